@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from metricas import metricas
+
+logger = logging.getLogger('Agendador')
+
+class PedidoDescartado(Exception):
+    """Pedido substituído por uma mensagem mais nova ou cancelado pelo usuário"""
+    def __init__(self, motivo: str):
+        super().__init__(motivo)
+        self.motivo = motivo
+
+class _Ticket:
+    def __init__(self, user_id: int, message_id: int, pedido, prioritario: bool):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.pedido = pedido
+        self.prioritario = prioritario
+        self.liberado = asyncio.get_running_loop().create_future()
+        self.enfileirado_em = time.monotonic()
+        self.iniciado_em = None
+        self.cancelado = False
+
+class Scheduler:
+    """Escalonador justo: uma fila por usuário, round-robin entre usuários e faixa prioritária"""
+    def __init__(self, worker, prioridade_ids=(), capacidade: int = 1, janela_metricas: int = 200):
+        self._worker = worker
+        self._prioridade_ids = set(prioridade_ids)
+        self._capacidade = capacidade
+
+        self._filas = OrderedDict()      # {user_id: deque[_Ticket]} na ordem do round-robin
+        self._prioritaria = deque()
+        self._por_mensagem = {}          # {message_id: _Ticket}
+        self._em_execucao = set()
+
+        # Métricas
+        self._esperas = deque(maxlen=janela_metricas)
+        self._contadores = {"atendidos": 0, "substituidos": 0, "cancelados": 0}
+
+    async def gerar(self, user_id: int, message_id: int, pedido):
+        """Aguarda a vez do usuário e produz os tokens gerados pelo worker"""
+        ticket = self._enfileirar(user_id, message_id, pedido)
+
+        try:
+            await ticket.liberado
+        except asyncio.CancelledError:
+            self._remover(ticket)
+            raise
+
+        try:
+            async for token in self._worker.gerar(pedido):
+                yield token
+        finally:
+            self._concluir(ticket)
+
+        if ticket.cancelado:
+            raise PedidoDescartado("cancelado")
+
+    def cancelar(self, message_id: int) -> bool:
+        """Cancela o pedido de uma mensagem apagada, esteja na fila ou em decodificação"""
+        ticket = self._por_mensagem.get(message_id)
+        if ticket is None:
+            return False
+
+        ticket.cancelado = True
+        self._contadores["cancelados"] += 1
+        metricas.incrementar("pedidos_total", ajuda="Pedidos por desfecho", desfecho="cancelado")
+        if ticket in self._em_execucao:
+            ticket.pedido.cancelar()
+        else:
+            self._descartar(ticket, "cancelado")
+        logger.info(f"🗑️ Pedido da mensagem {message_id} cancelado")
+        return True
+
+    def profundidade(self) -> int:
+        """Número de pedidos aguardando a vez"""
+        return len(self._prioritaria) + sum(len(fila) for fila in self._filas.values())
+
+    def estatisticas(self) -> dict:
+        """Profundidade da fila e tempos de espera recentes"""
+        esperas = sorted(self._esperas)
+        p95 = esperas[min(len(esperas) - 1, int(len(esperas) * 0.95))] if esperas else 0.0
+        return {
+            "profundidade": self.profundidade(),
+            "usuarios_na_fila": len(self._filas),
+            "em_execucao": len(self._em_execucao),
+            "espera_media": sum(esperas) / len(esperas) if esperas else 0.0,
+            "espera_p95": p95,
+            "espera_max": esperas[-1] if esperas else 0.0,
+            **self._contadores
+        }
+
+    def _enfileirar(self, user_id: int, message_id: int, pedido) -> _Ticket:
+        prioritario = user_id in self._prioridade_ids
+        ticket = _Ticket(user_id, message_id, pedido, prioritario)
+
+        # A mensagem mais nova substitui as que ainda aguardam na fila
+        fila_antiga = self._prioritaria if prioritario else self._filas.get(user_id, ())
+        for antigo in [t for t in fila_antiga if t.user_id == user_id]:
+            self._contadores["substituidos"] += 1
+            metricas.incrementar("pedidos_total", ajuda="Pedidos por desfecho", desfecho="substituido")
+            self._descartar(antigo, "substituido")
+
+        if prioritario:
+            self._prioritaria.append(ticket)
+        else:
+            self._filas.setdefault(user_id, deque()).append(ticket)
+        self._por_mensagem[message_id] = ticket
+
+        self._despachar()
+        return ticket
+
+    def _proximo(self):
+        if self._prioritaria:
+            return self._prioritaria.popleft()
+
+        if not self._filas:
+            return None
+
+        # Round-robin: atende o primeiro usuário e o move para o fim da fila
+        user_id, fila = next(iter(self._filas.items()))
+        ticket = fila.popleft()
+        if fila:
+            self._filas.move_to_end(user_id)
+        else:
+            del self._filas[user_id]
+        return ticket
+
+    def _despachar(self):
+        while len(self._em_execucao) < self._capacidade:
+            ticket = self._proximo()
+            if ticket is None:
+                return
+
+            ticket.iniciado_em = time.monotonic()
+            espera = ticket.iniciado_em - ticket.enfileirado_em
+            self._esperas.append(espera)
+            metricas.observar("espera_fila_segundos", espera, "Espera na fila até a geração começar")
+            metricas.incrementar("pedidos_total", ajuda="Pedidos por desfecho", desfecho="liberado")
+            self._em_execucao.add(ticket)
+            ticket.liberado.set_result(espera)
+            logger.info(f"🚦 Pedido de {ticket.user_id} liberado após {espera:.2f}s | Fila: {self.profundidade()}")
+
+    def _remover(self, ticket: _Ticket):
+        if ticket.prioritario:
+            if ticket in self._prioritaria:
+                self._prioritaria.remove(ticket)
+        else:
+            fila = self._filas.get(ticket.user_id)
+            if fila is not None and ticket in fila:
+                fila.remove(ticket)
+                if not fila:
+                    del self._filas[ticket.user_id]
+
+        if self._por_mensagem.get(ticket.message_id) is ticket:
+            del self._por_mensagem[ticket.message_id]
+
+        # Ticket já liberado mas abandonado antes de gerar
+        if ticket in self._em_execucao:
+            self._concluir(ticket)
+
+    def _descartar(self, ticket: _Ticket, motivo: str):
+        self._remover(ticket)
+        if not ticket.liberado.done():
+            ticket.liberado.set_exception(PedidoDescartado(motivo))
+
+    def _concluir(self, ticket: _Ticket):
+        self._em_execucao.discard(ticket)
+        if self._por_mensagem.get(ticket.message_id) is ticket:
+            del self._por_mensagem[ticket.message_id]
+        # Cancelado durante a geração já entrou em "cancelados"
+        if not ticket.cancelado:
+            self._contadores["atendidos"] += 1
+        self._despachar()
@@ -0,0 +1,281 @@
+"""Relatórios de latência e uso a partir dos logs de conversa.
+
+Uso:
+    python analitico.py                      # ingere as linhas novas e mostra o relatório
+    python analitico.py --desde 2025-06-01 --usuarios 20
+    python analitico.py --json relatorio.json
+
+Os logs do bot (conversas_*.jsonl) e da CLI (conversa_*.jsonl), inclusive as partes
+rotacionadas e comprimidas, são convertidos para colunas NumPy em logs/.analitico. Cada
+execução lê apenas as linhas novas (offsets por arquivo), então o relatório continua
+interativo com meses de histórico.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from registro_conversas import arquivos_de_log, linhas_novas
+
+logger = logging.getLogger('Analítico')
+
+# Colunas do cache e seus tipos
+COLUNAS = {
+    "ts": np.float64,               # Epoch (s)
+    "dia": np.int32,                # AAAAMMDD
+    "hora": np.int8,
+    "usuario": np.int32,            # Índice na lista "usuarios" de estado.json
+    "origem": np.int8,              # 0 = bot, 1 = CLI
+    "tempo_resposta": np.float32,   # NaN quando ausente
+    "valencia": np.float32,
+    "ativacao": np.float32,
+    "tamanho_entrada": np.int32,
+    "tamanho_resposta": np.int32
+}
+
+MAX_SEGMENTOS = 32
+
+class LogCache:
+    """Cache colunar dos logs em segmentos .npz, com ingestão incremental"""
+    def __init__(self, log_dir: str = "logs", cache_dir: str = None):
+        self.log_dir = log_dir
+        self.cache_dir = cache_dir or os.path.join(log_dir, ".analitico")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._estado_path = os.path.join(self.cache_dir, "estado.json")
+        try:
+            with open(self._estado_path, encoding="utf-8") as f:
+                self.estado = json.load(f)
+        except (OSError, ValueError):
+            self.estado = {"arquivos": {}, "assinaturas": {}, "usuarios": [], "nomes": {}, "segmentos": 0}
+        self._usuarios = {chave: i for i, chave in enumerate(self.estado["usuarios"])}
+
+    def ingerir(self) -> int:
+        """Lê apenas as linhas novas de cada log e grava um segmento com elas"""
+        linhas = {nome: [] for nome in COLUNAS}
+        arquivos = arquivos_de_log(self.log_dir)
+        for caminho in arquivos:
+            self._ingerir_arquivo(caminho, linhas)
+
+        # Arquivos renomeados na rotação: as assinaturas continuam valendo
+        for caminho in set(self.estado["arquivos"]) - set(arquivos):
+            del self.estado["arquivos"][caminho]
+
+        novas = len(linhas["ts"])
+        if novas:
+            indice = self.estado["segmentos"]
+            np.savez(
+                os.path.join(self.cache_dir, f"segmento_{indice:06d}.npz"),
+                **{nome: np.asarray(valores, dtype=COLUNAS[nome]) for nome, valores in linhas.items()}
+            )
+            self.estado["segmentos"] = indice + 1
+            if len(self._segmentos()) > MAX_SEGMENTOS:
+                self._compactar()
+
+        # Estado gravado depois dos dados: uma interrupção no meio só repete a ingestão
+        temporario = self._estado_path + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self.estado, f, ensure_ascii=False)
+        os.replace(temporario, self._estado_path)
+        return novas
+
+    def colunas(self) -> dict:
+        segmentos = [np.load(caminho) for caminho in self._segmentos()]
+        if not segmentos:
+            return {nome: np.empty(0, dtype=tipo) for nome, tipo in COLUNAS.items()}
+        return {nome: np.concatenate([s[nome] for s in segmentos]) for nome in COLUNAS}
+
+    def nome_usuario(self, indice: int) -> str:
+        chave = self.estado["usuarios"][indice]
+        return self.estado["nomes"].get(chave, chave)
+
+    def _segmentos(self) -> list:
+        return sorted(glob.glob(os.path.join(self.cache_dir, "segmento_*.npz")))
+
+    def _compactar(self):
+        """Junta todos os segmentos em um só"""
+        dados = self.colunas()
+        antigos = self._segmentos()
+        indice = self.estado["segmentos"]
+        np.savez(os.path.join(self.cache_dir, f"segmento_{indice:06d}.npz"), **dados)
+        self.estado["segmentos"] = indice + 1
+        for caminho in antigos:
+            os.remove(caminho)
+
+    def _ingerir_arquivo(self, caminho: str, linhas: dict):
+        for linha in linhas_novas(caminho, self.estado):
+            self._converter(linha, linhas)
+
+    def _converter(self, linha: bytes, linhas: dict):
+        try:
+            registro = json.loads(linha)
+            momento = datetime.fromisoformat(registro["timestamp"])
+        except (ValueError, KeyError, TypeError):
+            return
+
+        cli = "user_input" in registro
+        chave = "cli" if cli else str(registro.get("user_id"))
+        if chave not in self._usuarios:
+            self._usuarios[chave] = len(self.estado["usuarios"])
+            self.estado["usuarios"].append(chave)
+        if registro.get("username"):
+            self.estado["nomes"][chave] = registro["username"]
+
+        # Estado emocional: formato atual (valência/ativação) ou antigo (base/intensidade)
+        estado = registro.get("emotional_state") or registro.get("persona_state") or {}
+        valencia = estado.get("valencia", estado.get("base"))
+        ativacao = estado.get("ativacao", estado.get("intensidade"))
+        tempo = registro.get("response_time")
+
+        linhas["ts"].append(momento.timestamp())
+        linhas["dia"].append(momento.year * 10000 + momento.month * 100 + momento.day)
+        linhas["hora"].append(momento.hour)
+        linhas["usuario"].append(self._usuarios[chave])
+        linhas["origem"].append(1 if cli else 0)
+        linhas["tempo_resposta"].append(np.nan if tempo is None else tempo)
+        linhas["valencia"].append(np.nan if valencia is None else valencia)
+        linhas["ativacao"].append(np.nan if ativacao is None else ativacao)
+        linhas["tamanho_entrada"].append(len(registro.get("input") or registro.get("user_input") or ""))
+        linhas["tamanho_resposta"].append(len(registro.get("response") or ""))
+
+def percentis_por_grupo(grupos: np.ndarray, valores: np.ndarray, ps=(50, 95, 99)) -> tuple:
+    """Grupos distintos, contagens e percentis (interpolação linear) de cada grupo, sem laço Python"""
+    validos = ~np.isnan(valores)
+    grupos, valores = grupos[validos], valores[validos].astype(np.float64)
+    if not len(valores):
+        return np.empty(0, dtype=grupos.dtype), np.empty(0, dtype=np.int64), {p: np.empty(0) for p in ps}
+
+    ordem = np.lexsort((valores, grupos))
+    grupos, valores = grupos[ordem], valores[ordem]
+    unicos, inicios, contagens = np.unique(grupos, return_index=True, return_counts=True)
+
+    resultado = {}
+    for p in ps:
+        k = (contagens - 1) * p / 100
+        i = np.floor(k).astype(np.int64)
+        j = np.minimum(i + 1, contagens - 1)
+        baixo, alto = valores[inicios + i], valores[inicios + j]
+        resultado[p] = baixo + (alto - baixo) * (k - i)
+    return unicos, contagens, resultado
+
+def correlacao(x: np.ndarray, y: np.ndarray) -> tuple:
+    """Pearson entre duas colunas, ignorando NaN; devolve (r, n)"""
+    validos = ~(np.isnan(x) | np.isnan(y))
+    n = int(validos.sum())
+    if n < 3:
+        return float("nan"), n
+    x, y = x[validos].astype(np.float64), y[validos].astype(np.float64)
+    if x.std() == 0 or y.std() == 0:
+        return float("nan"), n
+    return float(np.corrcoef(x, y)[0, 1]), n
+
+def relatorio(cache: LogCache, desde: int = None, top_usuarios: int = 10) -> dict:
+    dados = cache.colunas()
+    if desde:
+        filtro = dados["dia"] >= desde
+        dados = {nome: coluna[filtro] for nome, coluna in dados.items()}
+
+    total = len(dados["ts"])
+    resultado = {"mensagens": total, "por_dia": [], "por_usuario": [], "por_hora": [], "correlacoes": {}}
+    if not total:
+        return resultado
+
+    tempos = dados["tempo_resposta"]
+
+    # Por dia: volume, taxa na janela ativa e percentis de latência
+    ordem = np.argsort(dados["dia"], kind="stable")
+    dias, inicios, contagens = np.unique(dados["dia"][ordem], return_index=True, return_counts=True)
+    ts_ordenado = dados["ts"][ordem]
+    duracoes = np.maximum.reduceat(ts_ordenado, inicios) - np.minimum.reduceat(ts_ordenado, inicios)
+    dias_lat, _, pct_dia = percentis_por_grupo(dados["dia"], tempos)
+    posicao = {int(d): i for i, d in enumerate(dias_lat)}
+    for dia, contagem, duracao in zip(dias, contagens, duracoes):
+        dia = int(dia)
+        horas_ativas = max(duracao / 3600, 1 / 60)
+        linha = {"dia": dia, "mensagens": int(contagem), "mensagens_hora": float(contagem / horas_ativas)}
+        if dia in posicao:
+            i = posicao[dia]
+            linha.update({f"p{p}": float(pct_dia[p][i]) for p in pct_dia})
+        resultado["por_dia"].append(linha)
+
+    # Por usuário: os mais ativos
+    usuarios, contagens = np.unique(dados["usuario"], return_counts=True)
+    usuarios_lat, _, pct_usuario = percentis_por_grupo(dados["usuario"], tempos)
+    posicao = {int(u): i for i, u in enumerate(usuarios_lat)}
+    for indice in np.argsort(-contagens)[:top_usuarios]:
+        usuario = int(usuarios[indice])
+        linha = {"usuario": cache.nome_usuario(usuario), "mensagens": int(contagens[indice])}
+        if usuario in posicao:
+            i = posicao[usuario]
+            linha.update({f"p{p}": float(pct_usuario[p][i]) for p in pct_usuario})
+        resultado["por_usuario"].append(linha)
+
+    # Distribuição por hora do dia
+    resultado["por_hora"] = np.bincount(dados["hora"].astype(np.int64), minlength=24).tolist()
+
+    # Estado emocional e tamanho das mensagens contra a latência
+    for coluna in ("valencia", "ativacao", "tamanho_entrada", "tamanho_resposta"):
+        r, n = correlacao(dados[coluna].astype(np.float64), tempos.astype(np.float64))
+        resultado["correlacoes"][coluna] = {"r": None if np.isnan(r) else r, "n": n}
+
+    return resultado
+
+def imprimir(resultado: dict):
+    print(f"\n📊 {resultado['mensagens']} mensagens")
+    if not resultado["mensagens"]:
+        return
+
+    print("\n📅 Por dia:")
+    for linha in resultado["por_dia"]:
+        latencia = f"p50 {linha['p50']:.2f}s | p95 {linha['p95']:.2f}s | p99 {linha['p99']:.2f}s" if "p50" in linha else "sem latência"
+        print(f"  {linha['dia']}: {linha['mensagens']} msgs ({linha['mensagens_hora']:.1f}/h ativa) | {latencia}")
+
+    print("\n👤 Usuários mais ativos:")
+    for linha in resultado["por_usuario"]:
+        latencia = f"p50 {linha['p50']:.2f}s | p95 {linha['p95']:.2f}s" if "p50" in linha else "sem latência"
+        print(f"  {linha['usuario']}: {linha['mensagens']} msgs | {latencia}")
+
+    print("\n🕐 Mensagens por hora do dia:")
+    pico = max(resultado["por_hora"]) or 1
+    for hora, contagem in enumerate(resultado["por_hora"]):
+        if contagem:
+            print(f"  {hora:02d}h {'█' * max(1, round(contagem / pico * 30))} {contagem}")
+
+    print("\n🔗 Correlação com o tempo de resposta (Pearson):")
+    for coluna, c in resultado["correlacoes"].items():
+        r = "n/d" if c["r"] is None else f"{c['r']:+.2f}"
+        print(f"  {coluna}: {r} (n={c['n']})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Relatórios de latência e uso a partir dos logs")
+    parser.add_argument("--logs", default="logs")
+    parser.add_argument("--cache", default=None, help="Diretório do cache colunar (padrão: <logs>/.analitico)")
+    parser.add_argument("--desde", default=None, help="Primeiro dia do relatório (AAAA-MM-DD)")
+    parser.add_argument("--usuarios", type=int, default=10, help="Quantidade de usuários listados")
+    parser.add_argument("--json", default=None, help="Grava o relatório neste arquivo JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s | %(message)s')
+
+    cache = LogCache(args.logs, args.cache)
+    inicio = time.perf_counter()
+    novas = cache.ingerir()
+    logger.info(f"📥 {novas} linhas novas ingeridas em {time.perf_counter() - inicio:.2f}s")
+
+    desde = int(args.desde.replace("-", "")) if args.desde else None
+    resultado = relatorio(cache, desde, args.usuarios)
+    imprimir(resultado)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\n📝 Relatório salvo em {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Calibração de n_threads, n_batch e quantização para a máquina atual.
+
+Uso: python autotune.py [--alvo 10] [--prompt-tokens 256] [--max-tokens 180]
+
+Mede prefill e decodificação (tokens/s) de cada GGUF em models/ e grava a melhor
+configuração em models/autotune.json, lida pelo registro de modelos em modelo.py.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+import psutil
+from llama_cpp import Llama
+
+from modelo import AUTOTUNE_PATH, PADROES_LLAMA
+
+logger = logging.getLogger('Autotune')
+
+def candidatos_threads() -> list:
+    fisicos = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    logicos = os.cpu_count() or fisicos
+    return sorted({max(1, fisicos // 2), max(1, fisicos - 1), fisicos, logicos})
+
+def medir(model: Llama, n_threads: int, prompt_tokens: int, decode_tokens: int) -> dict:
+    """Tokens/s de prefill e de decodificação para um número de threads"""
+    model._ctx.set_n_threads(n_threads, n_threads)
+
+    texto = "Astéria conversa sobre filosofia, lógica e o cotidiano. " * (prompt_tokens // 8 + 1)
+    tokens = model.tokenize(texto.encode("utf-8"))[:prompt_tokens]
+
+    model.reset()
+    start = time.perf_counter()
+    model.eval(tokens)
+    prefill = time.perf_counter() - start
+
+    # Decodificação: um token por avaliação, como na geração
+    token = tokens[-1]
+    start = time.perf_counter()
+    for _ in range(decode_tokens):
+        model.eval([token])
+    decode = time.perf_counter() - start
+
+    return {
+        "n_threads": n_threads,
+        "prefill_tps": len(tokens) / prefill,
+        "decode_tps": decode_tokens / decode
+    }
+
+def calibrar(arquivo: str, n_ctx: int, batches: list, prompt_tokens: int, decode_tokens: int) -> list:
+    resultados = []
+    for n_batch in batches:
+        params = {**PADROES_LLAMA, "model_path": arquivo, "n_ctx": n_ctx, "n_batch": n_batch}
+        model = Llama(**params)
+        for n_threads in candidatos_threads():
+            r = medir(model, n_threads, prompt_tokens, decode_tokens)
+            r.update(arquivo=arquivo, n_batch=n_batch)
+            logger.info(
+                f"{os.path.basename(arquivo)} | batch {n_batch} | {n_threads} threads | "
+                f"prefill {r['prefill_tps']:.1f} t/s | decode {r['decode_tps']:.1f} t/s"
+            )
+            resultados.append(r)
+        model.close()
+    return resultados
+
+def escolher(resultados: list, alvo: float, prompt_tokens: int, max_tokens: int) -> dict:
+    """Maior quantização que cumpre a latência alvo; sem nenhuma, a mais rápida"""
+    for r in resultados:
+        r["latencia_estimada"] = prompt_tokens / r["prefill_tps"] + max_tokens / r["decode_tps"]
+
+    # Melhor configuração de cada arquivo
+    por_arquivo = {}
+    for r in resultados:
+        atual = por_arquivo.get(r["arquivo"])
+        if atual is None or r["latencia_estimada"] < atual["latencia_estimada"]:
+            por_arquivo[r["arquivo"]] = r
+
+    # Tamanho do arquivo como aproximação de qualidade da quantização
+    dentro_do_alvo = [r for r in por_arquivo.values() if r["latencia_estimada"] <= alvo]
+    if dentro_do_alvo:
+        recomendado = max(dentro_do_alvo, key=lambda r: os.path.getsize(r["arquivo"]))
+    else:
+        recomendado = min(por_arquivo.values(), key=lambda r: r["latencia_estimada"])
+
+    return {
+        "recomendado": recomendado["arquivo"],
+        "por_arquivo": {
+            arquivo: {"n_threads": r["n_threads"], "n_batch": r["n_batch"],
+                      "latencia_estimada": r["latencia_estimada"]}
+            for arquivo, r in por_arquivo.items()
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra os modelos GGUF para esta máquina")
+    parser.add_argument("--modelos", default="models", help="Diretório com os arquivos .gguf")
+    parser.add_argument("--alvo", type=float, default=10.0, help="Latência alvo por resposta (s)")
+    parser.add_argument("--prompt-tokens", type=int, default=256)
+    parser.add_argument("--max-tokens", type=int, default=180)
+    parser.add_argument("--decode-tokens", type=int, default=32, help="Tokens decodificados por medição")
+    parser.add_argument("--batches", default="128,256,512")
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--saida", default=AUTOTUNE_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s | %(message)s')
+
+    # Caminhos normalizados ("./models" e "models/" viram "models/..."), como no modelos.json
+    arquivos = sorted(os.path.normpath(a) for a in glob.glob(os.path.join(args.modelos, "*.gguf")))
+    if not arquivos:
+        logger.error(f"Nenhum .gguf em {args.modelos}")
+        sys.exit(1)
+
+    batches = [int(b) for b in args.batches.split(",")]
+    resultados = []
+    for arquivo in arquivos:
+        resultados.extend(calibrar(arquivo, args.n_ctx, batches, args.prompt_tokens, args.decode_tokens))
+
+    escolha = escolher(resultados, args.alvo, args.prompt_tokens, args.max_tokens)
+    saida = {
+        "host": platform.node(),
+        "cpu": platform.processor() or platform.machine(),
+        "nucleos_fisicos": psutil.cpu_count(logical=False),
+        "alvo_s": args.alvo,
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **escolha,
+        "medicoes": resultados
+    }
+
+    os.makedirs(os.path.dirname(args.saida) or ".", exist_ok=True)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(saida, f, ensure_ascii=False, indent=2)
+
+    melhor = escolha["por_arquivo"][escolha["recomendado"]]
+    logger.info(
+        f"✅ Recomendado: {os.path.basename(escolha['recomendado'])} | {melhor['n_threads']} threads | "
+        f"batch {melhor['n_batch']} | ~{melhor['latencia_estimada']:.1f}s por resposta → {args.saida}"
+    )
+
+if __name__ == "__main__":
+    main()
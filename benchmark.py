@@ -0,0 +1,352 @@
+"""Benchmark de latência reproduzível a partir das conversas gravadas.
+
+Uso:
+    python benchmark.py                          # modelo real (perfil "bot" do registro)
+    python benchmark.py --stub --latencia-token 0.05
+    python benchmark.py --comparar benchmarks/base.json
+    python benchmark.py --especulativo lookup    # decodificação normal x especulativa
+
+Reenvia as entradas de logs/conversas_*.jsonl (bot) e logs/conversa_*.jsonl (CLI), inclusive
+as partes rotacionadas e comprimidas, pelo mesmo caminho do bot: prompt com histórico e
+lembranças de um MemoryIndex alimentado ao vivo, escalonador e InferenceWorker com cache de
+sessões (reaproveitamento de prefixo). Com --stub o modelo falso, sem estado KV, é chamado
+direto. Grava TTFT, tokens/s, percentis de ponta a ponta, prefixo reaproveitado e pico de RSS
+em JSON para comparação entre versões. Com --especulativo, as mesmas entradas rodam também
+com o rascunho no mesmo modelo carregado, e o resultado inclui a taxa de aceitação e o ganho
+em tokens/s.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+import prompts
+from agendador import Scheduler
+from cache import LRUCache
+from empacotador import PromptPacker
+from idioma import detector as detector_idioma
+from inferencia import GenerationRequest, InferenceWorker
+from memoria import MemoryIndex
+from persona import Asteria
+from registro_conversas import ler_registros
+
+logger = logging.getLogger('Benchmark')
+
+# Mesmos padrões do bot
+MAX_HISTORY = 20
+MAX_TOKENS = 180
+TEMPERATURE = 0.72
+STOP = ["\n", "###", "<|im_end|>"]
+MEMORIA_K = 3
+MEMORIA_CHARS = 400
+SESSION_CACHE_MB = 1024
+SESSION_CACHE_MAX = 64
+
+class StubModel:
+    """Modelo falso com latência configurável, para medir o overhead fora do LLM"""
+    def __init__(self, latencia_token: float = 0.05, latencia_prefill: float = 0.0005):
+        self.latencia_token = latencia_token
+        self.latencia_prefill = latencia_prefill
+
+    def n_ctx(self) -> int:
+        return 2048
+
+    def tokenize(self, texto: bytes, add_bos: bool = True, special: bool = False) -> list:
+        # ~4 bytes por token, como na estimativa do prefill
+        return list(range(int(add_bos) + (len(texto) + 3) // 4))
+
+    def detokenize(self, tokens: list) -> bytes:
+        return b"x" * 4 * len(tokens)
+
+    def create_completion(self, prompt, max_tokens=MAX_TOKENS, stream=True, resposta="", **kwargs):
+        # Prefill proporcional ao tamanho do prompt (~4 caracteres por token)
+        time.sleep(self.latencia_prefill * len(prompt) / 4)
+        palavras = (resposta or "ok " * 20).split()[:max_tokens]
+        for palavra in palavras:
+            time.sleep(self.latencia_token)
+            yield {'choices': [{'text': " " + palavra}]}
+
+def carregar_entradas(log_dir: str = "logs") -> list:
+    """Entradas gravadas nos dois formatos de log, em ordem de arquivo"""
+    entradas = []
+    for registro in ler_registros(log_dir):
+        texto = registro.get("input") or registro.get("user_input")
+        if texto:
+            entradas.append({
+                "user_id": registro.get("user_id", "cli"),
+                "input": texto,
+                "response": registro.get("response", "")
+            })
+    return entradas
+
+class MedidorRSS:
+    """Amostra o RSS do processo em segundo plano e guarda o pico"""
+    def __init__(self, intervalo: float = 0.05):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+    def _amostrar(self):
+        processo = psutil.Process()
+        while not self._parar.is_set():
+            self.pico = max(self.pico, processo.memory_info().rss)
+            self._parar.wait(self.intervalo)
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+def resumo(valores: list) -> dict:
+    return {
+        "media": sum(valores) / len(valores) if valores else 0.0,
+        "p50": percentil(valores, 50),
+        "p95": percentil(valores, 95),
+        "p99": percentil(valores, 99)
+    }
+
+def lembrancas_relevantes(memoria: MemoryIndex, historico: dict, user_id, content: str) -> str:
+    """Como no bot: trocas anteriores relevantes que ainda não estão no histórico recente"""
+    recentes = "\n".join(historico.get(user_id, []))
+    lembrancas = [
+        l for l in memoria.buscar(user_id, content, k=MEMORIA_K + MAX_HISTORY)
+        if l["entrada"] != content and f"Usuário: {l['entrada']}" not in recentes
+    ]
+    return prompts.bloco_memorias(lembrancas[:MEMORIA_K], MEMORIA_CHARS)
+
+async def gerar_direto(model, prompt: str, entrada: dict, numero: int):
+    """--stub: o modelo falso não tem estado KV, então a geração vai direto ao create_completion"""
+    stream = model.create_completion(
+        prompt, max_tokens=MAX_TOKENS, temperature=TEMPERATURE, stop=STOP, stream=True, resposta=entrada["response"]
+    )
+    for output in stream:
+        yield output['choices'][0]['text']
+
+def gerar_pelo_worker(scheduler: Scheduler):
+    """Geração pelo escalonador e pelo InferenceWorker, com a sessão do usuário como no bot"""
+    async def gerar(model, prompt: str, entrada: dict, numero: int):
+        pedido = GenerationRequest(
+            prompt, max_tokens=MAX_TOKENS, temperature=TEMPERATURE, stop=STOP, sessao=entrada["user_id"]
+        )
+        async for token in scheduler.gerar(entrada["user_id"], numero, pedido):
+            yield token
+    return gerar
+
+async def executar_turno(model, gerar, asteria: Asteria, historico: dict, memoria: MemoryIndex, entrada: dict,
+                         numero: int, empacotador: PromptPacker) -> dict:
+    """Um turno completo: idioma, persona, lembranças, prompt e geração em streaming"""
+    inicio = time.perf_counter()
+    user_id, content = entrada["user_id"], entrada["input"]
+
+    idioma = detector_idioma.detectar(content, user_id)
+    contexto_emocional = asteria.construir_resposta(content, user_id)
+    memorias = lembrancas_relevantes(memoria, historico, user_id, content)
+    prompt = prompts.montar_prompt(
+        prompts.instrucao_para(idioma),
+        "",
+        prompts.atualizar_historico(historico, user_id, f"Usuário: {content}", MAX_HISTORY),
+        contexto_emocional,
+        memorias,
+        empacotador=empacotador
+    )
+    pronto = time.perf_counter()
+
+    resposta, tokens, primeiro = "", 0, None
+    async for token in gerar(model, prompt, entrada, numero):
+        if primeiro is None:
+            primeiro = time.perf_counter()
+        resposta += token
+        tokens += 1  # Cada chunk do stream é um token
+    fim = time.perf_counter()
+
+    prompts.atualizar_historico(historico, user_id, f"Astéria: {resposta}", MAX_HISTORY)
+    memoria.indexar(user_id, content, resposta)
+
+    primeiro = primeiro or fim
+    return {
+        "overhead_prompt": pronto - inicio,
+        "ttft": primeiro - inicio,
+        "decode_tps": (tokens - 1) / (fim - primeiro) if tokens > 1 and fim > primeiro else 0.0,
+        "e2e": fim - inicio,
+        "tokens": tokens
+    }
+
+async def _executar_turnos(model, entradas: list, stub: bool, memoria: MemoryIndex) -> tuple:
+    """(turnos, prefixo): as medidas de cada turno e os tokens de prompt reaproveitados pelo worker"""
+    asteria = Asteria()
+    historico = {}
+    empacotador = PromptPacker(model, model.n_ctx() - MAX_TOKENS)
+
+    worker = None
+    if stub:
+        gerar = gerar_direto
+    else:
+        sessoes = LRUCache(capacidade=SESSION_CACHE_MAX, orcamento_bytes=SESSION_CACHE_MB * 1024 * 1024)
+        worker = InferenceWorker(lambda: model, sessoes=sessoes)
+        worker.iniciar()
+        gerar = gerar_pelo_worker(Scheduler(worker))
+
+    try:
+        turnos = [
+            await executar_turno(model, gerar, asteria, historico, memoria, entrada, numero, empacotador)
+            for numero, entrada in enumerate(entradas)
+        ]
+        return turnos, worker.prefixo if worker is not None else None
+    finally:
+        if worker is not None:
+            worker.parar()
+
+def executar(model, entradas: list, stub: bool) -> dict:
+    # Memória vazia a cada execução, alimentada pelos próprios turnos (a do bot não é tocada)
+    diretorio = tempfile.mkdtemp(prefix="asteria_benchmark_")
+    try:
+        with MedidorRSS() as rss:
+            turnos, prefixo = asyncio.run(_executar_turnos(model, entradas, stub, MemoryIndex(diretorio)))
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    return {
+        "turnos": len(turnos),
+        "tokens": sum(t["tokens"] for t in turnos),
+        "overhead_prompt": resumo([t["overhead_prompt"] for t in turnos]),
+        "ttft": resumo([t["ttft"] for t in turnos]),
+        "decode_tps": resumo([t["decode_tps"] for t in turnos if t["decode_tps"]]),
+        "e2e": resumo([t["e2e"] for t in turnos]),
+        "prefixo_reaproveitado": prefixo["reaproveitados"] / prefixo["tokens"] if prefixo and prefixo["tokens"] else None,
+        "pico_rss_mb": rss.pico / 1024 / 1024
+    }
+
+def executar_especulativo(model, entradas: list, perfil: str, modo: str) -> tuple:
+    """(normal, especulativo): as entradas sem rascunho e com o rascunho de `modo`, nos mesmos pesos"""
+    from especulativo import criar_rascunho, vocabulario_compativel
+    from modelo import registro
+
+    rascunho = criar_rascunho(registro.especulacao(perfil, modo))
+    if not vocabulario_compativel(model, rascunho):
+        raise ValueError(f"Rascunho com vocabulário diferente do modelo {perfil}")
+
+    configurado = model.draft_model
+    try:
+        model.draft_model = None
+        normal = executar(model, entradas, False)
+        model.draft_model = rascunho
+        especulativo = executar(model, entradas, False)
+    finally:
+        model.draft_model = configurado
+
+    base = normal["decode_tps"]["p50"]
+    especulativo.update(
+        modo=modo,
+        rascunho=rascunho.estatisticas(),
+        aceleracao=especulativo["decode_tps"]["p50"] / base if base else 0.0
+    )
+    return normal, especulativo
+
+def comparar(atual: dict, base: dict):
+    """Mostra a variação das métricas principais em relação a um resultado anterior"""
+    print(f"\n📊 Comparação com {base.get('data', 'base')}:")
+    for metrica in ("ttft", "e2e"):
+        for p in ("p50", "p95", "p99"):
+            a, b = atual[metrica][p], base[metrica][p]
+            delta = (a - b) / b * 100 if b else 0.0
+            print(f"  {metrica} {p}: {b:.3f}s → {a:.3f}s ({delta:+.1f}%)")
+    a, b = atual["decode_tps"]["p50"], base["decode_tps"]["p50"]
+    print(f"  decode p50: {b:.1f} → {a:.1f} t/s")
+    print(f"  pico RSS: {base['pico_rss_mb']:.0f} → {atual['pico_rss_mb']:.0f} MB")
+
+def imprimir(resultado: dict):
+    print(f"\n⏱️ {resultado['turnos']} turnos | {resultado['tokens']} tokens | modo {resultado['modo']}")
+    for metrica in ("overhead_prompt", "ttft", "e2e"):
+        r = resultado[metrica]
+        print(f"  {metrica}: p50 {r['p50']:.3f}s | p95 {r['p95']:.3f}s | p99 {r['p99']:.3f}s")
+    print(f"  decode: p50 {resultado['decode_tps']['p50']:.1f} t/s")
+    if resultado.get("prefixo_reaproveitado") is not None:
+        print(f"  prefixo reaproveitado: {resultado['prefixo_reaproveitado']:.0%} dos tokens de prompt")
+    print(f"  pico RSS: {resultado['pico_rss_mb']:.0f} MB")
+
+    especulativo = resultado.get("especulativo")
+    if especulativo:
+        r = especulativo["rascunho"]
+        print(f"\n🎯 Especulativo ({especulativo['modo']}):")
+        print(f"  aceitação: {r['taxa_aceitacao']:.1%} ({r['aceitos']}/{r['propostos']} tokens propostos)")
+        print(
+            f"  decode p50: {resultado['decode_tps']['p50']:.1f} → {especulativo['decode_tps']['p50']:.1f} t/s "
+            f"({especulativo['aceleracao']:.2f}x)"
+        )
+        print(f"  e2e p50: {resultado['e2e']['p50']:.3f}s → {especulativo['e2e']['p50']:.3f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latência com as conversas gravadas")
+    parser.add_argument("--logs", default="logs")
+    parser.add_argument("--stub", action="store_true", help="Usa o modelo falso (sem GGUF)")
+    parser.add_argument("--latencia-token", type=float, default=0.05)
+    parser.add_argument("--latencia-prefill", type=float, default=0.0005, help="Segundos por token de prompt")
+    parser.add_argument("--perfil", default="bot", help="Modelo/perfil do registro (modo real)")
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--saida", default=None, help="JSON de saída (padrão: benchmarks/<data>.json)")
+    parser.add_argument("--comparar", default=None, help="JSON de um resultado anterior")
+    parser.add_argument("--especulativo", choices=("lookup", "rascunho"), default=None,
+                        help="Compara a decodificação normal com a especulativa (modo real)")
+    args = parser.parse_args()
+    if args.stub and args.especulativo:
+        parser.error("--especulativo precisa do modelo real")
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s | %(message)s')
+
+    entradas = carregar_entradas(args.logs) * args.repeticoes
+    detector_idioma.carregar()
+    if not entradas:
+        logger.error(f"Nenhuma conversa encontrada em {args.logs}")
+        sys.exit(1)
+
+    if args.stub:
+        model = StubModel(args.latencia_token, args.latencia_prefill)
+    else:
+        from modelo import carregar_modelo
+        model = carregar_modelo(args.perfil)
+
+    if args.especulativo:
+        resultado, especulativo = executar_especulativo(model, entradas, args.perfil, args.especulativo)
+        resultado["especulativo"] = especulativo
+    else:
+        resultado = executar(model, entradas, args.stub)
+    resultado.update(
+        modo="stub" if args.stub else args.perfil,
+        data=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        latencia_token=args.latencia_token if args.stub else None
+    )
+    imprimir(resultado)
+
+    saida = args.saida or os.path.join("benchmarks", f"{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(saida) or ".", exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\n📝 Resultado salvo em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+
+if __name__ == "__main__":
+    main()
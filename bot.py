@@ -1,13 +1,27 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import asyncio
+import concurrent.futures
 import os
-from llama_cpp import Llama
 from persona import Asteria
+from modelo import registro
+from inferencia import InferenceWorker, GenerationRequest, com_complemento
+from lote import BatchEngine
+from pool import ModelPool
+from agendador import Scheduler, PedidoDescartado
+from cache import LRUCache
+from persistencia import PersonaStore
+from registro_conversas import ConversationLog
+from memoria import MemoryIndex, MEMORIA_DIR
+from empacotador import PromptPacker
+from edicoes import EditScheduler
+from idioma import detector as detector_idioma
+from metricas import metricas
 import time
-from langdetect import detect, LangDetectException
+import prompts
+import pesquisa
+from cache_pesquisa import cache_pesquisa
 import logging
-import json
 from datetime import datetime
 
 # Configuração de logging
@@ -21,140 +35,267 @@ logger = logging.getLogger('Astéria')
 # Configurações
 TOKEN = os.getenv("DISCORD_BOT_TOKEN") or "DISCORD_TOKEN_REMOVIDO"
 CRIADOR_ID = int(os.getenv("CRIADOR_ID", "766317071369109544"))
-MAX_HISTORY = 2
+MAX_HISTORY = int(os.getenv("ASTERIA_MAX_HISTORY", "20"))  # Mensagens guardadas; o empacotador decide quantas cabem
 MAX_TOKENS = 180
 TEMPERATURE = 0.72
 TIMEOUT_GENERATION = 20.0
-
-# Carregar modelo
-model = None
+SESSION_CACHE_MB = int(os.getenv("ASTERIA_SESSION_CACHE_MB", "1024"))
+SESSION_CACHE_MAX = int(os.getenv("ASTERIA_SESSION_CACHE_MAX", "64"))
+BATCH_SEQS = int(os.getenv("ASTERIA_BATCH_SEQS", "1"))  # >1 ativa a decodificação em lote
+POOL_WORKERS = int(os.getenv("ASTERIA_POOL_WORKERS", "1"))  # >1 ativa o pool de processos
+METRICS_PORT = int(os.getenv("ASTERIA_METRICS_PORT", "0"))  # Endpoint Prometheus local (0 = desligado)
+METRICS_FILE = os.getenv("ASTERIA_METRICS_FILE")             # Arquivo .prom regravado periodicamente
+IDLE_HOURS = float(os.getenv("ASTERIA_IDLE_HOURS", "6"))     # Usuários ociosos saem da memória (estado fica no disco)
+PESQUISA_ATIVA = os.getenv("ASTERIA_PESQUISA", "1") == "1"     # "pesquise X" responde com resultados da web
+PESQUISA_PRAZO = float(os.getenv("ASTERIA_PESQUISA_PRAZO", "3.0"))   # Depois disso a resposta segue sem resultados
+PESQUISA_TOKENS = int(os.getenv("ASTERIA_PESQUISA_TOKENS", "256"))   # Orçamento dos resultados no prompt
+MEMORIA_K = int(os.getenv("ASTERIA_MEMORIA_K", "3"))                  # Trocas anteriores recuperadas por mensagem (0 = desligado)
+MEMORIA_CHARS = int(os.getenv("ASTERIA_MEMORIA_CHARS", "400"))        # Orçamento das lembranças no prompt
+PROMPT_TOKENS = int(os.getenv("ASTERIA_PROMPT_TOKENS", "0"))          # Orçamento do prompt (0 = n_ctx - MAX_TOKENS)
+
+# Carregar modelo (variante do perfil "bot" em modelos.json)
 def load_model():
-    global model
-    if model is None:
-        logger.info("⏳ Carregando modelo de linguagem...")
-        model = Llama(
-            model_path="models/Nous-Hermes-2-Mistral-7B-DPO.Q3_K_M.gguf",
-            n_ctx=2048,
-            n_threads=8,
-            n_gpu_layers=40 if os.getenv('USE_GPU') == '1' else 0,
-            verbose=False
-        )
-        logger.info("✅ Modelo carregado com sucesso!")
-    return model
+    return registro.obter("bot")
+
+# Estados KV por usuário: a próxima mensagem só avalia os tokens novos do prompt
+session_cache = LRUCache(capacidade=SESSION_CACHE_MAX, orcamento_bytes=SESSION_CACHE_MB * 1024 * 1024)
+
+# Worker de inferência: a decodificação roda fora do event loop
+if POOL_WORKERS > 1:
+    # Processos com sua fatia de núcleos, mapeando o mesmo GGUF
+    inference_worker = ModelPool(
+        registro.parametros("bot"), n_processos=POOL_WORKERS, especulacao=registro.especulacao("bot")
+    )
+    concorrencia = POOL_WORKERS
+elif BATCH_SEQS > 1:
+    # Várias conversas no mesmo batch do llama.cpp, uma por seq_id (sem decodificação especulativa)
+    inference_worker = BatchEngine(
+        load_model, n_sequencias=BATCH_SEQS, n_ctx_sequencia=registro.parametros("bot")["n_ctx"]
+    )
+    concorrencia = BATCH_SEQS
+else:
+    inference_worker = InferenceWorker(load_model, sessoes=session_cache)
+    concorrencia = 1
+
+# Escalonador justo entre usuários, com prioridade para o criador
+scheduler = Scheduler(inference_worker, prioridade_ids={CRIADOR_ID}, capacidade=concorrencia)
+
+# Edições das respostas em streaming, coalescidas sob os limites de taxa do Discord
+editor = EditScheduler(
+    taxa_global=float(os.getenv("ASTERIA_DISCORD_TAXA", "40")),
+    intervalo_minimo=float(os.getenv("ASTERIA_EDIT_INTERVALO", "1.0"))
+)
 
 # Intents
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+class AsteriaBot(commands.Bot):
+    async def close(self):
+        # Conexões HTTP e cache da pesquisa fecham ainda dentro do event loop do bot
+        await pesquisa.encerrar()
+        await super().close()
+
+bot = AsteriaBot(command_prefix="!", intents=intents, help_command=None)
 asteria = Asteria()
 
-# Histórico em memória e sistema de logs
+# Estado da persona e histórico por usuário persistidos em segundo plano
+persona_db = PersonaStore()
+restauracoes = {}  # {user_id: Future} cargas em andamento
+
+# Histórico em memória e sistema de logs (gravado em segundo plano)
 user_history = {}
-message_logs = []
+conversas = ConversationLog("conversas_%Y%m%d.jsonl")
 
-def log_message(user_id: int, username: str, content: str, response: str = "", elapsed: float = 0):
+# Memória de longo prazo: trocas anteriores de cada usuário, indexadas a partir dos logs e ao vivo
+memoria = MemoryIndex(os.path.join(MEMORIA_DIR, "bot"))
+
+def log_message(user_id: int, username: str, content: str, response: str = "", elapsed: float = 0,
+                falha: bool = False):
     """Registra mensagem detalhada para análise"""
-    timestamp = datetime.now().isoformat()
-    entry = {
-        "timestamp": timestamp,
+    registro = {
+        "timestamp": datetime.now().isoformat(),
         "user_id": user_id,
         "username": username,
         "input": content,
         "response": response,
         "response_time": elapsed,
-        "emotional_state": asteria.estado_emocional.copy()
+        "emotional_state": asteria.estado_de(user_id)
     }
-    message_logs.append(entry)
+    if falha:
+        registro["falha"] = True  # Aviso de timeout/erro: a ingestão dos logs não o indexa
+    conversas.registrar(registro)
 
-    # Salva periodicamente em arquivo
-    if len(message_logs) >= 5:
-        save_logs_to_file()
+def atualizar_historico(user_id: int, mensagem: str):
+    """Mantém histórico conciso mas efetivo"""
+    return prompts.atualizar_historico(user_history, user_id, mensagem, MAX_HISTORY)
 
-def save_logs_to_file():
-    """Salva logs em arquivo JSON"""
-    if not message_logs:
+async def restaurar_usuario(user_id: int):
+    """Carrega o estado salvo na primeira mensagem do usuário após o reinício"""
+    if user_id in asteria.usuarios:
         return
 
+    tarefa = restauracoes.get(user_id)
+    if tarefa is None:
+        tarefa = restauracoes[user_id] = asyncio.ensure_future(asyncio.to_thread(persona_db.carregar, user_id))
+        tarefa.add_done_callback(lambda _: restauracoes.pop(user_id, None))
+
     try:
-        log_dir = "logs"
-        os.makedirs(log_dir, exist_ok=True)
-        filename = f"{log_dir}/conversas_{datetime.now().strftime('%Y%m%d')}.jsonl"
-
-        with open(filename, "a", encoding="utf-8") as f:
-            for entry in message_logs:
-                # Converte objetos datetime para string
-                entry["timestamp"] = entry["timestamp"]
-                if "ultima_atualizacao" in entry["emotional_state"]:
-                    entry["emotional_state"]["ultima_atualizacao"] = entry["emotional_state"]["ultima_atualizacao"].isoformat()
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-
-        message_logs.clear()
-        logger.info(f"📝 Logs salvos em {filename}")
+        with metricas.span("restauracao"):
+            dados = await tarefa
     except Exception as e:
-        logger.error(f"Erro ao salvar logs: {str(e)}")
+        logger.warning(f"⚠️ Falha ao restaurar estado de {user_id}: {str(e)}")
+        return
 
-def atualizar_historico(user_id: int, mensagem: str):
-    """Mantém histórico conciso mas efetivo"""
-    if user_id not in user_history:
-        user_history[user_id] = []
+    # Outra mensagem do mesmo usuário pode ter restaurado enquanto esperávamos
+    if dados is None or user_id in asteria.usuarios:
+        return
+    asteria.restaurar_usuario(user_id, dados["estado"], dados["historico_emocional"])
+    if dados["conversa"] and user_id not in user_history:
+        user_history[user_id] = dados["conversa"]
+    logger.info(f"💾 Estado de {user_id} restaurado")
+
+_empacotador = None
+
+def obter_empacotador() -> PromptPacker:
+    """Empacotador com o tokenizador do modelo do bot; o orçamento nunca passa do n_ctx"""
+    global _empacotador
+    if _empacotador is None:
+        orcamento = registro.parametros("bot")["n_ctx"] - MAX_TOKENS
+        if PROMPT_TOKENS > 0:
+            orcamento = min(orcamento, PROMPT_TOKENS)
+        _empacotador = PromptPacker(registro.tokenizador("bot"), orcamento)
+        logger.info(f"📦 Orçamento do prompt: {orcamento} tokens")
+    return _empacotador
+
+def lembrancas_relevantes(user_id: int, content: str) -> str:
+    """Trocas anteriores relevantes para a mensagem que ainda não estão no histórico recente"""
+    if MEMORIA_K <= 0:
+        return ""
+    recentes = "\n".join(user_history.get(user_id, []))
+    with metricas.span("memoria"):
+        lembrancas = [
+            l for l in memoria.buscar(user_id, content, k=MEMORIA_K + MAX_HISTORY)
+            if l["entrada"] != content and f"Usuário: {l['entrada']}" not in recentes
+        ]
+    return prompts.bloco_memorias(lembrancas[:MEMORIA_K], MEMORIA_CHARS)
 
-    user_history[user_id].append(mensagem)
+def persistir_usuario(user_id: int):
+    """Agenda a gravação do estado do usuário (write-behind)"""
+    persona_db.marcar(user_id, **asteria.exportar_usuario(user_id), conversa=list(user_history.get(user_id, [])))
 
-    # Mantém apenas as últimas mensagens
-    if len(user_history[user_id]) > MAX_HISTORY:
-        user_history[user_id] = user_history[user_id][-MAX_HISTORY:]
+async def pesquisar_para_prompt(termo: str, complemento: concurrent.futures.Future):
+    """Pesquisa web em paralelo ao prefill; fora do prazo, a resposta segue sem resultados"""
+    texto = ""
+    try:
+        with metricas.span("pesquisa"):
+            # O prazo vale para a busca e as páginas; páginas atrasadas entram com o snippet
+            resultados = await pesquisa.buscar_resultados(termo, prazo=PESQUISA_PRAZO)
+        texto = prompts.bloco_pesquisa(resultados)
+        logger.info(f"🔍 {len(resultados)} resultados para: {termo}")
+    except asyncio.TimeoutError:
+        logger.info(f"⌛ Pesquisa fora do prazo, respondendo sem resultados: {termo}")
+    except Exception as e:
+        logger.warning(f"⚠️ Falha na pesquisa: {str(e)}")
+    finally:
+        try:
+            complemento.set_result(texto)
+        except concurrent.futures.InvalidStateError:
+            pass  # Pedido já cancelado
+
+async def antecipar_prefill(prompt: str, message: discord.Message) -> bool:
+    """Worker único: avalia a parte estática do prompt em um pedido curto enquanto a busca roda.
+
+    A thread volta ao escalonador logo em seguida e o estado fica no cache de sessão para o
+    pedido com o prompt completo. False se o pedido foi substituído ou cancelado.
+    """
+    pedido = GenerationRequest(
+        prompt, max_tokens=0, temperature=TEMPERATURE, sessao=message.author.id, somente_prefill=True
+    )
+    try:
+        async for _ in scheduler.gerar(message.author.id, message.id, pedido):
+            pass
+    except PedidoDescartado as e:
+        logger.info(f"⏭️ Pedido descartado ({e.motivo}): {message.id}")
+        return False
+    except Exception as e:
+        # O pedido completo refaz o prefill do que faltar
+        logger.warning(f"⚠️ Falha no prefill antecipado: {str(e)}")
+    return True
 
-    return "\n".join(user_history[user_id])
+async def stream_response(prompt: str, message: discord.Message, complemento: concurrent.futures.Future = None):
+    """Gera e envia resposta com streaming.
 
-async def stream_response(prompt: str, message: discord.Message):
-    """Gera e envia resposta com streaming"""
-    model = load_model()
+    Devolve (texto, ok): em timeout ou erro o texto é o aviso enviado ao usuário e ok é False;
+    pedido descartado devolve (None, False).
+    """
     full_response = ""
-    last_update = time.time()
-    update_interval = 1.0  # Atualizar a cada 1 segundo
-    response_message = None
+    fluxo = editor.abrir(message)
 
     try:
-        stream = model.create_completion(
+        # Com complemento, `prompt` é só a parte estática: os resultados e o marcador de resposta vêm depois
+        pedido = GenerationRequest(
             prompt,
             max_tokens=MAX_TOKENS,
             temperature=TEMPERATURE,
             stop=["\n", "###", "<|im_end|>"],
-            stream=True
+            sessao=message.author.id,
+            complemento=complemento,
+            sufixo=prompts.MARCADOR_RESPOSTA if complemento is not None else "",
+            orcamento_complemento=PESQUISA_TOKENS,
+            prazo_complemento=PESQUISA_PRAZO + 1.0
         )
 
-        for output in stream:
-            token = output['choices'][0]['text']
+        # Os tokens chegam do worker sem bloquear o event loop; o editor decide quando enviar
+        async for token in scheduler.gerar(message.author.id, message.id, pedido):
             full_response += token
+            fluxo.atualizar(full_response)
 
-            # Envia/atualiza a mensagem periodicamente
-            if time.time() - last_update > update_interval:
-                if not response_message:
-                    response_message = await message.reply(full_response + "▌")
-                else:
-                    await response_message.edit(content=full_response + "▌")
-                last_update = time.time()
+        # Envia a resposta final (dividida em várias mensagens se passar de 2000 caracteres)
+        await fluxo.concluir(full_response)
+        return full_response, True
 
-        # Envia a resposta final
-        if response_message:
-            await response_message.edit(content=full_response)
-        else:
-            await message.reply(full_response)
-
-        return full_response
+    except PedidoDescartado as e:
+        logger.info(f"⏭️ Pedido descartado ({e.motivo}): {message.id}")
+        await fluxo.descartar()
+        return None, False
 
     except asyncio.TimeoutError:
         logger.warning("⏱️ Timeout na geração da resposta")
-        return "Parece que preciso de mais tempo para pensar nisso..."
+        await fluxo.descartar()
+        return "Parece que preciso de mais tempo para pensar nisso...", False
 
     except Exception as e:
         logger.error(f"🔴 Erro na geração: {str(e)}")
-        return "Sinto muito, encontrei uma dificuldade técnica. Podemos tentar novamente?"
+        metricas.erro("geracao")
+        await fluxo.descartar()
+        return "Sinto muito, encontrei uma dificuldade técnica. Podemos tentar novamente?", False
+
+@tasks.loop(minutes=5)
+async def manutencao_persona():
+    """Decaimento emocional e fadiga de todos os usuários em uma única operação vetorizada"""
+    asteria.manutencao()
+    await asyncio.to_thread(memoria.descarregar)
+
+    # Pesquisas e páginas além da validade máxima saem do disco
+    removidas = await asyncio.to_thread(cache_pesquisa.limpar_vencidos)
+    if removidas:
+        logger.info(f"🧹 {removidas} entradas vencidas removidas do cache de pesquisa")
+
+    # Usuários ociosos saem da memória; o estado continua no disco
+    ociosos = asteria.ociosos(IDLE_HOURS)
+    for user_id in ociosos:
+        persistir_usuario(user_id)
+        asteria.esquecer(user_id)
+        user_history.pop(user_id, None)
+    if ociosos:
+        logger.info(f"🧹 {len(ociosos)} usuários ociosos liberados da memória")
 
 @bot.event
 async def on_ready():
     logger.info(f"🤖 Conectada como {bot.user} (ID: {bot.user.id})")
+    if not manutencao_persona.is_running():
+        manutencao_persona.start()
     await bot.change_presence(activity=discord.Activity(
         type=discord.ActivityType.listening,
         name="mensagens e comandos"
@@ -172,11 +313,93 @@ async def ajuda(ctx):
     embed.add_field(name="!estado", value="Mostra meu estado emocional atual", inline=False)
     embed.add_field(name="!info", value="Mostra informações detalhadas sobre mim", inline=False)
     embed.add_field(name="!logs", value="Mostra últimos logs (apenas criador)", inline=False)
+    embed.add_field(name="!fila", value="Mostra a fila de geração de respostas", inline=False)
+    embed.add_field(name="!modelo", value="Mostra os modelos carregados", inline=False)
     embed.set_footer(text="Respostas em tempo real com streaming")
     await ctx.send(embed=embed)
 
+@bot.command()
+async def fila(ctx):
+    """Mostra profundidade da fila e tempos de espera"""
+    stats = scheduler.estatisticas()
+    embed = discord.Embed(title="🚦 Fila de geração", color=0x7289DA)
+    embed.add_field(name="Aguardando", value=f"{stats['profundidade']} ({stats['usuarios_na_fila']} usuários)")
+    embed.add_field(name="Em execução", value=str(stats['em_execucao']))
+    embed.add_field(name="Espera média", value=f"{stats['espera_media']:.2f}s")
+    embed.add_field(name="Espera p95", value=f"{stats['espera_p95']:.2f}s")
+    embed.add_field(name="Espera máx.", value=f"{stats['espera_max']:.2f}s")
+    embed.add_field(
+        name="Pedidos",
+        value=f"{stats['atendidos']} atendidos | {stats['substituidos']} substituídos | {stats['cancelados']} cancelados",
+        inline=False
+    )
+    edicoes = editor.estatisticas()
+    embed.add_field(
+        name="Edições no Discord",
+        value=(
+            f"{edicoes['streams']} streams | intervalo {edicoes['intervalo']:.1f}s | "
+            f"{edicoes['criadas']} mensagens | {edicoes['editadas']} edições | {edicoes['falhas']} falhas"
+        ),
+        inline=False
+    )
+    sessoes = session_cache.estatisticas()
+    prefixo = inference_worker.prefixo
+    embed.add_field(
+        name="Sessões KV",
+        value=(
+            f"{sessoes['itens']} em cache ({sessoes['bytes'] / 1024 / 1024:.0f} MB) | "
+            f"{sessoes['hits']} hits | {sessoes['misses']} misses | {sessoes['evicoes']} evicções"
+            + (
+                f"\nPrefixo reaproveitado: {prefixo['reaproveitados'] / prefixo['tokens']:.0%} "
+                f"de {prefixo['tokens']} tokens de prompt"
+                if prefixo["tokens"] else ""
+            )
+        ),
+        inline=False
+    )
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def modelo(ctx):
+    """Mostra tempo de carga e memória dos modelos carregados"""
+    embed = discord.Embed(title="🧠 Modelos carregados", color=0x7289DA)
+    for nome, m in registro.relatorio().items():
+        embed.add_field(
+            name=nome,
+            value=(
+                f"{os.path.basename(m['arquivo'])}\n"
+                f"Carga: {m['tempo_carga']:.1f}s | RSS: +{m['rss_mb']:.0f} MB | "
+                f"{m['n_threads']} threads | ctx {m['n_ctx']}"
+                + (
+                    f"\nEspeculativo ({m['rascunho']['modo']}): {m['rascunho']['taxa_aceitacao']:.0%} aceitos "
+                    f"de {m['rascunho']['propostos']} propostos"
+                    if "rascunho" in m else ""
+                )
+            ),
+            inline=False
+        )
+    # No pool os modelos e os rascunhos vivem nos processos de inferência
+    rascunho = inference_worker.estatisticas().get("rascunho") if isinstance(inference_worker, ModelPool) else None
+    if rascunho:
+        embed.add_field(
+            name=f"Pool ({POOL_WORKERS} processos)",
+            value=(
+                f"Especulativo ({rascunho['modo']}): {rascunho['taxa_aceitacao']:.0%} aceitos "
+                f"de {rascunho['propostos']} propostos"
+            ),
+            inline=False
+        )
+    if not embed.fields:
+        embed.description = "Nenhum modelo carregado neste processo."
+    await ctx.send(embed=embed)
+
 # ... (outros comandos mantidos como antes) ...
 
+@bot.event
+async def on_raw_message_delete(payload):
+    # Mensagem apagada: cancela a resposta na fila ou em decodificação
+    scheduler.cancelar(payload.message_id)
+
 @bot.event
 async def on_message(msg):
     start_time = time.time()
@@ -208,62 +431,109 @@ async def on_message(msg):
             await msg.reply("👋 Sim, estou aqui! Como posso ajudar?")
             return
 
-        # Detecção de idioma
-        idioma = "pt"
-        try:
-            if len(content) > 10:
-                idioma = detect(content)
-                logger.info(f"🌐 Idioma detectado: {idioma}")
-        except LangDetectException:
-            pass
+        # Estado salvo antes do reinício
+        await restaurar_usuario(user_id)
 
-        instrucao = {
-            "pt": "Você é Astéria. Responda em português de forma natural e concisa.",
-            "en": "You are Astéria. Reply in natural, concise English."
-        }.get(idioma[:2], "You are Astéria. Reply naturally in the user's language.")
+        # Detecção de idioma
+        with metricas.span("idioma"):
+            idioma = detector_idioma.detectar(content, user_id)
+        logger.info(f"🌐 Idioma detectado: {idioma}")
+        instrucao = prompts.instrucao_para(idioma)
 
         # Contexto emocional da persona
-        contexto_emocional = asteria.construir_resposta(content)
+        with metricas.span("persona"):
+            contexto_emocional = asteria.construir_resposta(content, user_id)
         logger.info(f"💭 Contexto emocional: {contexto_emocional}")
 
         # Nota especial para o criador
-        nota_criador = f"\nNota: Este usuário é meu criador, {msg.author.display_name}." if user_id == CRIADOR_ID else ""
+        nota_criador = prompts.nota_criador(msg.author.display_name) if user_id == CRIADOR_ID else ""
 
         # Construção do prompt eficiente
-        prompt_parts = [
-            instrucao,
-            nota_criador,
-            f"Contexto emocional: {contexto_emocional}",
-            atualizar_historico(user_id, f"Usuário: {content}"),
-            "Astéria:"
-        ]
-        prompt = "\n".join(filter(None, prompt_parts))
+        termo = prompts.termo_de_pesquisa(content) if PESQUISA_ATIVA else None
+        memorias = lembrancas_relevantes(user_id, content)
+        with metricas.span("prompt"):
+            empacotador = obter_empacotador()
+            partes = (
+                instrucao,
+                nota_criador,
+                atualizar_historico(user_id, f"Usuário: {content}"),
+                contexto_emocional,
+                memorias
+            )
+            if termo:
+                # O worker faz o prefill da parte estática enquanto a busca roda; os resultados têm orçamento próprio
+                reserva = PESQUISA_TOKENS + empacotador.contar(prompts.MARCADOR_RESPOSTA) + 2
+                prompt = prompts.montar_prefixo(*partes, empacotador, empacotador.orcamento - reserva)
+            else:
+                prompt = prompts.montar_prompt(*partes, empacotador)
+
+        complemento, busca = None, None
+        if termo:
+            complemento = concurrent.futures.Future()
+            busca = asyncio.create_task(pesquisar_para_prompt(termo, complemento))
 
         # Geração e envio da resposta com streaming
         async with msg.channel.typing():
-            resposta = await stream_response(prompt, msg)
+            try:
+                if busca is not None and concorrencia == 1:
+                    # Worker único: esperar a busca dentro dele pararia a fila de todos os usuários. O prefill
+                    # da parte estática roda como pedido próprio durante a busca e o prompt completo entra
+                    # na fila depois, com os resultados
+                    if not await antecipar_prefill(prompt, msg):
+                        return
+                    await busca
+                    prompt = com_complemento(
+                        empacotador.modelo, prompt, complemento.result(), PESQUISA_TOKENS, prompts.MARCADOR_RESPOSTA
+                    )
+                    complemento = None
+                resposta, ok = await stream_response(prompt, msg, complemento)
+            finally:
+                if busca is not None:
+                    busca.cancel()
+            if resposta is None:
+                return
             elapsed = time.time() - start_time
+            metricas.estagio("total", elapsed)
 
             # Log detalhado
-            log_message(user_id, str(msg.author), content, resposta, elapsed)
+            log_message(user_id, str(msg.author), content, resposta, elapsed, falha=not ok)
             logger.info(f"⏱️ TEMPO TOTAL: {elapsed:.2f}s | Resposta: {resposta[:80]}{'...' if len(resposta) > 80 else ''}")
 
+            # O aviso de falha foi só para o usuário: não entra no histórico, no estado salvo nem na memória
+            if not ok:
+                return
+
             # Atualizar histórico
             atualizar_historico(user_id, f"Astéria: {resposta}")
+            persistir_usuario(user_id)
+            memoria.indexar(user_id, content, resposta)
 
     except Exception as e:
         logger.exception(f"🔴 ERRO NO MESSAGE: {str(e)}")
+        metricas.erro("on_message")
         await msg.reply("❌ Ocorreu um erro inesperado. Por favor, tente novamente.")
 
-# Salvar logs ao sair
 @bot.event
 async def on_disconnect():
-    save_logs_to_file()
-    logger.info("🔌 Desconectado. Logs salvos.")
+    logger.info("🔌 Desconectado.")
 
 if __name__ == "__main__":
     try:
-        load_model()  # Pré-carrega o modelo
+        if POOL_WORKERS <= 1:
+            load_model()  # Pré-carrega o modelo
+        obter_empacotador()  # Tokenizador (no pool, só o vocabulário) pronto antes da primeira mensagem
+        detector_idioma.carregar()  # Perfis de idioma carregados antes da primeira mensagem
+        inference_worker.iniciar()
+        persona_db.iniciar()
+        conversas.iniciar()
+        memoria.iniciar(conversas.diretorio)  # Ingere em segundo plano os logs ainda não indexados
+        if METRICS_PORT:
+            metricas.iniciar_servidor(METRICS_PORT)
+        if METRICS_FILE:
+            metricas.gravar_periodicamente(METRICS_FILE)
         bot.run(TOKEN)
     finally:
-        save_logs_to_file()  # Garante salvamento final
+        inference_worker.parar()
+        persona_db.fechar()
+        conversas.fechar()  # Drena a fila de logs
+        memoria.fechar()
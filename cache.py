@@ -0,0 +1,163 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """Cache LRU limitado por número de itens e, opcionalmente, por bytes"""
+    def __init__(self, capacidade: int = 128, orcamento_bytes: int = None):
+        self.capacidade = capacidade
+        self.orcamento_bytes = orcamento_bytes
+        self._itens = OrderedDict()  # {chave: (valor, tamanho)}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicoes = 0
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.misses += 1
+                return padrao
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return item[0]
+
+    def put(self, chave, valor, tamanho: int = 0):
+        with self._lock:
+            antigo = self._itens.pop(chave, None)
+            if antigo is not None:
+                self._bytes -= antigo[1]
+
+            # Item maior que o orçamento inteiro não é armazenado
+            if self.orcamento_bytes is not None and tamanho > self.orcamento_bytes:
+                return
+
+            self._itens[chave] = (valor, tamanho)
+            self._bytes += tamanho
+            self._evitar_excesso()
+
+    def pop(self, chave, padrao=None):
+        with self._lock:
+            item = self._itens.pop(chave, None)
+            if item is None:
+                return padrao
+            self._bytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def chaves(self) -> list:
+        with self._lock:
+            return list(self._itens)
+
+    def __contains__(self, chave) -> bool:
+        return chave in self._itens
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    @property
+    def bytes_usados(self) -> int:
+        return self._bytes
+
+    def taxa_acerto(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def estatisticas(self) -> dict:
+        return {
+            "itens": len(self._itens),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicoes": self.evicoes,
+            "taxa_acerto": self.taxa_acerto()
+        }
+
+    def _evitar_excesso(self):
+        while self._itens and (
+            len(self._itens) > self.capacidade
+            or (self.orcamento_bytes is not None and self._bytes > self.orcamento_bytes)
+        ):
+            _, (_, tamanho) = self._itens.popitem(last=False)
+            self._bytes -= tamanho
+            self.evicoes += 1
+
+class PromptCache:
+    """Cache de respostas recentes e de estados de prefixo do prompt"""
+    # Só um prefixo vivo que cobre esta parte do prompt conta como acerto
+    FRACAO_VIVA_MINIMA = 0.5
+
+    def __init__(self, capacidade: int = 10, orcamento_bytes: int = None):
+        self.respostas = LRUCache(capacidade)
+        self.prefixos = LRUCache(capacidade, orcamento_bytes)
+        self.prefixo_hits = 0
+        self.prefixo_misses = 0
+
+    @staticmethod
+    def normalizar(texto: str) -> str:
+        """Normaliza a entrada para que turnos quase idênticos compartilhem a chave"""
+        texto = re.sub(r'\s+', ' ', texto.lower()).strip()
+        return texto.rstrip('!?.… ')
+
+    @classmethod
+    def chave(cls, entrada: str, *contexto) -> str:
+        """Chave da resposta: a entrada normalizada mais um contexto pequeno e estável (ex.: última troca e tom).
+
+        O prompt inteiro muda a cada turno (histórico rolante, números da persona) e nunca se repetiria.
+        """
+        partes = [cls.normalizar(entrada), *(str(c) for c in contexto)]
+        return hashlib.blake2b("\x1f".join(partes).encode("utf-8"), digest_size=16).hexdigest()
+
+    def resposta(self, chave: str):
+        return self.respostas.get(chave)
+
+    def guardar_resposta(self, chave: str, resposta: str):
+        self.respostas.put(chave, resposta, len(resposta))
+
+    def melhor_prefixo(self, prompt: str, minimo: int = 0, fracao_viva: float = 0.0):
+        """Estado salvo com o maior prefixo em comum com o prompt, se superar `minimo` caracteres.
+
+        `minimo` é o prefixo já presente no estado vivo do modelo e `fracao_viva` a parte dos tokens
+        do prompt que ele cobre. É hit carregar um estado salvo ou o estado vivo cobrir ao menos
+        `FRACAO_VIVA_MINIMA` do prompt; qualquer outra consulta é miss.
+        """
+        melhor_chave, melhor_len = None, minimo
+        for chave in self.prefixos.chaves():
+            comum = len(os.path.commonprefix([chave, prompt]))
+            if comum > melhor_len:
+                melhor_chave, melhor_len = chave, comum
+
+        estado = self.prefixos.get(melhor_chave) if melhor_chave is not None else None
+        if estado is not None or fracao_viva >= self.FRACAO_VIVA_MINIMA:
+            self.prefixo_hits += 1
+        else:
+            self.prefixo_misses += 1
+        return estado
+
+    def guardar_prefixo(self, prompt: str, estado, tamanho: int = 0):
+        self.prefixos.put(prompt, estado, tamanho)
+
+    def clear(self):
+        self.respostas.clear()
+        self.prefixos.clear()
+
+    def estatisticas(self) -> dict:
+        total_prefixos = self.prefixo_hits + self.prefixo_misses
+        return {
+            "respostas": self.respostas.estatisticas(),
+            "prefixos": {
+                **self.prefixos.estatisticas(),
+                "hits": self.prefixo_hits,
+                "misses": self.prefixo_misses,
+                "taxa_acerto": self.prefixo_hits / total_prefixos if total_prefixos else 0.0
+            }
+        }
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from cache import LRUCache
+
+logger = logging.getLogger('CachePesquisa')
+
+CACHE_PATH = os.getenv("ASTERIA_PESQUISA_CACHE", "data/pesquisa.db")
+
+# Validade (s) de cada tipo de entrada; depois disso só serve como reserva em timeout
+TTLS = {
+    "busca": 3600,        # Resultados do DuckDuckGo
+    "pagina": 24 * 3600   # Conteúdo extraído de uma página
+}
+VALIDADE_MAXIMA = 7 * 24 * 3600
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS entradas (
+    chave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL,
+    gravado_em REAL NOT NULL
+)
+"""
+
+class SearchCache:
+    """Cache de pesquisa em dois níveis (LRU em memória + SQLite) com deduplicação de pedidos em voo"""
+    def __init__(self, caminho: str = CACHE_PATH, capacidade: int = 512, ttls: dict = None,
+                 validade_maxima: float = VALIDADE_MAXIMA):
+        self.caminho = caminho
+        self.ttls = {**TTLS, **(ttls or {})}
+        self.validade_maxima = validade_maxima
+        self.memoria = LRUCache(capacidade=capacidade)  # {chave: (valor, gravado_em)}
+        self._em_voo = {}  # {chave: Task}
+        self._conexao = None
+        self._lock = threading.Lock()
+        self._contadores = {"frescos": 0, "vencidos": 0, "compartilhados": 0, "buscas": 0}
+
+    async def obter(self, tipo: str, chave: str, vencido: bool = False):
+        """Valor dentro da validade do tipo; com `vencido=True`, qualquer valor ainda guardado"""
+        chave = f"{tipo}:{chave}"
+        item = self.memoria.get(chave)
+        if item is None:
+            item = await asyncio.to_thread(self._ler_disco, chave)
+            if item is not None:
+                self.memoria.put(chave, item)
+        if item is None:
+            return None
+
+        valor, gravado_em = item
+        idade = time.time() - gravado_em
+        if idade <= self.ttls[tipo]:
+            self._contadores["frescos"] += 1
+            return valor
+        if vencido and idade <= self.validade_maxima:
+            self._contadores["vencidos"] += 1
+            return valor
+        return None
+
+    async def guardar(self, tipo: str, chave: str, valor):
+        chave = f"{tipo}:{chave}"
+        item = (valor, time.time())
+        self.memoria.put(chave, item)
+        await asyncio.to_thread(self._gravar_disco, chave, item)
+
+    async def buscar(self, tipo: str, chave: str, produtor):
+        """Valor fresco do cache ou do `produtor` (coroutine factory); pedidos iguais em voo compartilham a busca.
+
+        O produtor roda na sua própria task: cancelar quem espera (inclusive quem iniciou a busca)
+        não cancela a busca dos outros. O produtor pode devolver None para não guardar o resultado
+        (ex.: falha parcial).
+        """
+        valor = await self.obter(tipo, chave)
+        if valor is not None:
+            return valor
+
+        chave_voo = f"{tipo}:{chave}"
+        tarefa = self._em_voo.get(chave_voo)
+        if tarefa is not None:
+            self._contadores["compartilhados"] += 1
+        else:
+            self._contadores["buscas"] += 1
+            tarefa = asyncio.ensure_future(self._produzir(tipo, chave, produtor))
+            self._em_voo[chave_voo] = tarefa
+            tarefa.add_done_callback(lambda t: self._concluir(chave_voo, t))
+        return await asyncio.shield(tarefa)
+
+    async def _produzir(self, tipo: str, chave: str, produtor):
+        valor = await produtor()
+        if valor is not None:
+            await self.guardar(tipo, chave, valor)
+        return valor
+
+    def _concluir(self, chave_voo: str, tarefa: asyncio.Task):
+        if self._em_voo.get(chave_voo) is tarefa:
+            del self._em_voo[chave_voo]
+        # Evita "exception was never retrieved" quando ninguém mais esperava
+        if not tarefa.cancelled():
+            tarefa.exception()
+
+    def estatisticas(self) -> dict:
+        return {**self._contadores, "memoria": self.memoria.estatisticas()}
+
+    def limpar_vencidos(self) -> int:
+        """Remove do disco entradas além da validade máxima"""
+        with self._lock:
+            conexao = self._conectar()
+            cursor = conexao.execute("DELETE FROM entradas WHERE gravado_em < ?", (time.time() - self.validade_maxima,))
+            conexao.commit()
+            return cursor.rowcount
+
+    def fechar(self):
+        with self._lock:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
+
+    def _conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+            self._conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao.execute(_ESQUEMA)
+        return self._conexao
+
+    def _ler_disco(self, chave: str):
+        try:
+            with self._lock:
+                linha = self._conectar().execute(
+                    "SELECT valor, gravado_em FROM entradas WHERE chave = ?", (chave,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Falha ao ler cache de pesquisa: {str(e)}")
+            return None
+        if linha is None:
+            return None
+        return json.loads(linha[0]), linha[1]
+
+    def _gravar_disco(self, chave: str, item: tuple):
+        valor, gravado_em = item
+        try:
+            with self._lock:
+                conexao = self._conectar()
+                conexao.execute(
+                    "INSERT OR REPLACE INTO entradas (chave, valor, gravado_em) VALUES (?, ?, ?)",
+                    (chave, json.dumps(valor, ensure_ascii=False), gravado_em)
+                )
+                conexao.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Falha ao gravar cache de pesquisa: {str(e)}")
+
+def normalizar_consulta(termo: str) -> str:
+    """Minúsculas, sem pontuação nas pontas e com espaços únicos"""
+    return re.sub(r"\s+", " ", termo.lower()).strip(" \t?!.,;:")
+
+def normalizar_url(url: str) -> str:
+    """Esquema e host em minúsculas, sem fragmento, sem parâmetros de rastreamento e com a query ordenada"""
+    partes = urlsplit(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(partes.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in ("fbclid", "gclid")
+    )
+    caminho = partes.path.rstrip("/") or "/"
+    return urlunsplit((partes.scheme.lower(), partes.netloc.lower(), caminho, urlencode(query), ""))
+
+# Cache compartilhado pela pesquisa web
+cache_pesquisa = SearchCache()
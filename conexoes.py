@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+import aiohttp
+
+logger = logging.getLogger('Conexões')
+
+# Cabeçalhos de um navegador comum: alguns sites recusam o "Mozilla/5.0" puro
+CABECALHOS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.5",
+    "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
+    "Accept-Encoding": "gzip, deflate"
+}
+
+class RespostaLimitada:
+    """Corpo lido até o limite de bytes"""
+    def __init__(self, url: str, status: int, corpo: bytes, charset: str, truncado: bool):
+        self.url = url
+        self.status = status
+        self.corpo = corpo
+        self.charset = charset or "utf-8"
+        self.truncado = truncado
+
+    def texto(self) -> str:
+        return self.corpo.decode(self.charset, errors="replace")
+
+class SessionManager:
+    """Sessão aiohttp única do processo: conexões keep-alive, limite por host e cache de DNS"""
+    def __init__(self, limite: int = 32, limite_por_host: int = 4, ttl_dns: int = 300,
+                 keepalive: float = 30.0, max_bytes: int = 512 * 1024, cabecalhos: dict = None):
+        self.limite = limite
+        self.limite_por_host = limite_por_host
+        self.ttl_dns = ttl_dns
+        self.keepalive = keepalive
+        self.max_bytes = max_bytes
+        self.cabecalhos = {**CABECALHOS, **(cabecalhos or {})}
+        self._sessao = None
+        self._lock = None
+
+    async def sessao(self) -> aiohttp.ClientSession:
+        """Sessão compartilhada, criada no event loop em execução na primeira chamada"""
+        if self._sessao is not None and not self._sessao.closed:
+            return self._sessao
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._sessao is None or self._sessao.closed:
+                conector = aiohttp.TCPConnector(
+                    limit=self.limite,
+                    limit_per_host=self.limite_por_host,
+                    use_dns_cache=True,
+                    ttl_dns_cache=self.ttl_dns,
+                    keepalive_timeout=self.keepalive,
+                    enable_cleanup_closed=True
+                )
+                self._sessao = aiohttp.ClientSession(connector=conector, headers=self.cabecalhos)
+                logger.info("🔌 Sessão HTTP compartilhada criada")
+        return self._sessao
+
+    async def buscar(self, url: str, timeout: float = 1.5, max_bytes: int = None,
+                     tipos=("text/html", "application/xhtml+xml"), consumidor=None) -> RespostaLimitada:
+        """GET lendo no máximo `max_bytes` do corpo; o restante é descartado sem ser baixado.
+
+        Com `consumidor` (async, recebe cada pedaço e o charset e devolve True para parar),
+        o corpo é entregue em pedaços em vez de acumulado.
+        """
+        limite = max_bytes or self.max_bytes
+        sessao = await self.sessao()
+        async with sessao.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resposta:
+            if resposta.status != 200 or (tipos and resposta.content_type not in tipos):
+                return RespostaLimitada(str(resposta.url), resposta.status, b"", resposta.charset, False)
+
+            partes, lidos = [], 0
+            async for pedaco in resposta.content.iter_chunked(16 * 1024):
+                pedaco = pedaco[:limite - lidos]
+                lidos += len(pedaco)
+                parar = lidos >= limite
+                if consumidor is None:
+                    partes.append(pedaco)
+                elif await consumidor(pedaco, resposta.charset):
+                    parar = True
+                if parar:
+                    # Fecha a conexão em vez de baixar o resto do corpo
+                    resposta.close()
+                    return RespostaLimitada(str(resposta.url), resposta.status, b"".join(partes), resposta.charset, True)
+            return RespostaLimitada(str(resposta.url), resposta.status, b"".join(partes), resposta.charset, False)
+
+    async def fechar(self):
+        """Fecha a sessão e aguarda o encerramento das conexões"""
+        if self._sessao is not None and not self._sessao.closed:
+            await self._sessao.close()
+            # Dá tempo para o fechamento das conexões TLS (recomendação do aiohttp)
+            await asyncio.sleep(0.25)
+        self._sessao = None
+
+# Sessão compartilhada pela pesquisa web
+gerenciador = SessionManager()
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from metricas import metricas
+
+logger = logging.getLogger('Edições')
+
+LIMITE_MENSAGEM = 2000
+CURSOR = "▌"
+
+class _Balde:
+    """Token bucket: `taxa` requisições por segundo com rajada de até `capacidade`"""
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.fichas = capacidade
+        self.atualizado = time.monotonic()
+
+    def disponivel(self, agora: float) -> bool:
+        self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        return self.fichas >= 1
+
+    def consumir(self):
+        self.fichas -= 1
+
+class EditStream:
+    """Resposta em streaming: guarda só o texto mais recente, enviado pelo EditScheduler"""
+    def __init__(self, editor, origem):
+        self._editor = editor
+        self.origem = origem
+        self.canal = origem.channel.id
+        self.texto = ""
+        self.final = False
+        self.descartado = False
+        self.mensagens = []   # Mensagens já criadas (uma por parte de até 2000 caracteres)
+        self.enviados = []    # Conteúdo atual de cada mensagem
+        self.em_voo = False
+        self.falhas = 0
+        self.ultimo_envio = time.monotonic()
+        self.concluido = asyncio.get_running_loop().create_future()
+
+    def atualizar(self, texto: str):
+        """Substitui o texto pendente; não espera o Discord"""
+        self.texto = texto
+        self._editor._acordar.set()
+
+    async def concluir(self, texto: str):
+        """Envia o texto final (sem cursor) e aguarda todas as partes chegarem"""
+        self.texto = texto
+        self.final = True
+        self._editor._acordar.set()
+        return await asyncio.shield(self.concluido)
+
+    async def descartar(self):
+        """Apaga o que já foi enviado e deixa de agendar edições"""
+        self.descartado = True
+        self._editor._remover(self)
+        for mensagem in self.mensagens:
+            try:
+                await mensagem.delete()
+            except Exception:
+                pass
+
+    def conteudos(self) -> list:
+        partes = dividir(self.texto or ("…" if self.final else ""), LIMITE_MENSAGEM - len(CURSOR))
+        if partes and not self.final:
+            partes[-1] += CURSOR
+        return partes
+
+    def proxima_operacao(self):
+        """(índice, conteúdo) da próxima mensagem a criar ou editar, ou None se está em dia"""
+        for i, conteudo in enumerate(self.conteudos()):
+            if i >= len(self.enviados) or self.enviados[i] != conteudo:
+                return i, conteudo
+        return None
+
+class EditScheduler:
+    """Agenda as edições de todas as respostas sob os limites do Discord, sem bloquear a geração"""
+    def __init__(self, taxa_global: float = 40.0, taxa_canal: float = 1.0, rajada_canal: float = 5.0,
+                 intervalo_minimo: float = 1.0, tick: float = 0.05):
+        self.taxa_global = taxa_global
+        self.taxa_canal = taxa_canal
+        self.intervalo_minimo = intervalo_minimo
+        self.tick = tick
+        self._global = _Balde(taxa_global, taxa_global)
+        self._canais = defaultdict(lambda: _Balde(taxa_canal, rajada_canal))
+        self._streams = []
+        self._acordar = asyncio.Event()
+        self._tarefa = None
+        self._contadores = {"criadas": 0, "editadas": 0, "falhas": 0}
+
+    def abrir(self, origem) -> EditStream:
+        """Novo stream respondendo à mensagem `origem`"""
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = asyncio.get_running_loop().create_task(self._despachar())
+        stream = EditStream(self, origem)
+        self._streams.append(stream)
+        return stream
+
+    def intervalo(self, stream: EditStream) -> float:
+        """Intervalo entre edições de um stream, ajustado ao número de streams ativos"""
+        no_canal = sum(1 for s in self._streams if s.canal == stream.canal)
+        return max(self.intervalo_minimo, no_canal / self.taxa_canal, len(self._streams) / self.taxa_global)
+
+    def estatisticas(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "intervalo": max((self.intervalo(s) for s in self._streams), default=self.intervalo_minimo),
+            **self._contadores
+        }
+
+    async def _despachar(self):
+        while True:
+            if not self._streams:
+                self._acordar.clear()
+                await self._acordar.wait()
+            await asyncio.sleep(self.tick)
+
+            agora = time.monotonic()
+            # Finais primeiro, depois quem está há mais tempo sem atualização
+            for stream in sorted(self._streams, key=lambda s: (not s.final, s.ultimo_envio)):
+                if stream.em_voo or stream.descartado:
+                    continue
+                operacao = stream.proxima_operacao()
+                if operacao is None:
+                    if stream.final:
+                        self._finalizar(stream)
+                    continue
+                if not stream.final and agora - stream.ultimo_envio < self.intervalo(stream):
+                    continue
+
+                canal = self._canais[stream.canal]
+                if not self._global.disponivel(agora):
+                    break
+                if not canal.disponivel(agora):
+                    continue
+                self._global.consumir()
+                canal.consumir()
+
+                stream.em_voo = True
+                asyncio.get_running_loop().create_task(self._enviar(stream, *operacao))
+
+    async def _enviar(self, stream: EditStream, indice: int, conteudo: str):
+        try:
+            if indice >= len(stream.mensagens):
+                with metricas.span("discord_reply"):
+                    if indice == 0:
+                        mensagem = await stream.origem.reply(conteudo)
+                    else:
+                        mensagem = await stream.origem.channel.send(conteudo)
+                stream.mensagens.append(mensagem)
+                stream.enviados.append(conteudo)
+                self._contadores["criadas"] += 1
+                if stream.descartado:
+                    await mensagem.delete()
+            else:
+                with metricas.span("discord_edit"):
+                    await stream.mensagens[indice].edit(content=conteudo)
+                stream.enviados[indice] = conteudo
+                self._contadores["editadas"] += 1
+            stream.falhas = 0
+        except Exception as e:
+            stream.falhas += 1
+            self._contadores["falhas"] += 1
+            logger.warning(f"⚠️ Falha ao enviar parte da resposta: {str(e)}")
+            if stream.falhas >= 3:
+                self._finalizar(stream, e)
+        finally:
+            stream.em_voo = False
+            stream.ultimo_envio = time.monotonic()
+            self._acordar.set()
+
+    def _finalizar(self, stream: EditStream, erro: Exception = None):
+        self._remover(stream)
+        if not stream.concluido.done():
+            if erro is None:
+                stream.concluido.set_result(stream.mensagens)
+            else:
+                stream.concluido.set_exception(erro)
+
+    def _remover(self, stream: EditStream):
+        if stream in self._streams:
+            self._streams.remove(stream)
+        if not stream.concluido.done() and stream.descartado:
+            stream.concluido.cancel()
+
+def dividir(texto: str, limite: int = LIMITE_MENSAGEM) -> list:
+    """Partes de até `limite` caracteres, quebrando em linha ou espaço quando possível"""
+    partes = []
+    while len(texto) > limite:
+        corte = texto.rfind("\n", 0, limite + 1)
+        if corte < limite // 2:
+            corte = texto.rfind(" ", 0, limite + 1)
+        if corte < limite // 2:
+            corte = limite
+        partes.append(texto[:corte].rstrip())
+        texto = texto[corte:].lstrip()
+    if texto:
+        partes.append(texto)
+    return partes
@@ -0,0 +1,85 @@
+import logging
+
+from cache import LRUCache
+from metricas import metricas
+
+logger = logging.getLogger('Empacotador')
+
+# Prioridades das partes do prompt (menor = entra primeiro)
+INSTRUCAO = 0
+MENSAGEM = 1
+HISTORICO = 2
+PERSONA = 3
+MEMORIAS = 4
+
+MINIMO_CORTE = 8  # Sobra menor que isso não vale uma parte cortada
+
+class PromptPacker:
+    """Monta prompts dentro de um orçamento de tokens, escolhendo as partes por prioridade.
+
+    As contagens de tokens de cada texto ficam em um LRU: histórico e seções da persona que se
+    repetem entre mensagens não são tokenizados de novo.
+    """
+    def __init__(self, modelo, orcamento: int, capacidade_cache: int = 4096):
+        self.modelo = modelo  # Qualquer objeto com tokenize/detokenize do llama_cpp
+        self.orcamento = orcamento
+        self.contagens = LRUCache(capacidade=capacidade_cache)
+
+    def contar(self, texto: str) -> int:
+        n = self.contagens.get(texto)
+        if n is None:
+            n = len(self._tokenizar(texto))
+            self.contagens.put(texto, n)
+        return n
+
+    def cortar(self, texto: str, limite: int) -> str:
+        """Os primeiros `limite` tokens do texto"""
+        tokens = self._tokenizar(texto)
+        if len(tokens) <= limite:
+            return texto
+        cortado = self.modelo.detokenize(tokens[:limite]).decode("utf-8", errors="ignore").rstrip()
+        return cortado + "…" if limite > 1 else cortado
+
+    def empacotar(self, partes: list, orcamento: int = None, separador: str = "\n") -> str:
+        """Junta as partes (texto, prioridade, cortavel) que cabem no orçamento (com o BOS), na ordem dada.
+
+        Em cada prioridade as partes mais ao fim vêm primeiro (o histórico mais recente). Quando
+        uma parte não cabe, as demais da mesma prioridade também ficam de fora (sem buracos no
+        histórico); se for cortável, ocupa a sobra do orçamento. Prioridades fracionárias
+        (ex.: PERSONA + 0.1) dão a cada seção sua própria vez.
+        """
+        total = self.orcamento if orcamento is None else orcamento
+        restante = total - 1  # BOS
+        escolhidas, esgotadas, descartadas = {}, set(), 0
+        for i in sorted(range(len(partes)), key=lambda i: (partes[i][1], -i)):
+            texto, prioridade, cortavel = partes[i]
+            if not texto:
+                continue
+            if prioridade in esgotadas:
+                descartadas += 1
+                continue
+
+            # +1 pelo separador entre as partes
+            custo = self.contar(texto) + 1
+            if custo <= restante:
+                escolhidas[i] = texto
+                restante -= custo
+                continue
+
+            esgotadas.add(prioridade)
+            cortado = self.cortar(texto, restante - 4) if cortavel and restante > MINIMO_CORTE else ""
+            # Retokenizar o corte (com as reticências) pode mudar a contagem em alguns tokens
+            if cortado and self.contar(cortado) + 1 <= restante:
+                escolhidas[i] = cortado
+                restante -= self.contar(cortado) + 1
+            else:
+                descartadas += 1
+
+        usados = total - restante
+        metricas.observar("prompt_tokens", usados, "Tokens do prompt montado")
+        if descartadas:
+            logger.debug(f"✂️ {descartadas} partes fora do prompt ({usados} tokens usados)")
+        return separador.join(escolhidas[i] for i in sorted(escolhidas))
+
+    def _tokenizar(self, texto: str) -> list:
+        return self.modelo.tokenize(texto.encode("utf-8"), add_bos=False)
@@ -0,0 +1,135 @@
+import logging
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+from inferencia import prefixo_comum
+from metricas import metricas
+
+logger = logging.getLogger('Especulativo')
+
+# "nenhum": decodificação normal; "lookup": n-gramas do próprio prompt; "rascunho": GGUF pequeno
+MODOS = ("nenhum", "lookup", "rascunho")
+
+PADROES_ESPECULACAO = {
+    "modo": "nenhum",
+    "max_ngram_size": 2,     # lookup: tamanho do n-grama procurado no prompt
+    "num_pred_tokens": 10,   # Tokens propostos por passo de verificação
+    "rascunho": None         # rascunho: variante de modelos.json com o mesmo vocabulário
+}
+
+class CountingDraftModel(LlamaDraftModel):
+    """Rascunho que conta quantos dos tokens propostos o modelo principal aceitou.
+
+    O `Llama.generate` não informa a aceitação; ela aparece na chamada seguinte, quando os
+    `input_ids` recebidos trazem os tokens realmente gerados depois do rascunho anterior.
+    """
+    modo = None
+
+    def __init__(self):
+        self.chamadas = 0
+        self.propostos = 0
+        self.aceitos = 0
+        self._base = None      # input_ids da chamada anterior
+        self._rascunho = None  # Tokens propostos nela
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        self._conferir(input_ids)
+        rascunho = np.asarray(self.propor(input_ids), dtype=np.intc)
+        self.chamadas += 1
+        self._base = np.array(input_ids, copy=True)
+        self._rascunho = rascunho
+        return rascunho
+
+    def propor(self, input_ids: np.ndarray) -> np.ndarray:
+        raise NotImplementedError()
+
+    def estatisticas(self) -> dict:
+        return {
+            "modo": self.modo,
+            "chamadas": self.chamadas,
+            "propostos": self.propostos,
+            "aceitos": self.aceitos,
+            "taxa_aceitacao": self.aceitos / self.propostos if self.propostos else 0.0
+        }
+
+    def _conferir(self, input_ids: np.ndarray):
+        if self._rascunho is None or not len(self._rascunho):
+            return
+        n = len(self._base)
+        # Outra geração: o último rascunho da anterior nunca foi verificado
+        if len(input_ids) <= n or not np.array_equal(input_ids[:n], self._base):
+            return
+
+        # Os aceitos são repetidos; o primeiro divergente é o token amostrado pelo modelo principal.
+        # Todo o rascunho foi submetido à verificação, inclusive o que veio depois da divergência.
+        novos = input_ids[n:n + len(self._rascunho)]
+        iguais = novos == self._rascunho[:len(novos)]
+        aceitos = len(novos) if iguais.all() else int(np.argmin(iguais))
+        self.propostos += len(self._rascunho)
+        self.aceitos += aceitos
+        metricas.incrementar(
+            "rascunho_tokens_total", len(self._rascunho), "Tokens do rascunho verificados", modo=self.modo
+        )
+        metricas.incrementar("rascunho_aceitos_total", aceitos, "Tokens do rascunho aceitos", modo=self.modo)
+
+class PromptLookupDrafter(CountingDraftModel):
+    """Propõe a continuação do último n-grama onde ele já apareceu no prompt (histórico, persona, pesquisa)"""
+    modo = "lookup"
+
+    def __init__(self, max_ngram_size: int = 2, num_pred_tokens: int = 10):
+        super().__init__()
+        self._lookup = LlamaPromptLookupDecoding(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+
+    def propor(self, input_ids: np.ndarray) -> np.ndarray:
+        return self._lookup(input_ids)
+
+class DraftModelDrafter(CountingDraftModel):
+    """Propõe tokens com um GGUF pequeno (decodificação gulosa), verificados em lote pelo modelo principal"""
+    modo = "rascunho"
+
+    def __init__(self, modelo: Llama, num_pred_tokens: int = 10):
+        super().__init__()
+        self.modelo = modelo
+        self.num_pred_tokens = num_pred_tokens
+
+    def propor(self, input_ids: np.ndarray) -> np.ndarray:
+        tokens = input_ids.tolist()
+        if len(tokens) + self.num_pred_tokens >= self.modelo.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        # Só os tokens novos são avaliados; o último é reavaliado se preciso para ter seus logits
+        comum = min(prefixo_comum(self.modelo, tokens), len(tokens) - 1)
+        self.modelo.n_tokens = comum
+        self.modelo.eval(tokens[comum:])
+
+        rascunho = []
+        eos = self.modelo.token_eos()
+        for i in range(self.num_pred_tokens):
+            token = int(np.argmax(self.modelo.scores[self.modelo.n_tokens - 1]))
+            if token == eos:
+                break
+            rascunho.append(token)
+            if i + 1 < self.num_pred_tokens:
+                self.modelo.eval([token])
+        return np.array(rascunho, dtype=np.intc)
+
+def criar_rascunho(config: dict):
+    """Rascunho para o `draft_model` do Llama conforme `ModelRegistry.especulacao`; None no modo "nenhum" """
+    modo = config.get("modo", "nenhum")
+    if modo == "lookup":
+        return PromptLookupDrafter(config["max_ngram_size"], config["num_pred_tokens"])
+    if modo == "rascunho":
+        logger.info(f"⏳ Carregando modelo de rascunho {config['rascunho']}...")
+        return DraftModelDrafter(Llama(**config["parametros_rascunho"]), config["num_pred_tokens"])
+    return None
+
+def vocabulario_compativel(model: Llama, rascunho) -> bool:
+    """O rascunho por modelo só serve se os ids de token significam o mesmo nos dois"""
+    if not isinstance(rascunho, DraftModelDrafter):
+        return True
+    if rascunho.modelo.n_vocab() != model.n_vocab():
+        return False
+    amostra = "Olá! Tudo bem? <|im_start|>user\nHello, world.".encode("utf-8")
+    return model.tokenize(amostra, special=True) == rascunho.modelo.tokenize(amostra, special=True)
@@ -0,0 +1,298 @@
+import math
+import time
+
+import numpy as np
+
+# Colunas do estado por usuário e seus valores iniciais
+COLUNAS = {
+    "valencia": 0.5,        # -1 (negativo) a 1 (positivo)
+    "ativacao": 0.4,        # 0 (calmo) a 1 (excitado)
+    "dominancia": 0.7,      # 0 (submisso) a 1 (dominante)
+    "estabilidade": 0.6,    # 0 (volátil) a 1 (estável)
+    "familiaridade": 0.1,   # 0 (desconhecido) a 0.95
+    "confianca": 0.5,       # Confiança no usuário
+    "fadiga": 0.0,          # Fadiga mental com este usuário
+    "interacoes": 0.0,      # Interações recentes (limitado, alimenta a fadiga)
+    "ultima_interacao": 0.0,
+    "atualizado_em": 0.0    # Último decaimento aplicado
+}
+
+# Colunas que relaxam de volta ao valor inicial com o tempo
+_DECAEM = ("valencia", "ativacao", "dominancia", "estabilidade")
+
+class EmotionStore:
+    """Estado emocional por usuário em colunas NumPy: uma linha por user_id, busca O(1)"""
+    def __init__(self, capacidade: int = 1024, meia_vida: float = 3600.0, iniciais: dict = None):
+        self.iniciais = {**COLUNAS, **(iniciais or {})}
+        self.meia_vida = meia_vida
+        self._colunas = {nome: np.empty(capacidade, dtype=np.float64) for nome in self.iniciais}
+        self._indice = {}   # {user_id: linha}
+        self._ids = []      # linha -> user_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, user_id):
+        return user_id in self._indice
+
+    def ids(self) -> list:
+        return list(self._ids)
+
+    def linha(self, user_id, agora: float = None) -> int:
+        """Linha do usuário (criada com os valores iniciais), já com o decaimento aplicado"""
+        agora = time.time() if agora is None else agora
+        i = self._indice.get(user_id)
+        if i is None:
+            return self._criar(user_id, agora)
+        self._decair_linha(i, agora)
+        return i
+
+    def obter(self, user_id, agora: float = None) -> dict:
+        i = self.linha(user_id, agora)
+        return {nome: float(coluna[i]) for nome, coluna in self._colunas.items()}
+
+    def valor(self, user_id, coluna: str, padrao: float = None) -> float:
+        """Leitura sem criar a linha nem aplicar decaimento"""
+        i = self._indice.get(user_id)
+        if i is None:
+            return self.iniciais[coluna] if padrao is None else padrao
+        return float(self._colunas[coluna][i])
+
+    def definir(self, user_id, agora: float = None, **valores):
+        i = self.linha(user_id, agora)
+        for nome, valor in valores.items():
+            self._colunas[nome][i] = valor
+
+    def restaurar(self, user_id, valores: dict):
+        """Recria a linha com valores persistidos, sem aplicar decaimento na carga"""
+        i = self._indice.get(user_id)
+        if i is None:
+            i = self._criar(user_id, valores.get("atualizado_em", time.time()))
+        for nome, valor in valores.items():
+            if nome in self._colunas:
+                self._colunas[nome][i] = valor
+
+    def remover(self, user_id) -> bool:
+        """Libera a linha do usuário movendo a última linha para o lugar dela"""
+        i = self._indice.pop(user_id, None)
+        if i is None:
+            return False
+
+        ultima = len(self._ids) - 1
+        if i != ultima:
+            for coluna in self._colunas.values():
+                coluna[i] = coluna[ultima]
+            movido = self._ids[ultima]
+            self._ids[i] = movido
+            self._indice[movido] = i
+        self._ids.pop()
+        return True
+
+    def ociosos(self, limite: float) -> list:
+        """Usuários sem interação desde o timestamp `limite`"""
+        n = len(self._ids)
+        linhas = np.flatnonzero(self._colunas["ultima_interacao"][:n] < limite)
+        return [self._ids[i] for i in linhas]
+
+    def coluna(self, nome: str) -> np.ndarray:
+        """Visão (sem cópia) dos valores ativos de uma coluna"""
+        return self._colunas[nome][:len(self._ids)]
+
+    def decair(self, agora: float = None):
+        """Relaxa o estado de todos os usuários em direção aos valores iniciais de uma vez"""
+        agora = time.time() if agora is None else agora
+        n = len(self._ids)
+        if not n:
+            return
+
+        atualizado = self._colunas["atualizado_em"][:n]
+        fator = np.exp2(-np.maximum(agora - atualizado, 0.0) / self.meia_vida)
+        for nome in _DECAEM:
+            coluna = self._colunas[nome][:n]
+            base = self.iniciais[nome]
+            coluna -= base
+            coluna *= fator
+            coluna += base
+        atualizado[:] = agora
+
+    def atualizar_fadiga(self, agora: float = None):
+        """Recalcula a fadiga de todos os usuários (tempo desde a última interação e volume)"""
+        agora = time.time() if agora is None else agora
+        n = len(self._ids)
+        if not n:
+            return
+
+        horas = (agora - self._colunas["ultima_interacao"][:n]) / 3600
+        fadiga = 0.1 * horas + 0.01 * self._colunas["interacoes"][:n]
+        np.minimum(fadiga, 1.0, out=self._colunas["fadiga"][:n])
+
+    def fadiga(self, user_id, agora: float = None) -> float:
+        """Fadiga de um único usuário, com a mesma fórmula de `atualizar_fadiga`"""
+        agora = time.time() if agora is None else agora
+        i = self.linha(user_id, agora)
+        horas = (agora - self._colunas["ultima_interacao"][i]) / 3600
+        fadiga = min(1.0, 0.1 * horas + 0.01 * self._colunas["interacoes"][i])
+        self._colunas["fadiga"][i] = fadiga
+        return fadiga
+
+    def bytes_usados(self) -> int:
+        return sum(coluna.nbytes for coluna in self._colunas.values())
+
+    def _decair_linha(self, i: int, agora: float):
+        decorrido = agora - self._colunas["atualizado_em"][i]
+        if decorrido <= 0:
+            return
+        fator = math.pow(2.0, -decorrido / self.meia_vida)
+        for nome in _DECAEM:
+            base = self.iniciais[nome]
+            coluna = self._colunas[nome]
+            coluna[i] = base + (coluna[i] - base) * fator
+        self._colunas["atualizado_em"][i] = agora
+
+    def _criar(self, user_id, agora: float) -> int:
+        i = len(self._ids)
+        if i == len(self._colunas["valencia"]):
+            self._crescer()
+
+        for nome, coluna in self._colunas.items():
+            coluna[i] = self.iniciais[nome]
+        self._colunas["ultima_interacao"][i] = agora
+        self._colunas["atualizado_em"][i] = agora
+
+        self._indice[user_id] = i
+        self._ids.append(user_id)
+        return i
+
+    def _crescer(self):
+        for nome, coluna in self._colunas.items():
+            nova = np.empty(len(coluna) * 2, dtype=coluna.dtype)
+            nova[:len(coluna)] = coluna
+            self._colunas[nome] = nova
+
+class _Janela:
+    """Somas incrementais de uma janela deslizante (média e inclinação por mínimos quadrados)"""
+    def __init__(self):
+        self.n = 0
+        self.s_t = self.s_tt = self.s_v = self.s_a = self.s_tv = 0.0
+
+    def somar(self, t: float, v: float, a: float, sinal: int = 1):
+        self.n += sinal
+        self.s_t += sinal * t
+        self.s_tt += sinal * t * t
+        self.s_v += sinal * v
+        self.s_a += sinal * a
+        self.s_tv += sinal * t * v
+
+    def medias(self) -> tuple:
+        if not self.n:
+            return 0.0, 0.0
+        return self.s_v / self.n, self.s_a / self.n
+
+    def inclinacao(self) -> float:
+        """Variação da valência por minuto"""
+        denominador = self.n * self.s_tt - self.s_t * self.s_t
+        # Interações quase simultâneas (variância do tempo < 1 s²) não definem tendência
+        if self.n < 2 or denominador <= self.n * self.n:
+            return 0.0
+        return (self.n * self.s_tv - self.s_t * self.s_v) / denominador * 60
+
+class EmotionRing:
+    """Histórico emocional em buffer circular com agregados das últimas N interações e T minutos"""
+    DTYPE = np.dtype([("t", np.float64), ("valencia", np.float32), ("ativacao", np.float32)])
+
+    def __init__(self, capacidade: int = 100, ultimas: int = 20, minutos: float = 10.0):
+        self.capacidade = capacidade
+        self.ultimas = min(ultimas, capacidade)
+        self.janela_tempo = minutos * 60
+        self._dados = np.zeros(capacidade, dtype=self.DTYPE)
+        self._total = 0          # Sequência da próxima entrada
+        self._origem = None      # Tempos relativos para manter a precisão das somas
+        self._recentes = _Janela()
+        self._temporal = _Janela()
+        self._inicio_temporal = 0
+
+    def __len__(self):
+        return min(self._total, self.capacidade)
+
+    def adicionar(self, valencia: float, ativacao: float, t: float = None):
+        agora = time.time() if t is None else t
+        if self._origem is None:
+            self._origem = agora
+        t = agora - self._origem
+
+        # Saídas das janelas antes de sobrescrever a entrada mais antiga
+        if self._recentes.n == self.ultimas:
+            self._recentes.somar(*self._entrada(self._total - self.ultimas), sinal=-1)
+        if self._total >= self.capacidade:
+            antiga = self._total - self.capacidade
+            if self._inicio_temporal <= antiga:
+                self._temporal.somar(*self._entrada(antiga), sinal=-1)
+                self._inicio_temporal = antiga + 1
+
+        self._dados[self._total % self.capacidade] = (t, valencia, ativacao)
+        # Valores relidos do array para que as somas e subtrações usem a mesma precisão
+        entrada = self._entrada(self._total)
+        self._total += 1
+        self._recentes.somar(*entrada)
+        self._temporal.somar(*entrada)
+
+        # A cada volta completa, recalcula as somas para não acumular erro de arredondamento
+        if self._total % self.capacidade == 0:
+            self._recalcular()
+
+        self._expirar(agora - self._origem)
+
+    def agregados(self, agora: float = None) -> dict:
+        """Médias recentes e tendência, em O(1) amortizado"""
+        if self._origem is not None:
+            self._expirar((time.time() if agora is None else agora) - self._origem)
+
+        valencia_n, ativacao_n = self._recentes.medias()
+        valencia_t, ativacao_t = self._temporal.medias()
+        return {
+            "interacoes": self._recentes.n,
+            "valencia_media": valencia_n,
+            "ativacao_media": ativacao_n,
+            "interacoes_janela": self._temporal.n,
+            "valencia_janela": valencia_t,
+            "ativacao_janela": ativacao_t,
+            "tendencia": self._recentes.inclinacao()
+        }
+
+    def ultimos(self, n: int = None) -> np.ndarray:
+        """Cópia das últimas entradas em ordem cronológica"""
+        n = len(self) if n is None else min(n, len(self))
+        indices = np.arange(self._total - n, self._total) % self.capacidade
+        dados = self._dados[indices]
+        if self._origem is not None:
+            dados["t"] += self._origem
+        return dados
+
+    def _entrada(self, seq: int) -> tuple:
+        registro = self._dados[seq % self.capacidade]
+        return float(registro["t"]), float(registro["valencia"]), float(registro["ativacao"])
+
+    def _recalcular(self):
+        """Rebaseia os tempos na entrada mais antiga e refaz as somas das janelas (O(capacidade))"""
+        deslocamento = float(self._dados["t"].min())
+        self._dados["t"] -= deslocamento
+        self._origem += deslocamento
+
+        self._recentes = _Janela()
+        for seq in range(self._total - self._recentes_tamanho(), self._total):
+            self._recentes.somar(*self._entrada(seq))
+        self._temporal = _Janela()
+        for seq in range(self._inicio_temporal, self._total):
+            self._temporal.somar(*self._entrada(seq))
+
+    def _recentes_tamanho(self) -> int:
+        return min(self.ultimas, self._total)
+
+    def _expirar(self, t: float):
+        limite = t - self.janela_tempo
+        while self._inicio_temporal < self._total:
+            entrada = self._entrada(self._inicio_temporal)
+            if entrada[0] >= limite:
+                break
+            self._temporal.somar(*entrada, sinal=-1)
+            self._inicio_temporal += 1
@@ -0,0 +1,138 @@
+import asyncio
+import codecs
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+
+logger = logging.getLogger('Extração')
+
+# Conteúdo que nunca entra no texto extraído
+IGNORADAS = {"head", "title", "script", "style", "noscript", "template", "svg", "nav", "footer", "aside"}
+# Conteúdo principal, preferido ao texto solto do body
+PRINCIPAIS = {"article", "main"}
+
+_ESPACOS = re.compile(r"\s+")
+
+# Parsing fora do event loop, com poucas threads para não competir com a inferência
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="extracao")
+
+class _Coletor:
+    """Alvo SAX do lxml: recebe tags e texto em ordem, sem construir a árvore"""
+    def __init__(self, limite: int):
+        self.limite = limite
+        self.ignorando = 0        # Profundidade dentro de tags ignoradas
+        self.no_principal = 0     # Profundidade dentro de article/main
+        self.principal_fechado = False
+        self.principal = []
+        self.tamanho_principal = 0
+        self.corpo = []
+        self.tamanho_corpo = 0
+
+    def start(self, tag, attrib):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in IGNORADAS:
+            self.ignorando += 1
+        elif tag in PRINCIPAIS and not self.principal_fechado:
+            self.no_principal += 1
+        # Como get_text(separator=' '): o texto de elementos vizinhos não cola
+        self._espaco()
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in IGNORADAS:
+            self.ignorando = max(0, self.ignorando - 1)
+        elif tag in PRINCIPAIS and self.no_principal:
+            self.no_principal -= 1
+            # Como o BeautifulSoup.find, vale só o primeiro article/main com texto
+            if not self.no_principal and self.tamanho_principal:
+                self.principal_fechado = True
+        self._espaco()
+
+    def data(self, texto):
+        if self.ignorando or (self.principal_fechado and self.tamanho_corpo >= self.limite):
+            return
+        if self.no_principal and not self.principal_fechado:
+            self.principal.append(texto)
+            self.tamanho_principal += len(texto)
+        if self.tamanho_corpo < self.limite:
+            self.corpo.append(texto)
+            self.tamanho_corpo += len(texto)
+
+    def comment(self, texto):
+        pass
+
+    def close(self):
+        return None
+
+    def _espaco(self):
+        if self.no_principal and not self.principal_fechado:
+            self.principal.append(" ")
+        if self.tamanho_corpo < self.limite:
+            self.corpo.append(" ")
+
+    @property
+    def suficiente(self) -> bool:
+        # Espaços contam no tamanho bruto: pede uma folga antes de parar
+        return self.principal_fechado or self.tamanho_principal >= 2 * self.limite
+
+class HTMLExtractor:
+    """Extrai o texto principal de uma página alimentada em pedaços, parando quando há texto suficiente"""
+    def __init__(self, limite: int = 500, charset: str = None):
+        self.limite = limite
+        self.charset = charset or "utf-8"
+        self._coletor = _Coletor(limite)
+        self._parser = None
+        self._decoder = None
+        self.bytes_lidos = 0
+
+    def alimentar(self, pedaco: bytes) -> bool:
+        """Processa mais um pedaço do corpo; True quando já não precisa do resto"""
+        if self._parser is None:
+            self._parser = etree.HTMLParser(target=self._coletor, recover=True, no_network=True)
+            try:
+                self._decoder = codecs.getincrementaldecoder(self.charset)(errors="replace")
+            except LookupError:
+                self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.bytes_lidos += len(pedaco)
+        texto = self._decoder.decode(pedaco)
+        if texto:
+            self._parser.feed(texto)
+        return self._coletor.suficiente
+
+    def texto(self) -> str:
+        """Texto do primeiro article/main, ou do body se não houver, limitado a `limite` caracteres"""
+        if self._parser is not None:
+            try:
+                self._parser.close()
+            except etree.LxmlError:
+                pass
+            self._parser = None
+        partes = self._coletor.principal if self._coletor.tamanho_principal else self._coletor.corpo
+        texto = _ESPACOS.sub(" ", "".join(partes)).strip()
+        return texto[:self.limite] + '...' if len(texto) >= self.limite else texto
+
+async def extrair_pagina(sessoes, url: str, limite: int = 500, timeout: float = 1.5, max_bytes: int = None) -> tuple:
+    """(status, texto) de uma página lida em streaming e analisada no pool de extração"""
+    loop = asyncio.get_running_loop()
+    extrator = None
+
+    async def consumir(pedaco: bytes, charset: str) -> bool:
+        nonlocal extrator
+        if extrator is None:
+            extrator = HTMLExtractor(limite, charset)
+        return await loop.run_in_executor(_executor, extrator.alimentar, pedaco)
+
+    resposta = await sessoes.buscar(url, timeout=timeout, max_bytes=max_bytes, consumidor=consumir)
+    if extrator is None:
+        return resposta.status, ""
+    texto = await loop.run_in_executor(_executor, extrator.texto)
+    logger.debug(f"📄 {url}: {extrator.bytes_lidos} bytes lidos, {len(texto)} caracteres extraídos")
+    return resposta.status, texto
+
+def extrair_html(html: str, limite: int = 500) -> str:
+    """Extração síncrona de um HTML já em memória"""
+    extrator = HTMLExtractor(limite)
+    extrator.alimentar(html.encode("utf-8"))
+    return extrator.texto()
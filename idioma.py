@@ -0,0 +1,129 @@
+import logging
+import re
+import time
+
+from langdetect import DetectorFactory, LangDetectException, detect_langs
+from langdetect import detector_factory
+
+from cache import LRUCache
+
+logger = logging.getLogger('Idioma')
+
+# Perfis do langdetect com semente fixa: o mesmo texto sempre dá o mesmo idioma
+DetectorFactory.seed = 0
+
+# Palavras e grafias frequentes para textos curtos, onde o langdetect é pouco confiável
+_MARCADORES = {
+    "pt": {
+        "palavras": {
+            "oi", "olá", "ola", "você", "voce", "vc", "não", "nao", "sim", "obrigado", "obrigada",
+            "tudo", "bem", "que", "é", "eu", "meu", "minha", "como", "está", "esta", "tá", "ta",
+            "bom", "dia", "noite", "tarde", "por", "favor", "quem", "qual", "porque", "muito",
+            "tchau", "valeu", "kkk", "kkkk", "né", "de", "do", "da", "um", "uma", "isso", "ele", "ela"
+        },
+        "letras": set("ãõçâêôáíúà")
+    },
+    "en": {
+        "palavras": {
+            "hi", "hello", "hey", "you", "the", "is", "are", "what", "how", "yes", "no", "thanks",
+            "thank", "please", "i", "my", "good", "morning", "night", "who", "why", "it",
+            "this", "that", "and", "of", "to", "does", "lol", "bye", "your", "im", "whats"
+        },
+        "letras": set()
+    }
+}
+
+_NAO_LETRAS = re.compile(r"https?://\S+|<[@#:][^>]*>|[^\w\s]|\d|_", re.UNICODE)
+_ESPACOS = re.compile(r"\s+")
+
+class LanguageDetector:
+    """Detecção de idioma com heurística para textos curtos, cache LRU e idioma dominante por usuário"""
+    def __init__(self, padrao: str = "pt", capacidade_cache: int = 4096, capacidade_usuarios: int = 10000,
+                 decaimento: float = 0.8, minimo_caracteres: int = 25, confianca_minima: float = 0.7):
+        self.padrao = padrao
+        self.decaimento = decaimento
+        self.minimo_caracteres = minimo_caracteres
+        self.confianca_minima = confianca_minima
+        self.cache = LRUCache(capacidade=capacidade_cache)
+        self._usuarios = LRUCache(capacidade=capacidade_usuarios)  # {user_id: {idioma: peso}}
+        self._carregado = False
+
+    def carregar(self):
+        """Carrega os perfis do langdetect (custo alto, feito uma vez na inicialização)"""
+        if self._carregado:
+            return
+        inicio = time.perf_counter()
+        detector_factory.init_factory()
+        self._carregado = True
+        logger.info(f"🌐 Perfis de idioma carregados em {time.perf_counter() - inicio:.2f}s")
+
+    @staticmethod
+    def normalizar(texto: str) -> str:
+        """Minúsculas, sem links, menções, pontuação e números"""
+        return _ESPACOS.sub(" ", _NAO_LETRAS.sub(" ", texto.lower())).strip()
+
+    def detectar(self, texto: str, user_id=None) -> str:
+        """Idioma da mensagem; sem sinal claro, o idioma dominante do usuário ou o padrão"""
+        normalizado = self.normalizar(texto)
+        resultado = self.cache.get(normalizado)
+        if resultado is None:
+            resultado = self._classificar(normalizado)
+            self.cache.put(normalizado, resultado)
+
+        idioma, confianca = resultado
+        if user_id is not None:
+            if idioma is not None:
+                self._registrar(user_id, idioma, confianca)
+            if idioma is None or confianca < self.confianca_minima:
+                dominante, peso = self.idioma_usuario(user_id)
+                if dominante is not None and peso >= self.confianca_minima:
+                    return dominante
+
+        return idioma or self.padrao
+
+    def idioma_usuario(self, user_id) -> tuple:
+        """(idioma dominante, fração do peso recente) do usuário"""
+        pesos = self._usuarios.get(user_id)
+        if not pesos:
+            return None, 0.0
+        idioma = max(pesos, key=pesos.get)
+        return idioma, pesos[idioma] / sum(pesos.values())
+
+    def _registrar(self, user_id, idioma: str, confianca: float):
+        # Pesos antigos decaem: o dominante acompanha mudanças de idioma do usuário
+        pesos = {k: v * self.decaimento for k, v in (self._usuarios.get(user_id) or {}).items()}
+        pesos[idioma] = pesos.get(idioma, 0.0) + confianca
+        self._usuarios.put(user_id, {k: v for k, v in pesos.items() if v >= 0.01})
+
+    def _classificar(self, normalizado: str) -> tuple:
+        if not normalizado:
+            return None, 0.0
+        if len(normalizado) < self.minimo_caracteres:
+            return self._heuristica(normalizado)
+
+        self.carregar()
+        try:
+            melhor = detect_langs(normalizado)[0]
+        except LangDetectException:
+            return self._heuristica(normalizado)
+        return melhor.lang, melhor.prob
+
+    def _heuristica(self, normalizado: str) -> tuple:
+        """Pontua palavras e letras típicas; empate ou nenhum sinal fica indefinido"""
+        palavras = normalizado.split()
+        pontos = {}
+        for idioma, marcadores in _MARCADORES.items():
+            pontos[idioma] = (
+                sum(1 for p in palavras if p in marcadores["palavras"])
+                + sum(1 for c in normalizado if c in marcadores["letras"])
+            )
+
+        ordenados = sorted(pontos.items(), key=lambda item: item[1], reverse=True)
+        (idioma, melhor), (_, segundo) = ordenados[0], ordenados[1]
+        if melhor == 0 or melhor == segundo:
+            return None, 0.0
+        # Um único marcador não basta para superar o idioma dominante do usuário
+        return idioma, melhor / (melhor + segundo + 1)
+
+# Detector compartilhado pelo bot e pelo benchmark
+detector = LanguageDetector()
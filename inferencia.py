@@ -0,0 +1,245 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+from metricas import metricas
+
+logger = logging.getLogger('Inferência')
+
+# Marca o fim do stream de tokens de um pedido
+_FIM = object()
+
+class GenerationRequest:
+    """Pedido de geração enviado ao worker de inferência.
+
+    Com `complemento` (concurrent.futures.Future[str]), `prompt` é só a parte estática: o worker
+    faz o prefill dela enquanto o complemento (ex.: resultados de pesquisa) não chega, e depois
+    continua com `complemento` (até `orcamento_complemento` tokens) + `sufixo`. No InferenceWorker
+    de thread única essa espera seguraria os pedidos dos outros usuários; nele o bot usa
+    `somente_prefill`: um pedido curto que só avalia `prompt` e guarda o estado na sessão, seguido
+    de outro pedido com o prompt completo.
+    """
+    def __init__(self, prompt: str, max_tokens: int, temperature: float, stop: list = None, sessao=None,
+                 complemento: concurrent.futures.Future = None, sufixo: str = "",
+                 orcamento_complemento: int = 256, prazo_complemento: float = 5.0,
+                 somente_prefill: bool = False):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = stop or []
+        self.sessao = sessao  # Chave do cache de estado KV (ex.: user_id)
+        self.complemento = complemento
+        self.sufixo = sufixo
+        self.orcamento_complemento = orcamento_complemento
+        self.prazo_complemento = prazo_complemento  # Espera máxima do worker pelo complemento
+        self.somente_prefill = somente_prefill      # Só avalia o prompt, sem gerar tokens
+        self.cancelado = threading.Event()
+
+        # Preenchidos quando o pedido é submetido a partir de um event loop
+        self._loop = None
+        self._tokens = None
+
+    def cancelar(self):
+        """Interrompe a decodificação no próximo token"""
+        self.cancelado.set()
+        if self.complemento is not None:
+            self.complemento.cancel()  # Libera um worker esperando o complemento
+
+    def texto_complemento(self, timeout: float = None) -> str:
+        """Complemento do prompt; vazio se não chegou no prazo, falhou ou o pedido foi cancelado"""
+        if self.complemento is None:
+            return ""
+        try:
+            return self.complemento.result(self.prazo_complemento if timeout is None else timeout) or ""
+        except (concurrent.futures.CancelledError, concurrent.futures.TimeoutError):
+            return ""
+        except Exception as e:
+            logger.warning(f"⚠️ Complemento do prompt falhou: {str(e)}")
+            return ""
+
+def prefixo_comum(model, tokens) -> int:
+    """Quantos tokens do início de `tokens` já estão avaliados no contexto do modelo"""
+    comum = 0
+    # Só até n_tokens: depois disso o input_ids guarda restos de gerações anteriores
+    for a, b in zip(model.input_ids[:model.n_tokens], tokens):
+        if a != b:
+            break
+        comum += 1
+    return comum
+
+def prefill(model, texto: str):
+    """Avalia `texto` reaproveitando o prefixo já presente no contexto do modelo"""
+    tokens = model.tokenize(texto.encode("utf-8"), special=True)
+    if len(tokens) >= model.n_ctx():
+        return  # A geração vai tratar (ou recusar) o prompt longo demais
+
+    comum = prefixo_comum(model, tokens)
+    if comum < len(tokens):
+        # Mesmo ajuste que o create_completion faz ao encontrar um prefixo comum
+        model.n_tokens = comum
+        model.eval(tokens[comum:])
+
+def com_complemento(model, prompt: str, complemento: str, orcamento: int, sufixo: str) -> str:
+    """Prompt final: parte estática + complemento cortado em `orcamento` tokens + sufixo"""
+    if complemento:
+        tokens = model.tokenize(complemento.encode("utf-8"), add_bos=False)
+        if len(tokens) > orcamento:
+            complemento = model.detokenize(tokens[:orcamento]).decode("utf-8", errors="ignore")
+            # Não deixa uma linha cortada no meio
+            corte = complemento.rfind("\n")
+            if corte > len(complemento) // 2:
+                complemento = complemento[:corte]
+        if not complemento.endswith("\n"):
+            complemento += "\n"
+    return prompt + complemento + sufixo
+
+class InferenceWorker:
+    """Executa o modelo em uma thread dedicada e devolve tokens por uma fila assíncrona"""
+    def __init__(self, carregar_modelo, sessoes=None):
+        self._carregar_modelo = carregar_modelo
+        self.sessoes = sessoes       # LRUCache de estados do llama por sessão
+        self._sessao_ativa = None    # Sessão cujo estado está carregado no modelo
+        self.prefixo = {"tokens": 0, "reaproveitados": 0}  # Tokens de prompt e quantos já estavam no contexto
+        self._pedidos = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Inicia a thread de inferência (idempotente)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name="inferencia", daemon=True)
+                self._thread.start()
+
+    def parar(self, timeout: float = 5.0):
+        """Encerra a thread após o pedido em andamento"""
+        if self._thread is not None and self._thread.is_alive():
+            self._pedidos.put(None)
+            self._thread.join(timeout)
+
+    async def gerar(self, pedido: GenerationRequest):
+        """Submete o pedido e produz os tokens à medida que são gerados"""
+        pedido._loop = asyncio.get_running_loop()
+        pedido._tokens = asyncio.Queue()
+        self.iniciar()
+        self._pedidos.put(pedido)
+
+        try:
+            while True:
+                item = await pedido._tokens.get()
+                if item is _FIM:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Se o consumidor desistir, o worker para de decodificar
+            pedido.cancelar()
+
+    def _executar(self):
+        while True:
+            pedido = self._pedidos.get()
+            if pedido is None:
+                break
+
+            gerado = False
+            try:
+                if not pedido.cancelado.is_set():
+                    self._gerar_tokens(pedido)
+                    gerado = True
+            except Exception as e:
+                logger.error(f"🔴 Erro na inferência: {str(e)}")
+                metricas.erro("inferencia")
+                self._entregar(pedido, e)
+            finally:
+                self._entregar(pedido, _FIM)
+
+            # Salvo depois de entregar o fim do stream para não atrasar a resposta
+            if gerado:
+                self._salvar_sessao(pedido.sessao)
+
+    def _gerar_tokens(self, pedido: GenerationRequest):
+        model = self._carregar_modelo()
+        self._restaurar_sessao(model, pedido.sessao)
+        self._medir_prefixo(model, pedido.prompt)
+        prompt = pedido.prompt
+        if pedido.somente_prefill or pedido.complemento is not None:
+            # Parte estática avaliada enquanto o complemento ainda está a caminho
+            inicio = time.perf_counter()
+            prefill(model, prompt)
+            metricas.estagio("prefill_antecipado", time.perf_counter() - inicio)
+            if pedido.somente_prefill:
+                return  # O estado vai para o cache de sessão e a thread volta para a fila
+            complemento = pedido.texto_complemento()
+            if pedido.cancelado.is_set():
+                return
+            prompt = com_complemento(model, prompt, complemento, pedido.orcamento_complemento, pedido.sufixo)
+
+        inicio = time.perf_counter()
+        stream = model.create_completion(
+            prompt,
+            max_tokens=pedido.max_tokens,
+            temperature=pedido.temperature,
+            stop=pedido.stop,
+            stream=True
+        )
+
+        try:
+            anterior = None
+            for output in stream:
+                agora = time.perf_counter()
+                # Primeiro token: prefill do prompt; demais: um passo de decodificação cada
+                if anterior is None:
+                    metricas.estagio("prefill", agora - inicio)
+                else:
+                    metricas.estagio("decode_token", agora - anterior)
+                anterior = agora
+
+                if pedido.cancelado.is_set():
+                    break
+                self._entregar(pedido, output['choices'][0]['text'])
+        finally:
+            stream.close()
+
+    def _restaurar_sessao(self, model, sessao):
+        """Carrega o estado KV da sessão: o prefixo comum com o prompt não é reavaliado"""
+        if self.sessoes is None or sessao is None:
+            return
+
+        estado = self.sessoes.get(sessao)
+        if estado is not None and sessao != self._sessao_ativa:
+            model.load_state(estado)
+        self._sessao_ativa = sessao
+
+    def _medir_prefixo(self, model, prompt: str):
+        """Conta quantos tokens do prompt o llama.cpp vai pular por já estarem no contexto"""
+        tokens = model.tokenize(prompt.encode("utf-8"), special=True)
+        # O último token é sempre reavaliado para obter os logits
+        comum = min(prefixo_comum(model, tokens), max(len(tokens) - 1, 0))
+        self.prefixo["tokens"] += len(tokens)
+        self.prefixo["reaproveitados"] += comum
+        metricas.incrementar("prompt_tokens_total", len(tokens), "Tokens de prompt recebidos pelo worker")
+        metricas.incrementar("prefixo_reaproveitado_total", comum, "Tokens de prompt reaproveitados do contexto")
+
+    def _salvar_sessao(self, sessao):
+        if self.sessoes is None or sessao is None:
+            return
+
+        try:
+            estado = self._carregar_modelo().save_state()
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao salvar sessão {sessao}: {str(e)}")
+            return
+
+        tamanho = estado.llama_state_size + estado.scores.nbytes + estado.input_ids.nbytes
+        self.sessoes.put(sessao, estado, tamanho)
+
+    def _entregar(self, pedido: GenerationRequest, item):
+        try:
+            pedido._loop.call_soon_threadsafe(pedido._tokens.put_nowait, item)
+        except RuntimeError:
+            # Event loop já encerrado: ninguém mais aguarda este pedido
+            pedido.cancelar()
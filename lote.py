@@ -0,0 +1,295 @@
+import codecs
+import itertools
+import logging
+import queue
+import time
+from collections import deque
+
+import llama_cpp
+from llama_cpp import _internals
+
+from inferencia import InferenceWorker, _FIM, com_complemento
+from metricas import metricas
+
+logger = logging.getLogger('Lote')
+
+class _Sequencia:
+    """Conversa ativa no lote: um seq_id do llama.cpp"""
+    def __init__(self, pedido, seq_id: int, tokens: list):
+        self.pedido = pedido
+        self.seq_id = seq_id
+        self.prompt = deque(tokens) # Tokens do prompt ainda não avaliados
+        self.n_past = 0             # Próxima posição no cache KV da sequência
+        self.ultimo = None          # Último token amostrado (entra no próximo passo)
+        self.gerados = 0
+        self.texto = ""             # Texto ainda retido por poder iniciar um stop
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.ultimo_em = time.perf_counter()  # Admissão ou último token
+        self.admitido_em = self.ultimo_em
+        self.aguardando = pedido.complemento is not None  # Complemento do prompt ainda não chegou
+        self.amostrador = None      # Cadeia de amostragem do llama.cpp, com o histórico de penalidades
+
+class BatchEngine(InferenceWorker):
+    """Decodificação contínua em lote: várias conversas no mesmo batch do llama.cpp.
+
+    Cada pedido ocupa um seq_id; novos pedidos entram e saem do lote entre passos de
+    decodificação. Os pesos são os do `Llama` já carregado; só o cache KV é separado.
+    """
+    def __init__(self, carregar_modelo, n_sequencias: int = 4, n_ctx_sequencia: int = 2048,
+                 n_batch: int = 512, top_k: int = 40, top_p: float = 0.95, min_p: float = 0.05,
+                 typical_p: float = 1.0, repeat_penalty: float = 1.0, seed: int = 42):
+        super().__init__(carregar_modelo)
+        self.n_sequencias = n_sequencias
+        self.n_ctx_sequencia = n_ctx_sequencia
+        self.n_batch = n_batch
+        # Mesmos padrões do create_completion, para as respostas do lote não mudarem de estilo
+        self.top_k = top_k
+        self.top_p = top_p
+        self.min_p = min_p
+        self.typical_p = typical_p
+        self.repeat_penalty = repeat_penalty
+        self._seeds = itertools.count(seed)
+
+        self._llm = None
+        self._ctx = None
+        self._batch = None
+        self._ativas = {}           # {seq_id: _Sequencia}
+        self._livres = list(range(n_sequencias))
+
+        # Métricas de vazão agregada
+        self.tokens_gerados = 0
+        self.passos = 0
+        self._tempo_decode = 0.0
+
+    def estatisticas(self) -> dict:
+        return {
+            "sequencias_ativas": len(self._ativas),
+            "tokens_gerados": self.tokens_gerados,
+            "passos": self.passos,
+            "tokens_por_passo": self.tokens_gerados / self.passos if self.passos else 0.0,
+            "tokens_por_segundo": self.tokens_gerados / self._tempo_decode if self._tempo_decode else 0.0
+        }
+
+    def _preparar(self):
+        """Cria um contexto com vários seq_ids sobre os pesos do modelo compartilhado"""
+        if self._ctx is not None:
+            return
+
+        self._llm = self._carregar_modelo()
+        params = llama_cpp.llama_context_params.from_buffer_copy(self._llm.context_params)
+        params.n_ctx = self.n_ctx_sequencia * self.n_sequencias
+        params.n_batch = self.n_batch
+        params.n_ubatch = min(params.n_ubatch, self.n_batch)
+        params.n_seq_max = self.n_sequencias
+        if hasattr(params, "kv_unified"):
+            params.kv_unified = False  # Cada sequência com sua fatia de n_ctx
+
+        self._ctx = _internals.LlamaContext(model=self._llm._model, params=params, verbose=False)
+        self._batch = _internals.LlamaBatch(
+            n_tokens=self.n_batch, embd=0, n_seq_max=self.n_sequencias, verbose=False
+        )
+        self._eos = self._llm.token_eos()
+        logger.info(f"🧮 Motor em lote pronto: {self.n_sequencias} sequências x {self.n_ctx_sequencia} tokens")
+
+    def _executar(self):
+        while True:
+            # Sem conversas ativas, bloqueia esperando um pedido
+            if not self._admitir(bloquear=not self._ativas):
+                break
+            if not self._ativas:
+                continue
+
+            try:
+                self._passo()
+            except Exception as e:
+                logger.error(f"🔴 Erro no passo do lote: {str(e)}")
+                metricas.erro("inferencia")
+                for seq in list(self._ativas.values()):
+                    self._entregar(seq.pedido, e)
+                    self._finalizar(seq)
+
+    def _admitir(self, bloquear: bool) -> bool:
+        """Move pedidos da fila para o lote enquanto houver seq_ids livres"""
+        while self._livres:
+            try:
+                pedido = self._pedidos.get(block=bloquear)
+            except queue.Empty:
+                return True
+            if pedido is None:
+                return False
+            bloquear = False
+
+            if pedido.cancelado.is_set():
+                self._entregar(pedido, _FIM)
+                continue
+
+            try:
+                self._preparar()
+                tokens = self._llm.tokenize(pedido.prompt.encode("utf-8"))
+            except Exception as e:
+                self._entregar(pedido, e)
+                self._entregar(pedido, _FIM)
+                continue
+
+            # Mantém espaço para a resposta (e o complemento) dentro da fatia de contexto
+            limite = self.n_ctx_sequencia - pedido.max_tokens
+            if pedido.complemento is not None:
+                sufixo = self._llm.tokenize(pedido.sufixo.encode("utf-8"), add_bos=False)
+                limite -= pedido.orcamento_complemento + len(sufixo) + 1
+            if len(tokens) > limite:
+                tokens = self._cortar_meio(tokens, limite, pedido.prompt)
+
+            seq = _Sequencia(pedido, self._livres.pop(0), tokens)
+            seq.amostrador = self._criar_amostrador(pedido.temperature)
+            self._ativas[seq.seq_id] = seq
+        return True
+
+    def _passo(self):
+        """Um llama_decode com o próximo token de cada conversa e trechos de prefill"""
+        batch = self._batch.batch
+        batch.n_tokens = 0
+        saidas = {}  # {indice_no_batch: _Sequencia}
+
+        def adicionar(seq, token, logits):
+            i = batch.n_tokens
+            batch.token[i] = token
+            batch.pos[i] = seq.n_past
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq.seq_id
+            batch.logits[i] = logits
+            batch.n_tokens += 1
+            seq.n_past += 1
+            if logits:
+                saidas[i] = seq
+
+        # Decodificação primeiro: conversas em andamento não esperam prefills longos
+        for seq in self._ativas.values():
+            if seq.ultimo is not None:
+                adicionar(seq, seq.ultimo, True)
+
+        # Complementos que chegaram (ou cujo prazo venceu) entram no fim do prompt
+        agora = time.perf_counter()
+        for seq in self._ativas.values():
+            pedido = seq.pedido
+            if seq.aguardando and (pedido.complemento.done() or agora - seq.admitido_em >= pedido.prazo_complemento):
+                self._completar(seq)
+
+        # Prefill em trechos com o espaço restante do batch; sem logits enquanto falta o complemento
+        for seq in self._ativas.values():
+            while seq.prompt and batch.n_tokens < self.n_batch:
+                token = seq.prompt.popleft()
+                adicionar(seq, token, not seq.prompt and not seq.aguardando)
+
+        if batch.n_tokens == 0:
+            # Só há conversas esperando o complemento do prompt
+            time.sleep(0.005)
+        else:
+            inicio = time.perf_counter()
+            self._ctx.decode(self._batch)
+            self._tempo_decode += time.perf_counter() - inicio
+            self.passos += 1
+
+            agora = time.perf_counter()
+            for i, seq in saidas.items():
+                metricas.estagio("decode_token" if seq.gerados else "prefill", agora - seq.ultimo_em)
+                seq.ultimo_em = agora
+                token = seq.amostrador.sample(self._ctx, i)
+                self.tokens_gerados += 1
+                self._avancar(seq, token)
+
+        # Pedidos cancelados saem do lote antes do próximo passo
+        for seq in list(self._ativas.values()):
+            if seq.pedido.cancelado.is_set():
+                self._finalizar(seq)
+
+    def _completar(self, seq: _Sequencia):
+        pedido = seq.pedido
+        extra = com_complemento(self._llm, "", pedido.texto_complemento(timeout=0),
+                                pedido.orcamento_complemento, pedido.sufixo)
+        seq.prompt.extend(self._llm.tokenize(extra.encode("utf-8"), add_bos=False))
+        seq.aguardando = False
+
+    def _criar_amostrador(self, temperatura: float) -> _internals.LlamaSampler:
+        """Mesma cadeia do `Llama._init_sampler`: penalidades, top-k, typical, top-p, min-p e temperatura"""
+        amostrador = _internals.LlamaSampler()
+        amostrador.add_penalties(
+            penalty_last_n=self._llm.last_n_tokens_size,
+            penalty_repeat=self.repeat_penalty,
+            penalty_freq=0.0,
+            penalty_present=0.0
+        )
+        if temperatura <= 0:
+            amostrador.add_greedy()
+            return amostrador
+        amostrador.add_top_k(self.top_k)
+        amostrador.add_typical(self.typical_p, 1)
+        amostrador.add_top_p(self.top_p, 1)
+        amostrador.add_min_p(self.min_p, 1)
+        amostrador.add_temp(temperatura)
+        amostrador.add_dist(next(self._seeds))
+        return amostrador
+
+    def _cortar_meio(self, tokens: list, limite: int, prompt: str) -> list:
+        """Corta o meio do prompt (o histórico mais antigo), mantendo o BOS, a primeira linha (instrução) e o fim"""
+        cabeca = len(self._llm.tokenize(prompt.split("\n", 1)[0].encode("utf-8")))
+        cabeca = min(cabeca, limite // 2)
+        cauda = tokens[len(tokens) - (limite - cabeca):]
+        # Recomeça numa linha inteira se a quebra estiver perto do corte
+        nl = self._llm.token_nl()
+        if nl in cauda[:len(cauda) // 2]:
+            cauda = cauda[cauda.index(nl):]
+        logger.debug(f"✂️ Prompt de {len(tokens)} tokens cortado para {cabeca + len(cauda)}")
+        return tokens[:cabeca] + cauda
+
+    def _avancar(self, seq: _Sequencia, token: int):
+        pedido = seq.pedido
+        seq.gerados += 1
+
+        if token == self._eos:
+            self._liberar_texto(seq, final=True)
+            self._finalizar(seq)
+            return
+
+        seq.texto += seq.decoder.decode(self._llm.detokenize([token]))
+
+        # Stop encontrado: entrega o texto anterior a ele e encerra
+        for stop in pedido.stop:
+            pos = seq.texto.find(stop)
+            if pos >= 0:
+                seq.texto = seq.texto[:pos]
+                self._liberar_texto(seq, final=True)
+                self._finalizar(seq)
+                return
+
+        if seq.gerados >= pedido.max_tokens or seq.n_past >= self.n_ctx_sequencia:
+            self._liberar_texto(seq, final=True)
+            self._finalizar(seq)
+            return
+
+        seq.ultimo = token
+        self._liberar_texto(seq, final=False)
+
+    def _liberar_texto(self, seq: _Sequencia, final: bool):
+        """Entrega o texto pendente, retendo o sufixo que ainda pode virar um stop"""
+        retido = 0
+        if not final:
+            for stop in seq.pedido.stop:
+                for n in range(min(len(stop) - 1, len(seq.texto)), 0, -1):
+                    if seq.texto.endswith(stop[:n]):
+                        retido = max(retido, n)
+                        break
+
+        texto = seq.texto[:len(seq.texto) - retido]
+        seq.texto = seq.texto[len(texto):]
+        if texto:
+            self._entregar(seq.pedido, texto)
+
+    def _finalizar(self, seq: _Sequencia):
+        """Remove a sequência do lote e libera sua fatia do cache KV"""
+        if self._ativas.pop(seq.seq_id, None) is None:
+            return
+        self._ctx.kv_cache_seq_rm(seq.seq_id, -1, -1)
+        if seq.amostrador is not None:
+            seq.amostrador.close()
+        self._livres.append(seq.seq_id)
+        self._entregar(seq.pedido, _FIM)
@@ -1,30 +1,58 @@
 import datetime
 import time
 import os
-import json
 import re
 import sys
-from modelo import carregar_modelo
+from modelo import carregar_modelo, registro
 from persona import Asteria
+from cache import PromptCache
+from inferencia import prefixo_comum
+from persistencia import PersonaStore
+from registro_conversas import ConversationLog
+from memoria import MemoryIndex, MEMORIA_DIR
+from empacotador import PromptPacker, INSTRUCAO, MENSAGEM, HISTORICO, PERSONA, MEMORIAS
+import prompts
 
 class ConversationManager:
     def __init__(self):
-        self.model = carregar_modelo()
+        self.model = carregar_modelo("cli")
         self.persona = Asteria()
         self.history = []
-        self.log_dir = "logs"
-        os.makedirs(self.log_dir, exist_ok=True)
+        self.conversas = ConversationLog("conversa_%Y-%m-%d.jsonl")
+        self.conversas.iniciar()
         self.user_id = "default"
         self.streaming_delay = 0.02  # Delay entre tokens para efeito de streaming
 
         # Configurações otimizadas
         self.settings = {
-            "max_history": 2,
+            "max_history": int(os.getenv("ASTERIA_MAX_HISTORY", "10")),
             "max_tokens": 80,
             "temperature": 0.7,
-            "cache_size": 10
+            "memory_k": int(os.getenv("ASTERIA_MEMORIA_K", "2")),
+            "memory_chars": int(os.getenv("ASTERIA_MEMORIA_CHARS", "200")),
+            "cache_size": int(os.getenv("ASTERIA_CACHE_SIZE", "10")),
+            "cache_mb": int(os.getenv("ASTERIA_CACHE_MB", "512"))
         }
-        self.prompt_cache = {}
+        # Respostas recentes e estados de prefixo (evita prefill/decodificação repetidos)
+        self.prompt_cache = PromptCache(
+            capacidade=self.settings["cache_size"],
+            orcamento_bytes=self.settings["cache_mb"] * 1024 * 1024
+        )
+        self._ultimo_prompt = ""  # Prompt cujo estado está vivo no modelo
+        # Orçamento do prompt em tokens: o contexto menos a resposta (ASTERIA_PROMPT_TOKENS limita mais)
+        orcamento = self.model.n_ctx() - self.settings["max_tokens"]
+        if int(os.getenv("ASTERIA_PROMPT_TOKENS", "0")) > 0:
+            orcamento = min(orcamento, int(os.getenv("ASTERIA_PROMPT_TOKENS")))
+        self.empacotador = PromptPacker(self.model, orcamento)
+
+        # Estado da persona e histórico salvos entre execuções
+        self.persona_db = PersonaStore()
+        self.persona_db.iniciar()
+        self._restaurar_estado()
+
+        # Memória de longo prazo alimentada pelos logs anteriores e pelas trocas desta sessão
+        self.memoria = MemoryIndex(os.path.join(MEMORIA_DIR, "cli"))
+        self.memoria.iniciar(self.conversas.diretorio)
 
         print(f"\n🧠 {self.persona.nome} iniciada - Personalidade: {self.persona.descricao[:60]}...")
         print("Digite 'sair' ou '/ajuda' para comandos\n")
@@ -38,7 +66,26 @@ class ConversationManager:
         full_response = ""
         displayed_response = ""
 
+        # Mesma entrada logo depois da mesma troca e no mesmo tom: resposta em cache sem o modelo
+        tom = self.persona._calcular_tom_comportamental(self.persona.estado_de(self.user_id))
+        chave = PromptCache.chave(user_input, self.history[-1] if self.history else "", tom)
+        cached = self.prompt_cache.resposta(chave)
+        if cached is not None:
+            timestamp_str = datetime.datetime.now().strftime("[%H:%M:%S]")
+            print(f"{timestamp_str} {self.persona.nome}: {cached}")
+            elapsed = time.time() - start
+            self._update_history(user_input, cached, elapsed)
+            return cached, elapsed
+
         try:
+            # Restaura o estado salvo que compartilha o maior prefixo com o prompt
+            prefixo_vivo = len(os.path.commonprefix([self._ultimo_prompt, prompt]))
+            tokens = self.model.tokenize(prompt.encode("utf-8"), special=True)
+            fracao_viva = prefixo_comum(self.model, tokens) / len(tokens) if tokens else 0.0
+            estado = self.prompt_cache.melhor_prefixo(prompt, minimo=prefixo_vivo, fracao_viva=fracao_viva)
+            if estado is not None:
+                self.model.load_state(estado)
+
             # Geração com streaming
             stream = self.model.create_completion(
                 prompt,
@@ -68,6 +115,8 @@ class ConversationManager:
             full_response = re.sub(r'[<>\[\]]', '', full_response).strip()
             print()  # Nova linha após conclusão
 
+            self._guardar_no_cache(chave, prompt, full_response)
+
         except Exception as e:
             full_response = f"Erro: {str(e)}"
             print(f"{timestamp_str} {self.persona.nome}: {full_response}")
@@ -76,37 +125,68 @@ class ConversationManager:
         self._update_history(user_input, full_response, elapsed)
         return full_response, elapsed
 
+    def _guardar_no_cache(self, chave: str, prompt: str, response: str):
+        """Guarda a resposta e o estado do modelo após o prompt"""
+        if response:
+            self.prompt_cache.guardar_resposta(chave, response)
+
+        try:
+            estado = self.model.save_state()
+        except Exception:
+            return
+
+        tamanho = estado.llama_state_size + estado.scores.nbytes + estado.input_ids.nbytes
+        self.prompt_cache.guardar_prefixo(prompt, estado, tamanho)
+        self._ultimo_prompt = prompt
+
     def _build_minimal_prompt(self, user_input: str, persona_context: str) -> str:
-        """Prompt mínimo para streaming eficiente"""
-        # Histórico compactado
-        history_segment = ""
-        for i, (q, a) in enumerate(self.history[-self.settings["max_history"]:]):
-            history_segment += f"\nU{i+1}: {q[:20]}"[:20]
-            if a:  # Evita linha vazia se não houver resposta
-                history_segment += f"\nA{i+1}: {a[:20]}"[:20]
-
-        # Prompt essencial
-        return (
-            f"Contexto: {persona_context[:100]}\n"
-            f"Histórico:{history_segment}"
-            f"\nU: {user_input}\nA:"
+        """Prompt no orçamento de tokens, na ordem do bot: instrução e histórico, depois persona, memórias e mensagem"""
+        # Trocas antigas relevantes que já saíram do histórico
+        recentes = {q for q, _ in self.history}
+        lembrancas = [
+            l for l in self.memoria.buscar(self.user_id, user_input, k=self.settings["memory_k"] + len(recentes))
+            if l["entrada"] not in recentes
+        ][:self.settings["memory_k"]]
+        memorias = prompts.bloco_memorias(lembrancas, self.settings["memory_chars"])
+
+        # Instrução e histórico mudam pouco entre mensagens: ficam no começo e reaproveitam o prefixo
+        partes = [(prompts.INSTRUCAO_PADRAO, INSTRUCAO, True), ("Histórico:", INSTRUCAO, False)]
+        partes.extend((f"U: {q}\nA: {a}" if a else f"U: {q}", HISTORICO, False) for q, a in self.history)
+
+        # A persona muda a cada mensagem (tom, estabilidade, valência média); cada seção entra ou é cortada sozinha
+        secoes = [s.strip() for s in persona_context.split("\n\n") if s.strip()]
+        partes.extend(
+            (f"Contexto: {secao}" if i == 0 else secao, PERSONA + i * 0.1, True)
+            for i, secao in enumerate(secoes)
         )
+        partes.append((memorias, MEMORIAS, True))
+        partes.append((f"U: {user_input}", MENSAGEM, True))
+        partes.append(("A:", INSTRUCAO, False))
+        return self.empacotador.empacotar(partes)
 
     def _update_history(self, user_input: str, response: str, response_time: float):
+        # Respostas de erro são recusadas pelo próprio índice (também na ingestão dos logs)
+        self.memoria.indexar(self.user_id, user_input, response)
         self.history.append((user_input, response))
-        if len(self.history) > 5:
+        if len(self.history) > self.settings["max_history"]:
             self.history.pop(0)
+        self.persona_db.marcar(self.user_id, **self.persona.exportar_usuario(self.user_id), conversa=list(self.history))
+
+    def _restaurar_estado(self):
+        dados = self.persona_db.carregar(self.user_id)
+        if dados is None:
+            return
+        self.persona.restaurar_usuario(self.user_id, dados["estado"], dados["historico_emocional"])
+        self.history = [tuple(par) for par in dados["conversa"] or []]
 
-    def save_log(self, user_input: str, response: str, timestamp: datetime.datetime):
-        log_entry = {
+    def save_log(self, user_input: str, response: str, timestamp: datetime.datetime, elapsed: float = None):
+        self.conversas.registrar({
             "timestamp": timestamp.isoformat(),
             "user_input": user_input,
             "response": response,
-        }
-
-        filename = os.path.join(self.log_dir, f"conversa_{datetime.date.today().isoformat()}.jsonl")
-        with open(filename, "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+            "response_time": elapsed,
+            "persona_state": self.persona.estado_de(self.user_id)
+        })
 
     def interactive_loop(self):
         while True:
@@ -134,7 +214,7 @@ class ConversationManager:
                 if elapsed > 0.5:
                     print(f"⏱ {elapsed:.2f}s | 💬 {len(response.split())} tokens")
 
-                self.save_log(user_input, response, now)
+                self.save_log(user_input, response, now, elapsed)
 
             except KeyboardInterrupt:
                 print("\n\nEncerrando...")
@@ -149,23 +229,51 @@ class ConversationManager:
             print("\nComandos:")
             print("/estado - Mostrar estado emocional")
             print("/limpar - Limpar histórico da sessão")
+            print("/cache - Mostrar uso do cache de prompts")
+            print("/modelo - Mostrar modelos carregados")
             print("/sair - Encerrar conversa")
 
         elif cmd == '/estado':
             print(f"\n💖 Estado emocional atual:")
-            print(f"Tom: {getattr(self.persona, 'tom_comportamental', 'neutro')}")
-            print(f"Valência: {getattr(self.persona, 'valencia_emocional', 0.5):.1f}")
+            estado = self.persona.estado_de(self.user_id)
+            print(f"Tom: {self.persona._calcular_tom_comportamental(estado)}")
+            print(f"Valência: {estado['valencia']:.1f} | Familiaridade: {estado['familiaridade']:.2f}")
+            self._mostrar_cache()
+
+        elif cmd == '/cache':
+            self._mostrar_cache()
+
+        elif cmd == '/modelo':
+            for nome, m in registro.relatorio().items():
+                print(f"\n🧠 {nome}: {os.path.basename(m['arquivo'])}")
+                print(f"Carga: {m['tempo_carga']:.1f}s | RSS: +{m['rss_mb']:.0f} MB | {m['n_threads']} threads | ctx {m['n_ctx']}")
+                if "rascunho" in m:
+                    r = m["rascunho"]
+                    print(f"Especulativo ({r['modo']}): {r['taxa_aceitacao']:.0%} aceitos de {r['propostos']} propostos")
 
         elif cmd == '/limpar':
             self.history = []
-            self.prompt_cache = {}
+            self.prompt_cache.clear()
             print("\n🆑 Histórico limpo!")
 
         else:
             print(f"\nComando desconhecido: {command}")
 
+    def _mostrar_cache(self):
+        stats = self.prompt_cache.estatisticas()
+        respostas, prefixos = stats["respostas"], stats["prefixos"]
+        print(f"\n🗃️ Cache (capacidade {self.settings['cache_size']}):")
+        print(f"Respostas: {respostas['itens']} | acerto {respostas['taxa_acerto']:.0%} ({respostas['hits']}/{respostas['hits'] + respostas['misses']})")
+        print(f"Prefixos: {prefixos['itens']} ({prefixos['bytes'] / 1024 / 1024:.0f} MB) | acerto {prefixos['taxa_acerto']:.0%} ({prefixos['hits']}/{prefixos['hits'] + prefixos['misses']})")
+
 def main():
-    ConversationManager().interactive_loop()
+    conversa = ConversationManager()
+    try:
+        conversa.interactive_loop()
+    finally:
+        conversa.persona_db.fechar()
+        conversa.conversas.fechar()
+        conversa.memoria.fechar()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,466 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from registro_conversas import LOG_DIR, arquivos_de_log, linhas_novas
+
+logger = logging.getLogger('Memória')
+
+MEMORIA_DIR = os.getenv("ASTERIA_MEMORIA_DIR", "data/memoria")
+
+MAX_SEGMENTOS = 8        # Acima disso os segmentos são mesclados em um só
+LOTE_MEMORIA = 256       # Trocas em memória antes de virar segmento no disco
+LOTE_INGESTAO = 100_000  # Trocas por segmento ao ingerir logs
+
+# Parâmetros do BM25
+K1 = 1.2
+B = 0.75
+
+_PALAVRA = re.compile(r"\w+", re.UNICODE)
+_PARADAS = {
+    # Português (sem acentos, como os termos indexados)
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas", "um", "uma",
+    "que", "se", "por", "para", "com", "nao", "sim", "eu", "voce", "vc", "ele", "ela", "isso", "isto",
+    "esse", "essa", "meu", "minha", "seu", "sua", "me", "te", "lhe", "ao", "mas", "mais", "muito",
+    "como", "ja", "foi", "ser", "ta", "esta", "estou", "tem", "ter", "ou", "pra", "pro", "aqui",
+    # Inglês
+    "the", "an", "and", "or", "of", "to", "in", "on", "is", "are", "was", "it", "you", "i", "me", "my",
+    "your", "be", "do", "for", "with", "this", "that", "what", "so", "just", "at"
+}
+
+# Arrays de cada segmento (todos abertos com mmap)
+_ARRAYS = (
+    "chaves", "inicios", "docs", "tfs",               # Postings por (usuário, termo)
+    "comprimentos", "momentos", "offsets",            # Por documento
+    "ids",                                            # Impressões digitais ordenadas (deduplicação)
+    "usuarios", "usuarios_docs", "usuarios_tamanho"   # Estatísticas do BM25 por usuário
+)
+
+def termos(texto: str) -> list:
+    """Palavras normalizadas (minúsculas, sem acentos e sem palavras vazias)"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [p for p in _PALAVRA.findall(texto) if len(p) > 1 and p not in _PARADAS]
+
+def _hash(texto: str) -> int:
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "little")
+
+def _chave(usuario: str, termo: str) -> int:
+    return _hash(f"{usuario}\x1f{termo}")
+
+def indexavel(entrada, resposta, falha: bool = False) -> bool:
+    """Trocas vazias e respostas de erro não viram lembranças.
+
+    Erros da CLI são gravados como "Erro: ..."; os avisos do bot (timeout, falha na geração)
+    vêm com `falha` (o campo "falha" do registro no log).
+    """
+    return (
+        not falha
+        and isinstance(entrada, str) and isinstance(resposta, str)
+        and bool(entrada.strip()) and bool(resposta.strip())
+        and not resposta.lstrip().startswith("Erro:")
+    )
+
+def _documento(usuario, entrada: str, resposta: str, momento: float) -> tuple:
+    usuario, entrada, resposta = str(usuario), entrada.strip(), resposta.strip()
+    # Trocas idênticas do mesmo usuário são uma só lembrança (e o log não duplica o que já foi indexado ao vivo)
+    return _hash(f"{usuario}\x1f{entrada}\x1f{resposta}"), usuario, momento, entrada, resposta
+
+def _construir(documentos: list) -> tuple:
+    """Arrays do segmento e partes dos textos a partir de uma lista de documentos"""
+    postings = defaultdict(list)
+    por_usuario = defaultdict(lambda: [0, 0])
+    comprimentos, momentos, offsets, textos = [], [], [0], []
+    for i, (_, usuario, momento, entrada, resposta) in enumerate(documentos):
+        contagem = Counter(termos(f"{entrada}\n{resposta}"))
+        comprimento = sum(contagem.values())
+        for termo, tf in contagem.items():
+            postings[_chave(usuario, termo)].append((i, min(tf, 65535)))
+        estatistica = por_usuario[_hash(usuario)]
+        estatistica[0] += 1
+        estatistica[1] += comprimento
+
+        texto = json.dumps({"usuario": usuario, "entrada": entrada, "resposta": resposta}, ensure_ascii=False).encode("utf-8")
+        textos.append(texto)
+        offsets.append(offsets[-1] + len(texto))
+        comprimentos.append(comprimento)
+        momentos.append(momento)
+
+    chaves = sorted(postings)
+    inicios = np.zeros(len(chaves) + 1, dtype=np.int64)
+    inicios[1:] = np.cumsum([len(postings[c]) for c in chaves])
+    pares = np.array([par for c in chaves for par in postings[c]], dtype=np.int64).reshape(-1, 2)
+    usuarios = sorted(por_usuario)
+
+    arrays = {
+        "chaves": np.array(chaves, dtype=np.uint64),
+        "inicios": inicios,
+        "docs": pares[:, 0].astype(np.int32),
+        "tfs": pares[:, 1].astype(np.uint16),
+        "comprimentos": np.array(comprimentos, dtype=np.int32),
+        "momentos": np.array(momentos, dtype=np.float64),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "ids": np.sort(np.array([d[0] for d in documentos], dtype=np.uint64)),
+        "usuarios": np.array(usuarios, dtype=np.uint64),
+        "usuarios_docs": np.array([por_usuario[u][0] for u in usuarios], dtype=np.int64),
+        "usuarios_tamanho": np.array([por_usuario[u][1] for u in usuarios], dtype=np.int64)
+    }
+    return arrays, [b"".join(textos)]
+
+def _mesclar(segmentos: list) -> tuple:
+    """Junta segmentos sem retokenizar: postings reagrupados por chave com os docs deslocados"""
+    chaves, docs, tfs = [], [], []
+    base = 0
+    for seg in segmentos:
+        chaves.append(np.repeat(np.asarray(seg.chaves), np.diff(seg.inicios)))
+        docs.append(np.asarray(seg.docs, dtype=np.int64) + base)
+        tfs.append(np.asarray(seg.tfs))
+        base += seg.n_docs
+    chaves = np.concatenate(chaves)
+    ordem = np.argsort(chaves, kind="stable")
+    chaves, docs, tfs = chaves[ordem], np.concatenate(docs)[ordem], np.concatenate(tfs)[ordem]
+    unicas, inicios = np.unique(chaves, return_index=True)
+
+    offsets, deslocamento = [np.zeros(1, dtype=np.int64)], 0
+    for seg in segmentos:
+        offsets.append(np.asarray(seg.offsets[1:]) + deslocamento)
+        deslocamento += int(seg.offsets[-1])
+
+    usuarios = np.concatenate([seg.usuarios for seg in segmentos])
+    unicos, inverso = np.unique(usuarios, return_inverse=True)
+    arrays = {
+        "chaves": unicas,
+        "inicios": np.append(inicios, len(chaves)).astype(np.int64),
+        "docs": docs.astype(np.int32),
+        "tfs": tfs,
+        "comprimentos": np.concatenate([seg.comprimentos for seg in segmentos]),
+        "momentos": np.concatenate([seg.momentos for seg in segmentos]),
+        "offsets": np.concatenate(offsets),
+        "ids": np.sort(np.concatenate([seg.ids for seg in segmentos])),
+        "usuarios": unicos,
+        "usuarios_docs": np.bincount(inverso, np.concatenate([seg.usuarios_docs for seg in segmentos])).astype(np.int64),
+        "usuarios_tamanho": np.bincount(inverso, np.concatenate([seg.usuarios_tamanho for seg in segmentos])).astype(np.int64)
+    }
+    return arrays, [seg.textos for seg in segmentos]
+
+class _Segmento:
+    """Segmento imutável do índice: arrays NumPy (mmap no disco ou em memória) e textos dos documentos"""
+    def __init__(self, arrays: dict, textos, nome: str = None):
+        self.nome = nome
+        for campo in _ARRAYS:
+            setattr(self, campo, arrays[campo])
+        self.textos = textos
+        self.n_docs = len(self.comprimentos)
+
+    @classmethod
+    def abrir(cls, caminho: str):
+        arrays = {campo: np.load(os.path.join(caminho, f"{campo}.npy"), mmap_mode="r") for campo in _ARRAYS}
+        arquivo = os.path.join(caminho, "textos.bin")
+        textos = np.memmap(arquivo, dtype=np.uint8, mode="r") if os.path.getsize(arquivo) else np.empty(0, np.uint8)
+        return cls(arrays, textos, os.path.basename(caminho))
+
+    @staticmethod
+    def gravar(caminho: str, arrays: dict, textos: list):
+        temporario = caminho + ".tmp"
+        shutil.rmtree(temporario, ignore_errors=True)
+        os.makedirs(temporario)
+        for campo in _ARRAYS:
+            np.save(os.path.join(temporario, f"{campo}.npy"), arrays[campo])
+        with open(os.path.join(temporario, "textos.bin"), "wb") as f:
+            for parte in textos:
+                f.write(memoryview(parte))
+        os.replace(temporario, caminho)
+
+    def postings(self, chave: int):
+        i = int(np.searchsorted(self.chaves, np.uint64(chave)))
+        if i >= len(self.chaves) or int(self.chaves[i]) != chave:
+            return None
+        inicio, fim = int(self.inicios[i]), int(self.inicios[i + 1])
+        return np.asarray(self.docs[inicio:fim]), np.asarray(self.tfs[inicio:fim], dtype=np.float32)
+
+    def estatisticas_usuario(self, chave: int) -> tuple:
+        i = int(np.searchsorted(self.usuarios, np.uint64(chave)))
+        if i >= len(self.usuarios) or int(self.usuarios[i]) != chave:
+            return 0, 0
+        return int(self.usuarios_docs[i]), int(self.usuarios_tamanho[i])
+
+    def contem(self, ids: np.ndarray) -> np.ndarray:
+        if not len(self.ids):
+            return np.zeros(len(ids), dtype=bool)
+        posicoes = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.asarray(self.ids)[posicoes] == ids
+
+    def documento(self, i: int) -> dict:
+        inicio, fim = int(self.offsets[i]), int(self.offsets[i + 1])
+        dados = json.loads(bytes(self.textos[inicio:fim]).decode("utf-8"))
+        dados["momento"] = float(self.momentos[i])
+        return dados
+
+class MemoryIndex:
+    """Memória de longo prazo: índice invertido BM25 por usuário sobre as trocas anteriores.
+
+    Trocas novas ficam em memória e viram segmentos imutáveis no disco (abertos com mmap);
+    os logs de conversa alimentam o índice de forma incremental.
+    """
+    def __init__(self, diretorio: str = MEMORIA_DIR, lote: int = LOTE_MEMORIA, max_segmentos: int = MAX_SEGMENTOS):
+        self.diretorio = diretorio
+        self.lote = lote
+        self.max_segmentos = max_segmentos
+        os.makedirs(diretorio, exist_ok=True)
+
+        self._indice_path = os.path.join(diretorio, "indice.json")
+        try:
+            with open(self._indice_path, encoding="utf-8") as f:
+                self._estado = json.load(f)
+        except (OSError, ValueError):
+            self._estado = {"segmentos": [], "proximo": 0, "logs": {"arquivos": {}, "assinaturas": {}}}
+
+        self._segmentos = []
+        for nome in self._estado["segmentos"]:
+            try:
+                self._segmentos.append(_Segmento.abrir(os.path.join(diretorio, nome)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Segmento {nome} ignorado: {str(e)}")
+
+        self._pendentes = []          # Documentos ainda só em memória
+        self._ids_pendentes = set()
+        self._em_memoria = None       # Segmento construído a partir dos pendentes (refeito quando mudam)
+        self._gravando = []           # Segmentos em memória enquanto são gravados
+        self._lock = threading.Lock()     # Protege as listas acima
+        self._escrita = threading.Lock()  # Uma gravação/ingestão/mesclagem por vez
+        self._thread = None
+
+    def iniciar(self, diretorio_logs: str = LOG_DIR):
+        """Ingere os logs em segundo plano (só as linhas novas desde a última execução)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.ingerir_logs, args=(diretorio_logs,), name="memoria", daemon=True)
+            self._thread.start()
+
+    def fechar(self, timeout: float = 30.0):
+        """Aguarda a ingestão e grava as trocas pendentes"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.descarregar()
+
+    def indexar(self, usuario, entrada: str, resposta: str, momento: float = None) -> bool:
+        """Acrescenta uma troca ao índice (em memória; vai para o disco em lotes)"""
+        if not indexavel(entrada, resposta):
+            return False
+        documento = _documento(usuario, entrada, resposta, momento or time.time())
+        with self._lock:
+            if documento[0] in self._ids_pendentes or self._contem(documento[0], self._segmentos + self._gravando):
+                return False
+            self._pendentes.append(documento)
+            self._ids_pendentes.add(documento[0])
+            self._em_memoria = None
+            cheio = len(self._pendentes) >= self.lote
+        if cheio:
+            threading.Thread(target=self.descarregar, name="memoria-lote", daemon=True).start()
+        return True
+
+    def buscar(self, usuario, consulta: str, k: int = 3) -> list:
+        """As `k` trocas anteriores do usuário mais relevantes para a consulta (BM25)"""
+        palavras = set(termos(consulta))
+        if not palavras:
+            return []
+
+        usuario = str(usuario)
+        segmentos = self._visiveis()
+        n_docs, tamanho = 0, 0
+        chave_usuario = _hash(usuario)
+        for seg in segmentos:
+            n, t = seg.estatisticas_usuario(chave_usuario)
+            n_docs += n
+            tamanho += t
+        if not n_docs:
+            return []
+        media = max(tamanho / n_docs, 1.0)
+
+        # Postings de cada termo em todos os segmentos; o df é a soma entre segmentos
+        achados, df = [], Counter()
+        for termo in palavras:
+            chave = _chave(usuario, termo)
+            for j, seg in enumerate(segmentos):
+                encontrado = seg.postings(chave)
+                if encontrado is not None:
+                    achados.append((j, termo, *encontrado))
+                    df[termo] += len(encontrado[0])
+        if not achados:
+            return []
+
+        globais, pontuacoes = [], []
+        for j, termo, docs, tfs in achados:
+            idf = np.log1p((n_docs - df[termo] + 0.5) / (df[termo] + 0.5))
+            comprimentos = np.asarray(segmentos[j].comprimentos[docs], dtype=np.float32)
+            pontuacoes.append(idf * tfs * (K1 + 1) / (tfs + K1 * (1 - B + B * comprimentos / media)))
+            globais.append(docs.astype(np.int64) + (j << 32))
+
+        unicos, inverso = np.unique(np.concatenate(globais), return_inverse=True)
+        totais = np.bincount(inverso, np.concatenate(pontuacoes))
+        melhores = np.argsort(-totais)[:k] if len(totais) <= k else np.argpartition(-totais, k)[:k]
+        melhores = melhores[np.argsort(-totais[melhores])]
+
+        resultado = []
+        for i in melhores:
+            j, doc = int(unicos[i]) >> 32, int(unicos[i]) & 0xFFFFFFFF
+            dados = segmentos[j].documento(doc)
+            dados["pontuacao"] = float(totais[i])
+            resultado.append(dados)
+        return resultado
+
+    def descarregar(self) -> int:
+        """Grava as trocas pendentes como um novo segmento"""
+        with self._escrita:
+            with self._lock:
+                if not self._pendentes:
+                    return 0
+                documentos, self._pendentes, self._ids_pendentes = self._pendentes, [], set()
+                self._em_memoria = None
+            # Continuam visíveis às buscas enquanto o segmento é gravado
+            construido = _construir(documentos)
+            em_memoria = _Segmento(construido[0], construido[1][0])
+            with self._lock:
+                self._gravando.append(em_memoria)
+            try:
+                self._adicionar_segmento(construido)
+            finally:
+                with self._lock:
+                    self._gravando.remove(em_memoria)
+            return len(documentos)
+
+    def ingerir_logs(self, diretorio: str = LOG_DIR) -> int:
+        """Indexa as trocas ainda não lidas dos logs de conversa"""
+        inicio = time.perf_counter()
+        with self._escrita:
+            documentos = []
+            arquivos = arquivos_de_log(diretorio)
+            for caminho in arquivos:
+                try:
+                    for linha in linhas_novas(caminho, self._estado["logs"]):
+                        documento = _de_registro(linha)
+                        if documento is not None:
+                            documentos.append(documento)
+                except (OSError, RuntimeError) as e:
+                    logger.warning(f"⚠️ Log {caminho} ignorado: {str(e)}")
+
+            for caminho in set(self._estado["logs"]["arquivos"]) - set(arquivos):
+                del self._estado["logs"]["arquivos"][caminho]
+
+            documentos = self._novos(documentos)
+            for i in range(0, len(documentos), LOTE_INGESTAO):
+                self._adicionar_segmento(_construir(documentos[i:i + LOTE_INGESTAO]))
+            self._salvar_estado()
+
+        if documentos:
+            logger.info(f"🧠 {len(documentos)} trocas dos logs indexadas em {time.perf_counter() - inicio:.2f}s")
+        return len(documentos)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            segmentos = list(self._segmentos)
+            pendentes = len(self._pendentes)
+        return {
+            "segmentos": len(segmentos),
+            "documentos": sum(seg.n_docs for seg in segmentos) + pendentes,
+            "pendentes": pendentes,
+            "bytes_disco": sum(
+                os.path.getsize(os.path.join(self.diretorio, seg.nome, arquivo))
+                for seg in segmentos for arquivo in os.listdir(os.path.join(self.diretorio, seg.nome))
+            )
+        }
+
+    def _visiveis(self) -> list:
+        with self._lock:
+            if self._em_memoria is None and self._pendentes:
+                arrays, textos = _construir(self._pendentes)
+                self._em_memoria = _Segmento(arrays, textos[0])
+            return self._segmentos + self._gravando + ([self._em_memoria] if self._em_memoria else [])
+
+    @staticmethod
+    def _contem(id_documento: int, segmentos: list) -> bool:
+        ids = np.array([id_documento], dtype=np.uint64)
+        return any(seg.contem(ids)[0] for seg in segmentos)
+
+    def _novos(self, documentos: list) -> list:
+        """Remove documentos já indexados (ou repetidos na própria lista)"""
+        if not documentos:
+            return documentos
+        ids = np.array([d[0] for d in documentos], dtype=np.uint64)
+        existentes = np.zeros(len(ids), dtype=bool)
+        with self._lock:
+            segmentos = self._segmentos + self._gravando
+            pendentes = set(self._ids_pendentes)
+        for seg in segmentos:
+            existentes |= seg.contem(ids)
+
+        vistos, novos = set(pendentes), []
+        for documento, existente in zip(documentos, existentes):
+            if not existente and documento[0] not in vistos:
+                vistos.add(documento[0])
+                novos.append(documento)
+        return novos
+
+    def _adicionar_segmento(self, construido: tuple):
+        """Grava um segmento e o publica; mescla tudo se houver segmentos demais (chamar com _escrita)"""
+        nome = self._novo_nome()
+        _Segmento.gravar(os.path.join(self.diretorio, nome), *construido)
+        segmento = _Segmento.abrir(os.path.join(self.diretorio, nome))
+        with self._lock:
+            self._segmentos.append(segmento)
+        self._salvar_estado()
+
+        if len(self._segmentos) > self.max_segmentos:
+            self._compactar()
+
+    def _compactar(self):
+        inicio = time.perf_counter()
+        antigos = list(self._segmentos)
+        nome = self._novo_nome()
+        _Segmento.gravar(os.path.join(self.diretorio, nome), *_mesclar(antigos))
+        mesclado = _Segmento.abrir(os.path.join(self.diretorio, nome))
+        with self._lock:
+            self._segmentos = [mesclado]
+        self._salvar_estado()
+
+        # Buscas em andamento mantêm os arquivos antigos mapeados até terminarem
+        for seg in antigos:
+            shutil.rmtree(os.path.join(self.diretorio, seg.nome), ignore_errors=True)
+        logger.info(f"🗜️ {len(antigos)} segmentos da memória mesclados em {time.perf_counter() - inicio:.2f}s")
+
+    def _novo_nome(self) -> str:
+        nome = f"segmento_{self._estado['proximo']:06d}"
+        self._estado["proximo"] += 1
+        return nome
+
+    def _salvar_estado(self):
+        with self._lock:
+            self._estado["segmentos"] = [seg.nome for seg in self._segmentos]
+        temporario = self._indice_path + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self._estado, f, ensure_ascii=False)
+        os.replace(temporario, self._indice_path)
+
+def _de_registro(linha: bytes):
+    """Documento a partir de uma linha de log do bot (input/user_id) ou da CLI (user_input)"""
+    try:
+        registro = json.loads(linha)
+        momento = datetime.fromisoformat(registro["timestamp"]).timestamp()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    entrada = registro.get("input") or registro.get("user_input")
+    resposta = registro.get("response")
+    if not indexavel(entrada, resposta, registro.get("falha", False)):
+        return None
+    # A CLI registra sempre o mesmo usuário ("default")
+    return _documento(registro.get("user_id", "default"), entrada, resposta.strip(), momento)
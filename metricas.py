@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('Métricas')
+
+# Limites (s) dos buckets de latência
+BUCKETS_PADRAO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus"""
+    def __init__(self, buckets=BUCKETS_PADRAO):
+        self.buckets = tuple(buckets)
+        self.contagens = [0] * (len(self.buckets) + 1)  # Último: +Inf
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        else:
+            self.contagens[-1] += 1
+        self.soma += valor
+        self.total += 1
+
+class Metricas:
+    """Spans por estágio, histogramas e contadores exportados em texto Prometheus"""
+    def __init__(self, prefixo: str = "asteria"):
+        self.prefixo = prefixo
+        self._histogramas = {}  # {(nome, labels): Histograma}
+        self._contadores = {}   # {(nome, labels): float}
+        self._ajudas = {}
+        self._lock = threading.Lock()
+
+    def observar(self, nome: str, valor: float, ajuda: str = "", **labels):
+        chave = (nome, tuple(sorted(labels.items())))
+        with self._lock:
+            if chave not in self._histogramas:
+                self._histogramas[chave] = Histograma()
+            if ajuda:
+                self._ajudas[nome] = ajuda
+            self._histogramas[chave].observar(valor)
+
+    def incrementar(self, nome: str, valor: float = 1, ajuda: str = "", **labels):
+        chave = (nome, tuple(sorted(labels.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+            if ajuda:
+                self._ajudas[nome] = ajuda
+
+    def estagio(self, estagio: str, duracao: float):
+        """Registra a duração de um estágio do atendimento"""
+        self.observar("estagio_segundos", duracao, "Duração de cada estágio do atendimento", estagio=estagio)
+
+    def erro(self, origem: str):
+        self.incrementar("erros_total", ajuda="Erros por origem", origem=origem)
+
+    @contextmanager
+    def span(self, estagio: str):
+        """Mede o bloco como um estágio; exceções também são contadas como erro"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.erro(estagio)
+            raise
+        finally:
+            self.estagio(estagio, time.perf_counter() - inicio)
+
+    def exportar(self) -> str:
+        """Texto no formato de exposição do Prometheus"""
+        linhas = []
+        with self._lock:
+            vistos = set()
+            for (nome, labels), hist in sorted(self._histogramas.items()):
+                completo = f"{self.prefixo}_{nome}"
+                if nome not in vistos:
+                    vistos.add(nome)
+                    linhas.append(f"# HELP {completo} {self._ajudas.get(nome, '')}")
+                    linhas.append(f"# TYPE {completo} histogram")
+                acumulado = 0
+                for limite, contagem in zip(hist.buckets + (float("inf"),), hist.contagens):
+                    acumulado += contagem
+                    le = "+Inf" if limite == float("inf") else repr(limite)
+                    linhas.append(f"{completo}_bucket{_labels(labels + (('le', le),))} {acumulado}")
+                linhas.append(f"{completo}_sum{_labels(labels)} {hist.soma}")
+                linhas.append(f"{completo}_count{_labels(labels)} {hist.total}")
+
+            for (nome, labels), valor in sorted(self._contadores.items()):
+                completo = f"{self.prefixo}_{nome}"
+                if nome not in vistos:
+                    vistos.add(nome)
+                    linhas.append(f"# HELP {completo} {self._ajudas.get(nome, '')}")
+                    linhas.append(f"# TYPE {completo} counter")
+                linhas.append(f"{completo}{_labels(labels)} {valor}")
+        return "\n".join(linhas) + "\n"
+
+    def gravar_arquivo(self, caminho: str):
+        """Grava atomicamente (útil para o textfile collector do node_exporter)"""
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(self.exportar())
+        os.replace(temporario, caminho)
+
+    def iniciar_servidor(self, porta: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Endpoint local /metrics em uma thread de fundo"""
+        metricas = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                corpo = metricas.exportar().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer((host, porta), Handler)
+        threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+        logger.info(f"📈 Métricas em http://{host}:{porta}/metrics")
+        return servidor
+
+    def gravar_periodicamente(self, caminho: str, intervalo: float = 15.0):
+        """Regrava o arquivo de métricas a cada `intervalo` segundos"""
+        def loop():
+            while True:
+                try:
+                    self.gravar_arquivo(caminho)
+                except OSError as e:
+                    logger.warning(f"⚠️ Falha ao gravar métricas: {str(e)}")
+                time.sleep(intervalo)
+
+        threading.Thread(target=loop, name="metricas-arquivo", daemon=True).start()
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pares = ",".join(f'{k}="{_escapar(v)}"' for k, v in labels)
+    return "{" + pares + "}"
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Instância compartilhada pelo bot, workers e escalonador
+metricas = Metricas()
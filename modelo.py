@@ -1,56 +1,244 @@
 import os
+import json
+import threading
+import urllib.request
 from llama_cpp import Llama
 import logging
 import time
 import psutil
 
+from especulativo import MODOS, PADROES_ESPECULACAO, criar_rascunho, vocabulario_compativel
+
 logger = logging.getLogger('Modelo')
 
-def carregar_modelo():
-    """Carrega o modelo com configurações ultra-otimizadas para baixa latência"""
-    modelo_path = "models/Nous-Hermes-2-Mistral-7B-DPO.Q2_K.gguf"
+CONFIG_PATH = os.getenv("ASTERIA_MODELOS_CONFIG", "modelos.json")
+AUTOTUNE_PATH = os.getenv("ASTERIA_AUTOTUNE", "models/autotune.json")
+
+# Parâmetros do Llama comuns a todas as variantes (sobrescrevíveis no config)
+PADROES_LLAMA = {
+    "n_gpu_layers": 0,
+    "use_mmap": True,                # Pesos mapeados: page cache compartilhado entre processos
+    "use_mlock": False,
+    "offload_kqv": True,
+    "seed": 42,
+    "verbose": False
+}
+
+# Chaves do config que não são parâmetros do Llama
+_CHAVES_REGISTRO = {"arquivo", "url", "aquecimento", "especulativo"}
+
+def normalizar_caminho(caminho: str) -> str:
+    return os.path.normcase(os.path.abspath(caminho))
+
+def mesmo_arquivo(a: str, b: str) -> bool:
+    """Compara caminhos de GGUF independente de "./", barras repetidas ou caminho absoluto"""
+    return normalizar_caminho(a) == normalizar_caminho(b)
+
+class ModelRegistry:
+    """Registro único das variantes GGUF, carregadas sob demanda e compartilhadas"""
+    def __init__(self, config_path: str = CONFIG_PATH, autotune_path: str = AUTOTUNE_PATH):
+        self.config_path = config_path
+        self.autotune_path = autotune_path
+        self._config = None
+        self._autotune = None
+        self._instancias = {}
+        self._vocabularios = {}
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        if self._config is None:
+            with open(self.config_path, encoding="utf-8") as f:
+                self._config = json.load(f)
+        return self._config
+
+    @property
+    def autotune(self) -> dict:
+        """Calibração gravada por autotune.py (vazia se ainda não foi executada)"""
+        if self._autotune is None:
+            try:
+                with open(self.autotune_path, encoding="utf-8") as f:
+                    self._autotune = json.load(f)
+            except (OSError, ValueError):
+                self._autotune = {}
+        return self._autotune
+
+    def resolver(self, nome: str = None) -> str:
+        """Nome da variante a partir de um nome, perfil (ex.: 'bot', 'cli') ou ASTERIA_MODELO"""
+        nome = os.getenv("ASTERIA_MODELO") or nome or self.config["padrao"]
+        nome = self.config.get("perfis", {}).get(nome, nome)
+        if nome == "auto":
+            nome = self._variante_autotune()
+        if nome not in self.config["modelos"]:
+            raise KeyError(f"Modelo desconhecido: {nome}")
+        return nome
+
+    def variante(self, nome: str = None) -> dict:
+        return self.config["modelos"][self.resolver(nome)]
+
+    def parametros(self, nome: str = None) -> dict:
+        """Argumentos do `Llama(...)` para a variante, com overrides de ambiente"""
+        return self._parametros(self.variante(nome))
+
+    def especulacao(self, nome: str = None, modo: str = None) -> dict:
+        """Decodificação especulativa da variante: seção "especulativo" do config, sobrescrita pela da
+        variante, por ASTERIA_ESPECULATIVO / ASTERIA_RASCUNHO e por `modo`. No modo "rascunho", inclui
+        os parâmetros do GGUF de rascunho (baixado se ausente), com o mesmo n_ctx do modelo principal.
+        """
+        config = {
+            **PADROES_ESPECULACAO,
+            **self.config.get("especulativo", {}),
+            **self.variante(nome).get("especulativo", {})
+        }
+        config["modo"] = modo or os.getenv("ASTERIA_ESPECULATIVO") or config["modo"]
+        config["rascunho"] = os.getenv("ASTERIA_RASCUNHO") or config["rascunho"]
+        if config["modo"] not in MODOS:
+            raise ValueError(f"Modo especulativo desconhecido: {config['modo']} (use {', '.join(MODOS)})")
+
+        if config["modo"] == "rascunho":
+            if config["rascunho"] not in self.config["modelos"]:
+                raise KeyError(f"Modelo de rascunho desconhecido: {config['rascunho']}")
+            variante = self.config["modelos"][config["rascunho"]]
+            self._baixar_se_ausente(variante)
+            config["parametros_rascunho"] = {
+                **self._parametros(variante),
+                "n_ctx": self.parametros(nome)["n_ctx"]
+            }
+        return config
+
+    def _parametros(self, variante: dict) -> dict:
+        params = {**PADROES_LLAMA, **{k: v for k, v in variante.items() if k not in _CHAVES_REGISTRO}}
+        params["model_path"] = variante["arquivo"]
+
+        # Threads e batch calibrados para esta máquina
+        calibrado = next((
+            r for arquivo, r in self.autotune.get("por_arquivo", {}).items()
+            if mesmo_arquivo(arquivo, variante["arquivo"])
+        ), None)
+        if calibrado:
+            params["n_threads"] = calibrado["n_threads"]
+            params["n_batch"] = calibrado["n_batch"]
+
+        if os.getenv("USE_GPU") == "1":
+            params["n_gpu_layers"] = int(os.getenv("ASTERIA_GPU_LAYERS", "40"))
+        if os.getenv("ASTERIA_N_THREADS"):
+            params["n_threads"] = int(os.getenv("ASTERIA_N_THREADS"))
+        if os.getenv("ASTERIA_N_CTX"):
+            params["n_ctx"] = int(os.getenv("ASTERIA_N_CTX"))
+        if params.get("n_threads") == "fisicos":
+            params["n_threads"] = psutil.cpu_count(logical=False) or os.cpu_count()
+
+        return params
+
+    def obter(self, nome: str = None) -> Llama:
+        """Instância da variante, carregada na primeira chamada e reutilizada depois"""
+        nome = self.resolver(nome)
+        with self._lock:
+            if nome not in self._instancias:
+                self._instancias[nome] = self._carregar(nome)
+            return self._instancias[nome]
+
+    def tokenizador(self, nome: str = None) -> Llama:
+        """Instância já carregada ou só o vocabulário da variante (tokenize/detokenize sem os pesos)"""
+        nome = self.resolver(nome)
+        with self._lock:
+            if nome in self._instancias:
+                return self._instancias[nome]
+            if nome not in self._vocabularios:
+                self._baixar_se_ausente(self.config["modelos"][nome])
+                self._vocabularios[nome] = Llama(
+                    model_path=self.parametros(nome)["model_path"], vocab_only=True, verbose=False
+                )
+            return self._vocabularios[nome]
+
+    def relatorio(self) -> dict:
+        """Tempo de carga e memória residente de cada modelo carregado (e a aceitação do rascunho, se houver)"""
+        relatorio = {nome: dict(metricas) for nome, metricas in self._metricas.items()}
+        for nome, model in self._instancias.items():
+            if hasattr(model.draft_model, "estatisticas"):
+                relatorio[nome]["rascunho"] = model.draft_model.estatisticas()
+        return relatorio
+
+    def _variante_autotune(self) -> str:
+        """Variante do arquivo recomendado pelo autotune; sem calibração, a padrão"""
+        recomendado = self.autotune.get("recomendado")
+        if not recomendado:
+            return self.config["padrao"]
+
+        for nome, variante in self.config["modelos"].items():
+            if mesmo_arquivo(variante["arquivo"], recomendado):
+                return nome
+
+        # GGUF presente em models/ mas fora do config: herda os parâmetros da padrão
+        nome = f"auto:{os.path.basename(recomendado)}"
+        padrao = self.config["modelos"][self.config["padrao"]]
+        self.config["modelos"][nome] = {**padrao, "arquivo": recomendado, "url": None}
+        return nome
+
+    def _carregar(self, nome: str) -> Llama:
+        variante = self.config["modelos"][nome]
+        params = self.parametros(nome)
+        self._baixar_se_ausente(variante)
+
+        logger.info(f"⏳ Carregando modelo {nome}...")
+        processo = psutil.Process()
+        rss_antes = processo.memory_info().rss
+        start = time.time()
+
+        especulacao = self.especulacao(nome)
+        rascunho = criar_rascunho(especulacao)
+        model = Llama(**params, draft_model=rascunho)
+        if not vocabulario_compativel(model, rascunho):
+            logger.warning(f"⚠️ Rascunho {especulacao['rascunho']} com vocabulário diferente de {nome}; especulação desligada")
+            model.draft_model = None
+
+        # Pré-aquecimento eficiente
+        if variante.get("aquecimento"):
+            logger.info("🔥 Pré-aquecendo para streaming...")
+            warmup_prompt = "Pre-aquecendo " * 20
+            for _ in range(variante["aquecimento"]):
+                model.create_completion(warmup_prompt, max_tokens=1)
+
+        self._metricas[nome] = {
+            "arquivo": params["model_path"],
+            "tempo_carga": time.time() - start,
+            "rss_mb": (processo.memory_info().rss - rss_antes) / 1024 / 1024,
+            "tamanho_arquivo_mb": os.path.getsize(params["model_path"]) / 1024 / 1024,
+            "n_threads": params.get("n_threads"),
+            "n_ctx": params.get("n_ctx"),
+            "especulativo": especulacao["modo"] if model.draft_model is not None else "nenhum"
+        }
+        logger.info(
+            f"✅ Modelo {nome} carregado em {self._metricas[nome]['tempo_carga']:.2f}s "
+            f"(+{self._metricas[nome]['rss_mb']:.0f} MB RSS)"
+        )
+        return model
+
+    def _baixar_se_ausente(self, variante: dict):
+        caminho = variante["arquivo"]
+        if os.path.exists(caminho):
+            return
 
-    if not os.path.exists(modelo_path):
         # Tenta baixar automaticamente se não encontrar
+        if not variante.get("url"):
+            raise FileNotFoundError(f"Modelo não encontrado: {caminho}")
         try:
-            logger.warning("Modelo não encontrado. Baixando...")
-            os.system('wget https://gpt4all.io/models/gguf/nous-hermes-2-mistral-7b-dpo.Q2_K.gguf -P models/')
+            logger.warning(f"Modelo não encontrado. Baixando {variante['url']}...")
+            os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+            urllib.request.urlretrieve(variante["url"], caminho + ".part")
+            os.replace(caminho + ".part", caminho)
         except Exception as e:
             raise FileNotFoundError(f"Falha ao baixar modelo: {str(e)}")
 
-    logger.info("⏳ Carregando modelo com configurações de alto desempenho...")
-
-    # Configurações para máxima velocidade
-    model = Llama(
-        model_path=modelo_path,
-        n_ctx=1024,                  # Contexto reduzido
-        n_threads=max(psutil.cpu_count(logical=False),  # Usa apenas cores físicos
-        n_gpu_layers=0,              # CPU-only para melhor compatibilidade
-        n_batch=512,                 # Batch maior para eficiência
-        use_mmap=True,               # Uso de mmap para carregamento rápido
-        use_mlock=False,             # Desativar mlock para evitar problemas
-        offload_kqv=True,            # Descarregar camadas críticas
-        main_gpu=0,                  # GPU principal
-        tensor_split=[0],            # Alocação de VRAM
-        seed=42,                     # Seed fixa para consistência
-        low_vram=True,               # Modo de baixo consumo de VRAM
-        verbose=False                # Sem logs internos
-    ))
-
-    # Pré-aquecimento eficiente
-    logger.info("🔥 Pré-aquecendo para streaming...")
-    start = time.time()
-    warmup_prompt = "Pre-aquecendo " * 20
-
-    # Pré-aquecimento em 2 estágios
-    for _ in range(3):
-        model.create_completion(warmup_prompt, max_tokens=1)
-
-    logger.info(f"⚡ Pré-aquecimento concluído em {time.time() - start:.2f}s")
-
-    return model
-
-# Teste de desempenho integrado
+# Registro compartilhado por bot.py, main.py e demais subsistemas
+registro = ModelRegistry()
+
+def carregar_modelo(nome: str = None) -> Llama:
+    """Carrega (uma única vez) o modelo configurado em modelos.json"""
+    return registro.obter(nome)
+
+# Teste rápido de desempenho (benchmark completo: benchmark.py)
 if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -64,7 +252,7 @@ if __name__ == "__main__":
         response = model.create_completion(prompt, max_tokens=50, temperature=0.7)
         elapsed = time.time() - start
 
-        tokens = len(response['choices'][0]['text'].split())
+        tokens = response['usage']['completion_tokens']
         logger.info(f"⚡ Tokens gerados: {tokens}")
         logger.info(f"⏱️ Tempo total: {elapsed:.2f}s")
         logger.info(f"📝 Resposta: {response['choices'][0]['text']}")
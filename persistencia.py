@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from estado_usuarios import EmotionRing
+from metricas import metricas
+
+logger = logging.getLogger('Persistência')
+
+DB_PATH = os.getenv("ASTERIA_PERSONA_DB", "data/persona.db")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (
+    user_id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    historico_emocional BLOB,
+    conversa TEXT,
+    atualizado_em REAL NOT NULL
+)
+"""
+
+class PersonaStore:
+    """Estado da persona por usuário em SQLite (WAL), gravado em lotes por uma thread de fundo"""
+    def __init__(self, caminho: str = DB_PATH, intervalo: float = 5.0, lote: int = 256):
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self.lote = lote
+
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        self._escrita = self._conectar()
+        self._escrita.execute("PRAGMA journal_mode=WAL")
+        self._escrita.execute(_ESQUEMA)
+        self._escrita.commit()
+        self._lock_escrita = threading.Lock()
+
+        # Leituras usam uma conexão própria: no WAL não esperam as gravações
+        self._leitura = self._conectar()
+        self._lock_leitura = threading.Lock()
+
+        self._pendentes = {}  # {chave: (user_id, estado, historico, conversa)}
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executar, name="persistencia", daemon=True)
+            self._thread.start()
+
+    def fechar(self, timeout: float = 10.0):
+        """Para a thread e grava o que ainda estiver pendente"""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.descarregar()
+        self._leitura.close()
+        self._escrita.close()
+
+    def marcar(self, user_id, estado: dict, historico_emocional: np.ndarray = None, conversa=None):
+        """Agenda a gravação do estado do usuário (só o instantâneo mais recente é gravado)"""
+        with self._lock:
+            self._pendentes[_chave(user_id)] = (user_id, estado, historico_emocional, conversa)
+            cheio = len(self._pendentes) >= self.lote
+        if cheio:
+            self._acordar.set()
+
+    def carregar(self, user_id):
+        """Estado persistido do usuário, ou None se for desconhecido"""
+        chave = _chave(user_id)
+        with self._lock:
+            pendente = self._pendentes.get(chave)
+        if pendente is not None:
+            _, estado, historico, conversa = pendente
+            return {"estado": estado, "historico_emocional": historico, "conversa": conversa}
+
+        with self._lock_leitura:
+            linha = self._leitura.execute(
+                "SELECT estado, historico_emocional, conversa FROM usuarios WHERE user_id = ?", (chave,)
+            ).fetchone()
+        if linha is None:
+            return None
+
+        estado, historico, conversa = linha
+        return {
+            "estado": json.loads(estado),
+            "historico_emocional": np.frombuffer(historico, dtype=EmotionRing.DTYPE) if historico else None,
+            "conversa": json.loads(conversa) if conversa else None
+        }
+
+    def descarregar(self) -> int:
+        """Grava os pendentes em uma única transação"""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        if not pendentes:
+            return 0
+
+        inicio = time.perf_counter()
+        linhas = [
+            (
+                chave,
+                json.dumps(estado),
+                historico.tobytes() if historico is not None else None,
+                json.dumps(conversa, ensure_ascii=False) if conversa is not None else None,
+                time.time()
+            )
+            for chave, (_, estado, historico, conversa) in pendentes.items()
+        ]
+        try:
+            with self._lock_escrita, self._escrita:
+                self._escrita.executemany(
+                    "INSERT OR REPLACE INTO usuarios "
+                    "(user_id, estado, historico_emocional, conversa, atualizado_em) VALUES (?, ?, ?, ?, ?)",
+                    linhas
+                )
+        except sqlite3.Error as e:
+            logger.error(f"🔴 Falha ao gravar estado da persona: {str(e)}")
+            metricas.erro("persistencia")
+            # Devolve à fila sem sobrescrever instantâneos mais novos
+            with self._lock:
+                for chave, registro in pendentes.items():
+                    self._pendentes.setdefault(chave, registro)
+            return 0
+        finally:
+            metricas.estagio("persistencia", time.perf_counter() - inicio)
+
+        logger.debug(f"💾 {len(linhas)} usuários gravados")
+        return len(linhas)
+
+    def _conectar(self) -> sqlite3.Connection:
+        conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+        conexao.execute("PRAGMA synchronous=NORMAL")
+        return conexao
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            self.descarregar()
+
+def _chave(user_id) -> str:
+    # Preserva o tipo: 123 (Discord) e "123" (CLI) são usuários diferentes
+    return json.dumps(user_id)
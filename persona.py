@@ -1,7 +1,72 @@
 import re
+import os
+import json
 import random
+import time
 from datetime import datetime, timedelta
-import numpy as np
+
+from estado_usuarios import EmotionStore, EmotionRing
+
+TOPICOS_PATH = os.getenv("ASTERIA_TOPICOS", "topicos.json")
+
+# Mapeamento de tópicos usado quando não há arquivo de configuração
+TOPICOS_PADRAO = {
+    "filosofia": ["filosof", "existência", "sentido", "moral", "ética", "cosmos"],
+    "lógica": ["lógica", "razão", "argumento", "paradoxo", "silogismo"],
+    "pessoal": ["eu ", "meu", "minha", "minhas coisas", "meus sentimentos"],
+    "relacional": ["você", "nós", "nosso", "juntos", "relacionamento"],
+    "tarefa": ["fazer", "tarefa", "problema", "solução", "ajuda"]
+}
+
+class TopicMatcher:
+    """Detecta todos os tópicos em uma única passada com uma regex compilada uma vez"""
+    def __init__(self, mapeamento: dict):
+        self.topicos = list(mapeamento)
+
+        # Termo -> tópicos. Um termo que casa em uma posição implica todos os termos
+        # que são prefixos dele, então seus tópicos são herdados
+        termos = {}
+        for topico, lista in mapeamento.items():
+            for termo in lista:
+                termos.setdefault(termo.lower(), set()).add(topico)
+        self._topicos_do_termo = {
+            termo: frozenset().union(*(t for outro, t in termos.items() if termo.startswith(outro)))
+            for termo in termos
+        }
+
+        # Lookahead: testa todas as posições; alternativas mais longas primeiro
+        alternativas = "|".join(re.escape(t) for t in sorted(termos, key=len, reverse=True))
+        self._regex = re.compile(f"(?=({alternativas}))") if termos else None
+
+    @classmethod
+    def do_arquivo(cls, caminho: str = TOPICOS_PATH) -> "TopicMatcher":
+        try:
+            with open(caminho, encoding="utf-8") as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return cls(TOPICOS_PADRAO)
+
+    def detectar(self, texto: str) -> list:
+        if self._regex is None:
+            return []
+
+        encontrados = set()
+        for match in self._regex.finditer(texto.lower()):
+            encontrados |= self._topicos_do_termo[match.group(1)]
+            if len(encontrados) == len(self.topicos):
+                break
+
+        # Mantém a ordem do mapeamento
+        return [t for t in self.topicos if t in encontrados]
+
+_matcher = None
+
+def obter_matcher() -> TopicMatcher:
+    """Matcher compartilhado, compilado na primeira chamada"""
+    global _matcher
+    if _matcher is None:
+        _matcher = TopicMatcher.do_arquivo()
+    return _matcher
 
 class Asteria:
     def __init__(self):
@@ -12,7 +77,7 @@ class Asteria:
             "que usa sarcasmo com quem confia. Fã de Reverend Insanity e entusiasta de lógica."
         )
 
-        # Sistema emocional multidimensional
+        # Sistema emocional multidimensional (estado inicial de cada usuário)
         self.emocao = {
             "valencia": 0.5,       # -1 (negativo) a 1 (positivo)
             "ativacao": 0.4,       # 0 (calmo) a 1 (excitado)
@@ -22,15 +87,14 @@ class Asteria:
 
         # Estados complexos
         self.estados = {
-            "fadiga_mental": 0.0,
-            "curiosidade": 0.8,
-            "confianca_usuario": 0.5,
-            "familiaridade": {}  # {user_id: 0-1}
+            "curiosidade": 0.8
         }
 
-        # Memória emocional
-        self.historico_emocional = []
-        self.ultima_interacao = datetime.now()
+        # Emoção, familiaridade, confiança e fadiga por usuário
+        self.usuarios = EmotionStore(iniciais=self.emocao)
+
+        # Memória emocional: buffer circular por usuário, criado na primeira interação
+        self.historicos = {}  # {user_id: EmotionRing}
 
         # Padrões comportamentais
         self.tendencias = {
@@ -51,6 +115,9 @@ class Asteria:
             }
         }
 
+        # Detector de tópicos compilado (compartilhado entre instâncias)
+        self.topicos = obter_matcher()
+
         # Fatores de personalidade (Big 5 adaptado)
         self.big5 = {
             "abertura": 0.9,
@@ -60,20 +127,15 @@ class Asteria:
             "neuroticismo": 0.3
         }
 
-    def _calcular_fadiga(self):
+    def _calcular_fadiga(self, user_id, agora):
         """Calcula fadiga mental baseada em tempo e intensidade de interações"""
-        tempo_ativo = (datetime.now() - self.ultima_interacao).total_seconds() / 3600
-        self.estados["fadiga_mental"] = min(1.0, 0.1 * tempo_ativo + 0.01 * len(self.historico_emocional))
+        return self.usuarios.fadiga(user_id, agora)
 
-    def _atualizar_familiaridade(self, user_id):
+    def _atualizar_familiaridade(self, user_id, agora):
         """Aumenta familiaridade com o usuário ao longo do tempo"""
-        if user_id not in self.estados["familiaridade"]:
-            self.estados["familiaridade"][user_id] = 0.1
-        else:
-            self.estados["familiaridade"][user_id] = min(
-                0.95,
-                self.estados["familiaridade"][user_id] + 0.05
-            )
+        estado = self.usuarios.obter(user_id, agora)
+        if estado["interacoes"] > 0:
+            self.usuarios.definir(user_id, agora, familiaridade=min(0.95, estado["familiaridade"] + 0.05))
 
     def _analisar_estrutura_texto(self, texto):
         """Analisa características linguísticas avançadas"""
@@ -93,36 +155,24 @@ class Asteria:
 
     def _detectar_topicos_chave(self, texto):
         """Identifica tópicos relevantes usando correspondência semântica"""
-        texto = texto.lower()
-        topicos = []
-
-        # Mapeamento de tópicos
-        mapeamento = {
-            "filosofia": ["filosof", "existência", "sentido", "moral", "ética", "cosmos"],
-            "lógica": ["lógica", "razão", "argumento", "paradoxo", "silogismo"],
-            "pessoal": ["eu ", "meu", "minha", "minhas coisas", "meus sentimentos"],
-            "relacional": ["você", "nós", "nosso", "juntos", "relacionamento"],
-            "tarefa": ["fazer", "tarefa", "problema", "solução", "ajuda"]
-        }
-
-        for topico, termos in mapeamento.items():
-            if any(termo in texto for termo in termos):
-                topicos.append(topico)
-
-        return topicos
+        return self.topicos.detectar(texto)
 
-    def _atualizar_estado_emocional(self, texto, user_id):
+    def _atualizar_estado_emocional(self, texto, user_id, topicos=None):
         """Atualiza o estado emocional com base em múltiplos fatores"""
+        agora = time.time()
+
         # Fatores temporais
-        self._calcular_fadiga()
+        fadiga = self._calcular_fadiga(user_id, agora)
 
         # Fatores relacionais
-        self._atualizar_familiaridade(user_id)
-        familiaridade = self.estados["familiaridade"].get(user_id, 0.1)
+        self._atualizar_familiaridade(user_id, agora)
+        estado = self.usuarios.obter(user_id, agora)
+        familiaridade = estado["familiaridade"]
 
         # Análise textual
         analise_texto = self._analisar_estrutura_texto(texto)
-        topicos = self._detectar_topicos_chave(texto)
+        if topicos is None:
+            topicos = self._detectar_topicos_chave(texto)
 
         # Impacto emocional
         impacto_valencia = 0
@@ -141,51 +191,51 @@ class Asteria:
         impacto_valencia += (analise_texto["complexidade"] - 0.5) * 0.3
 
         # Aplicar impactos com amortecimento
-        self.emocao["valencia"] = np.clip(
-            self.emocao["valencia"] + impacto_valencia * (1 - self.estados["fadiga_mental"]),
-            -1, 1
-        )
-
-        self.emocao["ativacao"] = np.clip(
-            self.emocao["ativacao"] + impacto_ativacao * (1 - self.estados["fadiga_mental"]),
-            0, 1
-        )
+        estado["valencia"] = min(1.0, max(-1.0, estado["valencia"] + impacto_valencia * (1 - fadiga)))
+        estado["ativacao"] = min(1.0, max(0.0, estado["ativacao"] + impacto_ativacao * (1 - fadiga)))
 
         # Atualizar estabilidade emocional
-        self.emocao["estabilidade"] = max(0.3, self.emocao["estabilidade"] - 0.05 * abs(impacto_valencia))
+        estado["estabilidade"] = max(0.3, estado["estabilidade"] - 0.05 * abs(impacto_valencia))
+
+        self.usuarios.definir(
+            user_id, agora,
+            valencia=estado["valencia"],
+            ativacao=estado["ativacao"],
+            estabilidade=estado["estabilidade"],
+            interacoes=min(100.0, estado["interacoes"] + 1),
+            ultima_interacao=agora
+        )
 
         # Atualizar histórico
-        self.historico_emocional.append({
-            "timestamp": datetime.now(),
-            "estado": self.emocao.copy(),
-            "input": texto[:100]
-        })
-        if len(self.historico_emocional) > 100:
-            self.historico_emocional.pop(0)
+        self.historico(user_id).adicionar(estado["valencia"], estado["ativacao"], agora)
 
-        self.ultima_interacao = datetime.now()
+    def historico(self, user_id):
+        """Histórico emocional do usuário (últimas 100 interações)"""
+        if user_id not in self.historicos:
+            self.historicos[user_id] = EmotionRing(capacidade=100)
+        return self.historicos[user_id]
 
-    def _calcular_tom_comportamental(self):
+    def _calcular_tom_comportamental(self, estado):
         """Determina o tom comportamental com base no estado emocional"""
         # Mapeamento dimensional para estados discretos
-        if self.emocao["valencia"] > 0.6:
-            if self.emocao["ativacao"] > 0.6:
+        if estado["valencia"] > 0.6:
+            if estado["ativacao"] > 0.6:
                 return "entusiasmado"
             return "contente"
 
-        elif self.emocao["valencia"] < -0.4:
-            if self.emocao["ativacao"] > 0.5:
+        elif estado["valencia"] < -0.4:
+            if estado["ativacao"] > 0.5:
                 return "irritado"
             return "desanimado"
 
-        if self.emocao["ativacao"] > 0.7:
+        if estado["ativacao"] > 0.7:
             return "energizado"
 
         return "neutro"
 
-    def _determinar_diretrizes_comportamentais(self, texto):
+    def _determinar_diretrizes_comportamentais(self, texto, estado, topicos=None):
         """Gera diretrizes para o LLM com base na personalidade e estado"""
-        tom = self._calcular_tom_comportamental()
+        tom = self._calcular_tom_comportamental(estado)
         diretrizes = []
 
         # Diretrizes baseadas no tom
@@ -197,13 +247,14 @@ class Asteria:
             diretrizes.append("Demonstre curiosidade e engajamento")
 
         # Diretrizes baseadas em tópicos
-        topicos = self._detectar_topicos_chave(texto)
+        if topicos is None:
+            topicos = self._detectar_topicos_chave(texto)
         if "filosofia" in topicos:
             diretrizes.append("Faça referência a conceitos filosóficos quando relevante")
             diretrizes.append("Relacione com pensadores ou obras filosóficas")
 
         # Diretrizes de personalidade
-        if self.tendencias["sarcasmo"]["prob_base"] > 0.3 and self.estados["confianca_usuario"] > 0.4:
+        if self.tendencias["sarcasmo"]["prob_base"] > 0.3 and estado["confianca"] > 0.4:
             diretrizes.append("Use sarcasmo moderado quando apropriado")
 
         if self.big5["abertura"] > 0.7:
@@ -213,25 +264,98 @@ class Asteria:
 
     def analisar_interacao(self, texto, user_id="default"):
         """Analisa a interação e retorna metadados para o LLM"""
+        # Tópicos detectados uma vez e compartilhados pelas etapas
+        topicos = self._detectar_topicos_chave(texto)
+
         # Atualiza estado emocional
-        self._atualizar_estado_emocional(texto, user_id)
+        self._atualizar_estado_emocional(texto, user_id, topicos)
 
         # Calcula diretrizes
-        diretrizes = self._determinar_diretrizes_comportamentais(texto)
+        estado = self.usuarios.obter(user_id)
+        diretrizes = self._determinar_diretrizes_comportamentais(texto, estado, topicos)
+
+        # Agregados do histórico recente, sem percorrê-lo
+        recentes = self.historico(user_id).agregados()
 
         # Prepara metadados
         return {
-            "tom_comportamental": self._calcular_tom_comportamental(),
+            "tom_comportamental": self._calcular_tom_comportamental(estado),
             "diretrizes": diretrizes,
-            "fadiga_mental": self.estados["fadiga_mental"],
-            "valencia_emocional": self.emocao["valencia"],
-            "ativacao_emocional": self.emocao["ativacao"],
-            "familiaridade_usuario": self.estados["familiaridade"].get(user_id, 0.1),
-            "probabilidade_sarcasmo": self.tendencias["sarcasmo"]["prob_base"] * self.estados["confianca_usuario"],
+            "fadiga_mental": estado["fadiga"],
+            "valencia_emocional": estado["valencia"],
+            "ativacao_emocional": estado["ativacao"],
+            "familiaridade_usuario": estado["familiaridade"],
+            "probabilidade_sarcasmo": self.tendencias["sarcasmo"]["prob_base"] * estado["confianca"],
             "probabilidade_filosofia": self.tendencias["filosofia"]["prob_base"] * self.big5["abertura"],
-            "estabilidade_emocional": self.emocao["estabilidade"]
+            "estabilidade_emocional": estado["estabilidade"],
+            "valencia_media": recentes["valencia_media"],
+            "ativacao_janela": recentes["ativacao_janela"],
+            "tendencia_valencia": recentes["tendencia"]
+        }
+
+    def estado_de(self, user_id="default"):
+        """Instantâneo do estado emocional do usuário (usado nos logs)"""
+        estado = self.usuarios.obter(user_id)
+        return {
+            **{k: estado[k] for k in self.emocao},
+            "fadiga_mental": estado["fadiga"],
+            "familiaridade": estado["familiaridade"],
+            "ultima_atualizacao": datetime.fromtimestamp(estado["ultima_interacao"])
         }
 
+    def exportar_usuario(self, user_id):
+        """Estado do usuário para persistência"""
+        historico = self.historicos.get(user_id)
+        return {
+            "estado": self.usuarios.obter(user_id),
+            "historico_emocional": historico.ultimos() if historico is not None else None
+        }
+
+    def restaurar_usuario(self, user_id, estado, historico_emocional=None):
+        """Recarrega o estado persistido de um usuário"""
+        self.usuarios.restaurar(user_id, estado)
+        if historico_emocional is not None:
+            historico = self.historicos[user_id] = EmotionRing(capacidade=100)
+            for registro in historico_emocional:
+                historico.adicionar(float(registro["valencia"]), float(registro["ativacao"]), float(registro["t"]))
+
+    def esquecer(self, user_id):
+        """Libera a memória de um usuário (o estado deve ter sido persistido antes)"""
+        self.usuarios.remover(user_id)
+        self.historicos.pop(user_id, None)
+
+    def ociosos(self, horas):
+        """Usuários sem interação há mais de `horas` horas"""
+        return self.usuarios.ociosos(time.time() - horas * 3600)
+
+    def manutencao(self):
+        """Decaimento e fadiga de todos os usuários de uma vez (chamado periodicamente)"""
+        agora = time.time()
+        self.usuarios.decair(agora)
+        self.usuarios.atualizar_fadiga(agora)
+
+    def construir_resposta(self, texto, user_id="default"):
+        """Contexto emocional compacto, em uma linha, para o prompt do bot"""
+        meta = self.analisar_interacao(texto, user_id)
+        contexto = (
+            f"tom {meta['tom_comportamental']}, "
+            f"valência {meta['valencia_emocional']:.2f}, "
+            f"ativação {meta['ativacao_emocional']:.2f}, "
+            f"humor {self._descrever_tendencia(meta['tendencia_valencia'])}"
+        )
+        if meta['diretrizes']:
+            contexto += ". " + "; ".join(meta['diretrizes'][:3])
+        return contexto
+
+    @staticmethod
+    def _descrever_tendencia(tendencia):
+        """Tendência da valência (por minuto) em palavras"""
+        if tendencia > 0.02:
+            return "melhorando"
+        if tendencia < -0.02:
+            return "piorando"
+        return "estável"
+
     def gerar_contexto_prompt(self, texto, user_id="default"):
         """Gera contexto formatado para inclusão no prompt do LLM"""
         meta = self.analisar_interacao(texto, user_id)
@@ -242,7 +366,9 @@ class Asteria:
             f"- Tom Comportamental: {meta['tom_comportamental']}\n"
             f"- Valência: {'Positiva' if meta['valencia_emocional'] > 0 else 'Negativa'}\n"
             f"- Ativação: {'Alta' if meta['ativacao_emocional'] > 0.5 else 'Baixa'}\n"
-            f"- Estabilidade: {int(meta['estabilidade_emocional']*100)}%\n\n"
+            f"- Estabilidade: {int(meta['estabilidade_emocional']*100)}%\n"
+            f"- Humor Recente: {self._descrever_tendencia(meta['tendencia_valencia'])} "
+            f"(valência média {meta['valencia_media']:.2f})\n\n"
             f"## Diretrizes Comportamentais\n"
         )
 
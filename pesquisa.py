@@ -1,91 +1,112 @@
 import aiohttp
 import asyncio
 from duckduckgo_search import AsyncDDGS
-import re
-from bs4 import BeautifulSoup
-from bs4.builder import ParserRejectedMarkup
 import logging
 
+from cache_pesquisa import SearchCache, cache_pesquisa, normalizar_consulta, normalizar_url
+from conexoes import gerenciador, SessionManager
+from extracao import extrair_pagina
+
 # Configuração de logging
 logger = logging.getLogger('Pesquisa')
 
-async def pesquisar_web(termo: str, max_results: int = 3, timeout: int = 4) -> str:
+async def pesquisar_web(termo: str, max_results: int = 3, timeout: int = 4, sessoes: SessionManager = None,
+                        cache: SearchCache = None) -> str:
     """
     Realiza pesquisa na web de forma assíncrona e otimizada.
-    Retorna resultados formatados em menos de 4 segundos.
+    Retorna resultados formatados em até `timeout` segundos (páginas atrasadas ficam com o snippet).
+    Consultas repetidas saem do cache; em timeout, usa um resultado vencido se houver.
     """
     try:
-        async with AsyncDDGS() as ddgs:
-            # Pesquisa principal com timeout
-            search_task = asyncio.create_task(
-                ddgs.text(termo, region='wt-wt', safesearch='moderate', max_results=max_results)
-            )
-
-            try:
-                resultados = await asyncio.wait_for(search_task, timeout=2.5)
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout na pesquisa: {termo}")
-                return "⌛ A pesquisa está demorando mais que o esperado. Tente mais tarde."
-
-            if not resultados:
-                return "🔍 Nenhum resultado encontrado."
-
-            # Processa os resultados em paralelo
-            tasks = [processar_resultado(resultado) for resultado in resultados[:max_results]]
-            resultados_processados = await asyncio.gather(*tasks)
-
-            # Formata a resposta final
-            return formatar_resposta(resultados_processados)
-
+        resultados_processados = await buscar_resultados(termo, max_results, sessoes, cache, prazo=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timeout na pesquisa: {termo}")
+        return "⌛ A pesquisa está demorando mais que o esperado. Tente mais tarde."
     except Exception as e:
         logger.error(f"Erro na pesquisa: {str(e)}", exc_info=True)
         return "⚠️ Ocorreu um erro durante a pesquisa."
 
-async def processar_resultado(resultado: dict) -> dict:
-    """Processa um resultado de pesquisa de forma otimizada"""
+    if not resultados_processados:
+        return "🔍 Nenhum resultado encontrado."
+
+    # Formata a resposta final
+    return formatar_resposta(resultados_processados)
+
+async def buscar_resultados(termo: str, max_results: int = 3, sessoes: SessionManager = None,
+                            cache: SearchCache = None, prazo: float = None) -> list:
+    """Resultados processados ({'url', 'title', 'content'}); asyncio.TimeoutError sem busca nem cache.
+
+    Com `prazo` (s), páginas que não ficam prontas a tempo entram com o snippet da busca.
+    """
+    cache = cache or cache_pesquisa
+    chave = f"{normalizar_consulta(termo)}|{max_results}"
+    loop = asyncio.get_running_loop()
+    limite = None if prazo is None else loop.time() + prazo
+    try:
+        # A busca continua em segundo plano (e vai para o cache) mesmo se o prazo vencer
+        resultados = await asyncio.wait_for(cache.buscar(
+            "busca", chave,
+            lambda: asyncio.wait_for(_buscar_ddg(termo, max_results), timeout=2.5)
+        ), timeout=None if prazo is None else min(2.5, prazo))
+    except asyncio.TimeoutError:
+        resultados = await cache.obter("busca", chave, vencido=True)
+        if resultados is None:
+            raise
+        logger.info(f"♻️ Timeout na pesquisa, usando resultado em cache: {termo}")
+
+    if not resultados:
+        return []
+
+    # Processa os resultados em paralelo, no tempo que sobrou do prazo
+    restante = None if limite is None else max(0.1, limite - loop.time())
+    tasks = [processar_resultado(resultado, sessoes, cache, restante) for resultado in resultados[:max_results]]
+    return await asyncio.gather(*tasks)
+
+async def _buscar_ddg(termo: str, max_results: int) -> list:
+    async with AsyncDDGS() as ddgs:
+        return await ddgs.text(termo, region='wt-wt', safesearch='moderate', max_results=max_results)
+
+async def processar_resultado(resultado: dict, sessoes: SessionManager = None, cache: SearchCache = None,
+                              prazo: float = None) -> dict:
+    """Processa um resultado de pesquisa de forma otimizada; página fora do `prazo` fica com o snippet"""
     url = resultado.get('href') or resultado.get('url', '')
     title = resultado.get('title', 'Sem título')
     snippet = resultado.get('body', resultado.get('description', 'Sem descrição'))
 
     # Se já temos snippet suficiente, não acessa a página
-    if len(snippet) > 150:
+    if len(snippet) > 150 or not url:
         return {'url': url, 'title': title, 'content': snippet[:300]}
 
-    # Tenta obter conteúdo da página com timeout
+    async def extrair():
+        # Tenta obter conteúdo da página com timeout (sessão e conexões compartilhadas)
+        # O corpo é analisado em streaming fora do event loop e a leitura para com texto suficiente
+        try:
+            status, texto = await extrair_pagina(sessoes or gerenciador, url, limite=500, timeout=1.5)
+            if status == 200 and texto:
+                return {'url': url, 'title': title, 'content': texto}
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.warning(f"Erro na extração de {url}: {str(e)}")
+        # None não é guardado: a página é tentada de novo na próxima pesquisa
+        return None
+
+    # Qualquer falha nesta página (cache incluído) fica neste resultado: os demais seguem no gather
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1.5)) as session:
-            async with session.get(url, headers={'User-Agent': 'Mozilla/5.0'}) as response:
-                if response.status == 200:
-                    html = await response.text()
-                    return extract_meaningful_content(url, title, html)
-    except Exception:
-        pass
+        # Com o prazo vencido a extração segue em segundo plano e fica no cache para a próxima vez
+        pagina = await asyncio.wait_for(
+            (cache or cache_pesquisa).buscar("pagina", normalizar_url(url), extrair), timeout=prazo
+        )
+    except asyncio.TimeoutError:
+        pagina = None
+    except Exception as e:
+        logger.warning(f"Erro ao processar {url}: {str(e)}")
+        pagina = None
+    if pagina is not None:
+        return pagina
 
     return {'url': url, 'title': title, 'content': snippet[:300]}
 
-def extract_meaningful_content(url: str, title: str, html: str) -> dict:
-    """Extrai conteúdo relevante de forma otimizada"""
-    try:
-        soup = BeautifulSoup(html, 'lxml')
-
-        # Remove elementos indesejados
-        for tag in soup(['script', 'style', 'nav', 'footer', 'aside']):
-            tag.decompose()
-
-        # Tenta encontrar o conteúdo principal
-        article = soup.find('article') or soup.find('main') or soup.body
-
-        # Limita a extração a 500 caracteres
-        text = article.get_text(separator=' ', strip=True) if article else ''
-        clean_text = re.sub(r'\s+', ' ', text)[:500]
-
-        return {'url': url, 'title': title, 'content': clean_text + '...' if len(clean_text) == 500 else clean_text}
-
-    except ParserRejectedMarkup:
-        return {'url': url, 'title': title, 'content': 'Conteúdo não processável'}
-    except Exception:
-        return {'url': url, 'title': title, 'content': 'Erro na extração de conteúdo'}
-
 def formatar_resposta(resultados: list) -> str:
     """Formata os resultados para o Discord com emojis e limitando tamanho"""
     resposta = []
@@ -98,3 +119,8 @@ def formatar_resposta(resultados: list) -> str:
             )
 
     return "\n\n" + "\n\n".join(resposta) if resposta else "Nenhum conteúdo útil encontrado."
+
+async def encerrar():
+    """Fecha as conexões HTTP compartilhadas e o cache em disco (chamar no desligamento)"""
+    await gerenciador.fechar()
+    cache_pesquisa.fechar()
@@ -0,0 +1,322 @@
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+import psutil
+
+from inferencia import InferenceWorker, _FIM, com_complemento, prefill
+from metricas import metricas
+
+logger = logging.getLogger('Pool')
+
+def _dividir_cpus(n_processos: int) -> list:
+    """Divide os núcleos físicos em fatias contíguas, uma por processo"""
+    fisicos = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    disponiveis = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(fisicos))
+
+    # Em geral os primeiros IDs lógicos correspondem a um thread por núcleo físico
+    cpus = disponiveis[:fisicos]
+    tamanho = max(1, len(cpus) // n_processos)
+    return [cpus[i * tamanho:(i + 1) * tamanho] or cpus for i in range(n_processos)]
+
+def _processo_worker(indice: int, config: dict, cpus: list, conexao, resultados, especulacao: dict = None):
+    """Processo de inferência: um `Llama` mapeando o mesmo GGUF (page cache compartilhado)"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    try:
+        from llama_cpp import Llama
+        from especulativo import criar_rascunho, vocabulario_compativel
+        if especulacao and especulacao.get("parametros_rascunho"):
+            # O rascunho alterna com o modelo principal: usa a mesma fatia de núcleos
+            especulacao["parametros_rascunho"]["n_threads"] = len(cpus) or 1
+        rascunho = criar_rascunho(especulacao or {})
+        model = Llama(
+            **{**config, "n_threads": len(cpus) or 1, "use_mmap": True, "use_mlock": False}, draft_model=rascunho
+        )
+        if not vocabulario_compativel(model, rascunho):
+            model.draft_model = None
+    except Exception as e:
+        # Sem job_id: o worker inteiro ficou indisponível
+        resultados.put((indice, None, "erro", f"falha ao carregar o modelo: {str(e)}"))
+        return
+    resultados.put((indice, None, "pronto", os.getpid()))
+    enviado = {"chamadas": 0, "propostos": 0, "aceitos": 0}  # Contagens do rascunho já repassadas
+
+    while True:
+        mensagem = conexao.recv()
+        if mensagem is None:
+            break
+        if mensagem[0] != "gerar":
+            continue  # Cancelamento de um pedido já concluído
+
+        _, job_id, prompt, params = mensagem
+        complemento = params.pop("complemento", None)
+        try:
+            if complemento is not None:
+                # Prefill da parte estática enquanto o complemento não chega pelo pipe
+                prefill(model, prompt)
+                texto, cancelado = "", False
+                limite = time.monotonic() + complemento["prazo"]
+                while True:
+                    restante = limite - time.monotonic()
+                    if restante <= 0 or not conexao.poll(restante):
+                        break
+                    controle = conexao.recv()
+                    if controle is None:
+                        return
+                    if controle[1] != job_id:
+                        continue  # Complemento ou cancelamento atrasado de um pedido anterior
+                    if controle[0] == "cancelar":
+                        cancelado = True
+                        break
+                    if controle[0] == "complemento":
+                        texto = controle[2]
+                        break
+                if cancelado:
+                    resultados.put((indice, job_id, "fim", None))
+                    continue
+                prompt = com_complemento(model, prompt, texto, complemento["orcamento"], complemento["sufixo"])
+
+            stream = model.create_completion(prompt, stream=True, **params)
+            for output in stream:
+                # Cancelamento chega pelo pipe entre tokens
+                if conexao.poll():
+                    controle = conexao.recv()
+                    if controle is None:
+                        return
+                    if controle[0] == "cancelar" and controle[1] == job_id:
+                        break
+                resultados.put((indice, job_id, "token", output['choices'][0]['text']))
+            stream.close()
+        except Exception as e:
+            resultados.put((indice, job_id, "erro", str(e)))
+
+        # As métricas do rascunho ficam neste processo: o pai recebe a diferença de cada pedido
+        if hasattr(model.draft_model, "estatisticas"):
+            atual = model.draft_model.estatisticas()
+            if atual["chamadas"] > enviado["chamadas"]:
+                resultados.put((indice, None, "rascunho", {
+                    "modo": atual["modo"], **{k: atual[k] - enviado[k] for k in enviado}
+                }))
+                enviado = {k: atual[k] for k in enviado}
+        resultados.put((indice, job_id, "fim", None))
+
+class ModelPool(InferenceWorker):
+    """Pool de processos de inferência com despachante para workers ociosos.
+
+    Cada processo recebe sua fatia dos núcleos físicos; com `use_mmap` os pesos ficam no
+    page cache e são compartilhados, então só o cache KV cresce com o número de workers.
+    """
+    def __init__(self, config: dict, n_processos: int = 2, especulacao: dict = None):
+        super().__init__(carregar_modelo=None)
+        self.config = config
+        self.n_processos = n_processos
+        self.especulacao = especulacao  # ModelRegistry.especulacao: rascunho criado em cada processo
+
+        self._contexto = mp.get_context("spawn")
+        self._processos = []
+        self._conexoes = []
+        self._locks_conexao = []
+        self._resultados = None
+        self._leitor = None
+
+        self._ociosos = queue.Queue()
+        self._mortos = set()        # Workers que falharam ao carregar ou encerraram
+        self._rascunho = None       # Aceitação do rascunho somada de todos os processos
+        self._parando = False
+        self._em_andamento = {}     # {job_id: [pedido, indice, cancelamento_enviado, ultimo_evento, tokens]}
+        self._ids = itertools.count()
+        self._atendidos = [0] * n_processos
+
+    def iniciar(self):
+        with self._lock:
+            if not self._processos:
+                self._iniciar_processos()
+        super().iniciar()
+
+    def parar(self, timeout: float = 5.0):
+        self._parando = True
+        super().parar(timeout)
+        for i, conexao in enumerate(self._conexoes):
+            self._enviar(i, None)
+        for processo in self._processos:
+            processo.join(timeout)
+            if processo.is_alive():
+                processo.terminate()
+        if self._resultados is not None:
+            self._resultados.put((None, None, "parar", None))
+            self._leitor.join(timeout)
+
+    def estatisticas(self) -> dict:
+        rascunho = None
+        if self._rascunho is not None:
+            propostos = self._rascunho["propostos"]
+            rascunho = {**self._rascunho, "taxa_aceitacao": self._rascunho["aceitos"] / propostos if propostos else 0.0}
+        return {
+            "rascunho": rascunho,
+            "processos": self.n_processos,
+            "ociosos": self._ociosos.qsize(),
+            "indisponiveis": len(self._mortos),
+            "em_andamento": len(self._em_andamento),
+            "atendidos_por_processo": list(self._atendidos)
+        }
+
+    def _iniciar_processos(self):
+        self._resultados = self._contexto.Queue()
+        for indice, cpus in enumerate(_dividir_cpus(self.n_processos)):
+            pai, filho = self._contexto.Pipe()
+            processo = self._contexto.Process(
+                target=_processo_worker,
+                args=(indice, self.config, cpus, filho, self._resultados, self.especulacao),
+                name=f"inferencia-{indice}",
+                daemon=True
+            )
+            processo.start()
+            self._processos.append(processo)
+            self._conexoes.append(pai)
+            self._locks_conexao.append(threading.Lock())
+            logger.info(f"🧵 Worker {indice} iniciado (PID {processo.pid}) nos CPUs {cpus}")
+
+        self._leitor = threading.Thread(target=self._ler_resultados, name="pool-resultados", daemon=True)
+        self._leitor.start()
+
+    def _enviar(self, indice: int, mensagem):
+        try:
+            with self._locks_conexao[indice]:
+                self._conexoes[indice].send(mensagem)
+        except (OSError, ValueError):
+            pass  # Processo já encerrado
+
+    def _executar(self):
+        """Despachante: entrega cada pedido ao próximo worker ocioso"""
+        while True:
+            pedido = self._pedidos.get()
+            if pedido is None:
+                break
+            if pedido.cancelado.is_set():
+                self._entregar(pedido, _FIM)
+                continue
+
+            indice = self._proximo_ocioso(pedido)
+            if indice is None:
+                if not pedido.cancelado.is_set():
+                    self._entregar(pedido, RuntimeError("Nenhum worker de inferência disponível"))
+                self._entregar(pedido, _FIM)
+                continue
+            job_id = next(self._ids)
+            self._em_andamento[job_id] = [pedido, indice, False, time.perf_counter(), 0]
+            params = {
+                "max_tokens": pedido.max_tokens,
+                "temperature": pedido.temperature,
+                "stop": pedido.stop
+            }
+            if pedido.complemento is not None:
+                params["complemento"] = {
+                    "prazo": pedido.prazo_complemento,
+                    "orcamento": pedido.orcamento_complemento,
+                    "sufixo": pedido.sufixo
+                }
+            self._enviar(indice, ("gerar", job_id, pedido.prompt, params))
+            if pedido.complemento is not None:
+                # O texto segue para o processo assim que chega (ou vazio, se o pedido for cancelado)
+                pedido.complemento.add_done_callback(
+                    lambda _, indice=indice, job_id=job_id, pedido=pedido: self._enviar(
+                        indice, ("complemento", job_id, pedido.texto_complemento(timeout=0))
+                    )
+                )
+
+    def _proximo_ocioso(self, pedido):
+        """Próximo worker ocioso e vivo; None se todos estão indisponíveis ou o pedido foi cancelado"""
+        while len(self._mortos) < self.n_processos:
+            try:
+                indice = self._ociosos.get(timeout=0.5)
+            except queue.Empty:
+                if pedido.cancelado.is_set():
+                    return None
+                continue
+            if indice not in self._mortos:
+                return indice
+        return None
+
+    def _ler_resultados(self):
+        while True:
+            try:
+                indice, job_id, tipo, valor = self._resultados.get(timeout=1.0)
+            except queue.Empty:
+                self._verificar_processos()
+                continue
+            except (EOFError, OSError):
+                break  # Fila encerrada junto com o processo
+            if tipo == "parar":
+                break
+            if tipo == "pronto":
+                logger.info(f"✅ Worker {indice} pronto (PID {valor})")
+                self._ociosos.put(indice)
+                continue
+            if tipo == "erro" and job_id is None:
+                self._worker_indisponivel(indice, valor)
+                continue
+            if tipo == "rascunho":
+                self._somar_rascunho(valor)
+                continue
+
+            andamento = self._em_andamento.get(job_id)
+            if andamento is None:
+                continue
+            pedido = andamento[0]
+
+            if tipo == "token":
+                agora = time.perf_counter()
+                metricas.estagio("decode_token" if andamento[4] else "prefill", agora - andamento[3])
+                andamento[3], andamento[4] = agora, andamento[4] + 1
+                if not pedido.cancelado.is_set():
+                    self._entregar(pedido, valor)
+                elif not andamento[2]:
+                    andamento[2] = True
+                    self._enviar(indice, ("cancelar", job_id))
+            elif tipo == "erro":
+                logger.error(f"🔴 Erro no worker {indice}: {valor}")
+                metricas.erro("inferencia")
+                self._entregar(pedido, RuntimeError(valor))
+            elif tipo == "fim":
+                del self._em_andamento[job_id]
+                self._atendidos[indice] += 1
+                self._entregar(pedido, _FIM)
+                self._ociosos.put(indice)
+
+    def _somar_rascunho(self, delta: dict):
+        """Acumula as contagens do rascunho de um processo e as exporta nas métricas deste"""
+        if self._rascunho is None:
+            self._rascunho = {"modo": delta["modo"], "chamadas": 0, "propostos": 0, "aceitos": 0}
+        for chave in ("chamadas", "propostos", "aceitos"):
+            self._rascunho[chave] += delta[chave]
+        metricas.incrementar(
+            "rascunho_tokens_total", delta["propostos"], "Tokens do rascunho verificados", modo=delta["modo"]
+        )
+        metricas.incrementar("rascunho_aceitos_total", delta["aceitos"], "Tokens do rascunho aceitos", modo=delta["modo"])
+
+    def _verificar_processos(self):
+        """Processos que morreram sem avisar (ex.: falta de memória) deixam de receber pedidos"""
+        if self._parando:
+            return
+        for indice, processo in enumerate(self._processos):
+            if indice not in self._mortos and not processo.is_alive():
+                self._worker_indisponivel(indice, f"processo encerrado (código {processo.exitcode})")
+
+    def _worker_indisponivel(self, indice: int, motivo: str):
+        """Marca o worker como indisponível e falha o pedido que estava com ele"""
+        self._mortos.add(indice)
+        logger.error(f"🔴 Worker {indice} indisponível: {motivo}")
+        metricas.erro("pool")
+        for job_id, andamento in list(self._em_andamento.items()):
+            if andamento[1] == indice:
+                del self._em_andamento[job_id]
+                self._entregar(andamento[0], RuntimeError(f"Worker {indice} indisponível: {motivo}"))
+                self._entregar(andamento[0], _FIM)
+        if len(self._mortos) == self.n_processos:
+            logger.error("🔴 Nenhum worker de inferência disponível; os pedidos falham até reiniciar")
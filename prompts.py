@@ -0,0 +1,99 @@
+import re
+
+from empacotador import HISTORICO, INSTRUCAO, MEMORIAS, MENSAGEM, PERSONA
+
+# Montagem do prompt do bot, compartilhada com o benchmark
+INSTRUCOES = {
+    "pt": "Você é Astéria. Responda em português de forma natural e concisa.",
+    "en": "You are Astéria. Reply in natural, concise English."
+}
+INSTRUCAO_PADRAO = "You are Astéria. Reply naturally in the user's language."
+MARCADOR_RESPOSTA = "Astéria:"
+
+# "pesquise sobre X", "procura: X", "search for X"... pedem uma resposta com pesquisa web
+_PEDIDO_PESQUISA = re.compile(
+    r"^\s*(?:pesquis[ae]r?|procur[ae]r?|busc[ae]r?|search|look\s+up|google)"
+    r"(?:\s+(?:sobre|por|for|about))?\s*[:,-]?\s+(?P<termo>\S.*)$",
+    re.IGNORECASE | re.DOTALL
+)
+
+def instrucao_para(idioma: str) -> str:
+    return INSTRUCOES.get(idioma[:2], INSTRUCAO_PADRAO)
+
+def nota_criador(nome: str) -> str:
+    return f"\nNota: Este usuário é meu criador, {nome}."
+
+def atualizar_historico(historico: dict, user_id, mensagem: str, max_history: int) -> list:
+    """Acrescenta a mensagem ao histórico do usuário e devolve a janela recente"""
+    if user_id not in historico:
+        historico[user_id] = []
+
+    historico[user_id].append(mensagem)
+
+    # Mantém apenas as últimas mensagens
+    if len(historico[user_id]) > max_history:
+        historico[user_id] = historico[user_id][-max_history:]
+
+    return historico[user_id]
+
+def partes_do_prompt(instrucao: str, nota: str, historico: list, contexto_emocional: str, memorias: str = "") -> list:
+    """Partes do prompt na ordem final, com prioridade e se podem ser cortadas (ver PromptPacker).
+
+    A última entrada do histórico é a mensagem atual. Partes estáveis vêm primeiro para
+    maximizar o prefixo reaproveitado do cache de sessão; as lembranças mudam a cada mensagem.
+    """
+    *anteriores, mensagem = historico or [""]
+    return [
+        (instrucao, INSTRUCAO, True),
+        (nota, INSTRUCAO, False),
+        *[(linha, HISTORICO, False) for linha in anteriores],
+        (memorias, MEMORIAS, True),
+        (mensagem, MENSAGEM, True),
+        (f"Contexto emocional: {contexto_emocional}", PERSONA, True)
+    ]
+
+def montar_prefixo(instrucao: str, nota: str, historico: list, contexto_emocional: str, memorias: str = "",
+                   empacotador=None, orcamento: int = None) -> str:
+    """Parte estática do prompt (tudo antes da resposta), terminada em quebra de linha.
+
+    Com `empacotador`, só entram as partes que cabem em `orcamento` tokens, por prioridade.
+    """
+    partes = partes_do_prompt(instrucao, nota, historico, contexto_emocional, memorias)
+    if empacotador is None:
+        return "\n".join(texto for texto, _, _ in partes if texto) + "\n"
+    return empacotador.empacotar(partes, orcamento) + "\n"
+
+def montar_prompt(instrucao: str, nota: str, historico: list, contexto_emocional: str, memorias: str = "",
+                  empacotador=None, orcamento: int = None) -> str:
+    """Prompt completo, terminado no marcador da resposta"""
+    if empacotador is not None:
+        orcamento = (orcamento or empacotador.orcamento) - empacotador.contar(MARCADOR_RESPOSTA) - 1
+    return montar_prefixo(
+        instrucao, nota, historico, contexto_emocional, memorias, empacotador, orcamento
+    ) + MARCADOR_RESPOSTA
+
+def bloco_memorias(lembrancas: list, limite: int = 400) -> str:
+    """Trocas anteriores relevantes, na ordem de relevância, até `limite` caracteres"""
+    linhas, total = [], 0
+    for lembranca in lembrancas:
+        linha = f"- Usuário: {lembranca['entrada']} | Astéria: {lembranca['resposta']}"
+        if total + len(linha) > limite:
+            if linhas:
+                break
+            linha = linha[:limite - 3] + "..."
+        linhas.append(linha)
+        total += len(linha)
+    return "Conversas anteriores:\n" + "\n".join(linhas) if linhas else ""
+
+def termo_de_pesquisa(mensagem: str):
+    """Termo a pesquisar se a mensagem pede uma pesquisa, senão None"""
+    encontrado = _PEDIDO_PESQUISA.match(mensagem)
+    return encontrado.group("termo").strip() if encontrado else None
+
+def bloco_pesquisa(resultados: list) -> str:
+    """Resultados da pesquisa web como contexto para o modelo"""
+    linhas = [
+        f"- {r['title']}: {r['content']}"
+        for r in resultados if r.get('content')
+    ]
+    return "Resultados da pesquisa:\n" + "\n".join(linhas) + "\n" if linhas else ""
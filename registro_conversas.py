@@ -0,0 +1,258 @@
+import atexit
+import glob
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import date, datetime
+
+from metricas import metricas
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('Logs')
+
+LOG_DIR = os.getenv("ASTERIA_LOG_DIR", "logs")
+ROTACAO = os.getenv("ASTERIA_LOG_ROTACAO", "diaria")          # "diaria" ou "tamanho" (diária + limite de tamanho)
+MAX_MB = float(os.getenv("ASTERIA_LOG_MAX_MB", "64"))
+COMPRESSAO = os.getenv("ASTERIA_LOG_COMPRESSAO") or None      # None, "gzip" ou "zstd" (arquivos rotacionados)
+FSYNC = os.getenv("ASTERIA_LOG_FSYNC", "lote")                # "nunca", "lote" ou "rotacao"
+
+_FIM = object()
+
+class ConversationLog:
+    """Escritor de logs JSONL em thread de fundo: fila limitada, gravação em lotes e rotação"""
+    def __init__(self, padrao: str, diretorio: str = LOG_DIR, rotacao: str = ROTACAO,
+                 max_mb: float = MAX_MB, compressao: str = COMPRESSAO, fsync: str = FSYNC,
+                 capacidade: int = 10000, lote: int = 64, intervalo: float = 2.0):
+        self.padrao = padrao  # strftime, ex.: "conversas_%Y%m%d.jsonl"
+        self.diretorio = diretorio
+        self.rotacao = rotacao
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.compressao = compressao
+        self.fsync = fsync
+        self.lote = lote
+        self.intervalo = intervalo
+
+        if compressao == "zstd" and zstandard is None:
+            logger.warning("⚠️ zstandard não instalado, usando gzip nos logs rotacionados")
+            self.compressao = "gzip"
+
+        self._fila = queue.Queue(maxsize=capacidade)
+        self._thread = None
+        self._arquivo = None
+        self._caminho = None
+        self.descartados = 0
+
+    def iniciar(self):
+        if self._thread is None:
+            os.makedirs(self.diretorio, exist_ok=True)
+            self._thread = threading.Thread(target=self._executar, name=f"logs-{self.padrao}", daemon=True)
+            self._thread.start()
+            atexit.register(self.fechar)
+
+    def registrar(self, entrada: dict) -> bool:
+        """Enfileira sem bloquear; com a fila cheia a entrada é descartada"""
+        try:
+            self._fila.put_nowait(entrada)
+            return True
+        except queue.Full:
+            self.descartados += 1
+            metricas.incrementar("logs_descartados_total", ajuda="Entradas de log descartadas com a fila cheia")
+            return False
+
+    def fechar(self, timeout: float = 10.0):
+        """Drena a fila, grava o restante e fecha o arquivo"""
+        if self._thread is None:
+            return
+        self._fila.put(_FIM)
+        self._thread.join(timeout)
+        self._thread = None
+        atexit.unregister(self.fechar)
+
+    def _executar(self):
+        pendentes = []
+        prazo = time.monotonic() + self.intervalo
+        while True:
+            try:
+                item = self._fila.get(timeout=max(0.0, prazo - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _FIM:
+                if pendentes:
+                    self._gravar(pendentes)
+                self._fechar_arquivo(rotacionado=False)
+                return
+
+            if item is not None:
+                pendentes.append(item)
+
+            # Grava por tamanho do lote ou por tempo desde a última gravação
+            if len(pendentes) >= self.lote or time.monotonic() >= prazo:
+                if pendentes:
+                    self._gravar(pendentes)
+                    pendentes = []
+                prazo = time.monotonic() + self.intervalo
+
+    def _gravar(self, entradas: list):
+        inicio = time.perf_counter()
+        try:
+            linhas = "".join(json.dumps(e, ensure_ascii=False, default=_serializar) + "\n" for e in entradas)
+            self._abrir_atual()
+            self._arquivo.write(linhas)
+            self._arquivo.flush()
+            if self.fsync == "lote":
+                os.fsync(self._arquivo.fileno())
+
+            if self.rotacao == "tamanho" and self._arquivo.tell() >= self.max_bytes:
+                self._fechar_arquivo(rotacionado=True)
+            logger.debug(f"📝 {len(entradas)} entradas gravadas em {self._caminho}")
+        except Exception as e:
+            logger.error(f"Erro ao salvar logs: {str(e)}")
+            metricas.erro("log_flush")
+        finally:
+            metricas.estagio("log_flush", time.perf_counter() - inicio)
+
+    def _abrir_atual(self):
+        caminho = os.path.join(self.diretorio, datetime.now().strftime(self.padrao))
+        if caminho == self._caminho and self._arquivo is not None:
+            return
+
+        # Virada do dia: o arquivo anterior está completo
+        if self._arquivo is not None:
+            self._fechar_arquivo(rotacionado=True)
+        self._caminho = caminho
+        self._arquivo = open(caminho, "a", encoding="utf-8")
+
+    def _fechar_arquivo(self, rotacionado: bool):
+        if self._arquivo is None:
+            return
+        if self.fsync in ("lote", "rotacao"):
+            os.fsync(self._arquivo.fileno())
+        self._arquivo.close()
+        self._arquivo = None
+
+        if rotacionado:
+            caminho = self._caminho
+            if self.rotacao == "tamanho":
+                caminho = self._renomear_parte(caminho)
+            if self.compressao:
+                self._comprimir(caminho)
+        self._caminho = None
+
+    def _renomear_parte(self, caminho: str) -> str:
+        """conversas_20240101.jsonl -> conversas_20240101.1.jsonl (próximo índice livre)"""
+        base, extensao = os.path.splitext(caminho)
+        parte = 1
+        while glob.glob(f"{glob.escape(base)}.{parte}{extensao}*"):
+            parte += 1
+        destino = f"{base}.{parte}{extensao}"
+        os.replace(caminho, destino)
+        return destino
+
+    def _comprimir(self, caminho: str):
+        if not os.path.exists(caminho):
+            return
+        try:
+            if self.compressao == "zstd":
+                destino = caminho + ".zst"
+                with open(caminho, "rb") as origem, open(destino, "wb") as saida:
+                    zstandard.ZstdCompressor().copy_stream(origem, saida)
+            else:
+                destino = caminho + ".gz"
+                with open(caminho, "rb") as origem, gzip.open(destino, "wb") as saida:
+                    shutil.copyfileobj(origem, saida)
+            os.remove(caminho)
+            logger.info(f"🗜️ Log rotacionado: {destino}")
+        except OSError as e:
+            logger.error(f"Erro ao comprimir {caminho}: {str(e)}")
+            metricas.erro("log_compressao")
+
+def _serializar(valor):
+    # datetime/date (ex.: ultima_atualizacao do estado emocional) e tipos NumPy
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if hasattr(valor, "item"):
+        return valor.item()
+    return str(valor)
+
+def abrir(caminho: str, binario: bool = False):
+    """Abre um log, descomprimindo .gz/.zst de forma transparente"""
+    if caminho.endswith(".gz"):
+        return gzip.open(caminho, "rb") if binario else gzip.open(caminho, "rt", encoding="utf-8")
+    if caminho.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard necessário para ler {caminho}")
+        bruto = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(caminho, "rb")))
+        return bruto if binario else io.TextIOWrapper(bruto, encoding="utf-8")
+    return open(caminho, "rb") if binario else open(caminho, encoding="utf-8")
+
+def arquivos_de_log(diretorio: str = LOG_DIR) -> list:
+    """Logs do bot (conversas_*) e da CLI (conversa_*), incluindo partes rotacionadas"""
+    arquivos = sorted(glob.glob(os.path.join(diretorio, "conversas_*.jsonl*")))
+    arquivos += sorted(glob.glob(os.path.join(diretorio, "conversa_*.jsonl*")))
+    return arquivos
+
+def ler_registros(diretorio: str = LOG_DIR):
+    """Registros de todos os logs, na ordem dos arquivos; linhas inválidas são ignoradas"""
+    for arquivo in arquivos_de_log(diretorio):
+        with abrir(arquivo) as f:
+            for linha in f:
+                try:
+                    yield json.loads(linha)
+                except ValueError:
+                    continue
+
+def linhas_novas(caminho: str, estado: dict):
+    """Linhas completas de um log ainda não lidas, segundo `estado` ({"arquivos": {}, "assinaturas": {}}).
+
+    O estado é atualizado quando a leitura termina: arquivos que crescem continuam do último
+    offset e partes rotacionadas/comprimidas não são relidas (a primeira linha identifica o conteúdo).
+    """
+    info = os.stat(caminho)
+    registro = estado["arquivos"].get(caminho)
+    if registro and registro["tamanho"] == info.st_size and registro["mtime"] == info.st_mtime:
+        return
+
+    comprimido = caminho.endswith((".gz", ".zst"))
+    with abrir(caminho, binario=True) as f:
+        primeira = f.readline()
+        if not primeira.endswith(b"\n"):
+            return  # Arquivo vazio ou primeira linha ainda sendo gravada
+        assinatura = hashlib.sha1(primeira).hexdigest()
+        lidas = estado["assinaturas"].get(assinatura, 0)
+
+        if not comprimido and registro and registro["assinatura"] == assinatura:
+            # Mesmo arquivo crescendo: continua do último offset
+            f.seek(registro["bytes"])
+            offset, contador = registro["bytes"], registro["linhas"]
+        else:
+            f.seek(0)
+            offset, contador = 0, 0
+
+        for linha in f:
+            if not linha.endswith(b"\n"):
+                break  # Linha parcial: fica para a próxima leitura
+            offset += len(linha)
+            contador += 1
+            if contador > lidas:
+                yield linha
+
+    estado["assinaturas"][assinatura] = max(lidas, contador)
+    estado["arquivos"][caminho] = {
+        "assinatura": assinatura,
+        "bytes": offset,
+        "linhas": contador,
+        "tamanho": info.st_size,
+        "mtime": info.st_mtime
+    }